@@ -0,0 +1,191 @@
+"""
+Compare single-pass BGE-M3 hybrid retrieval against the BM25 + BGE pair.
+
+Both pipelines are timed per query, end to end:
+
+    pair:   underthesea tokenize + BM25 (search.py) + BGE encode + FAISS (predict_bge.py)
+            + product_rank fusion
+    hybrid: one BGE-M3 encode (dense + lexical weights) + FAISS + sparse index
+            + fusion in process (bge_m3_hybrid.py, --hybrid_fusion)
+
+and scored with macro F2 (utils/evaluate.py) on the same questions.
+
+Real models:
+    python benchmark/compare_m3_hybrid.py --path_test data/processed/test.json \
+        --path_chunk data/processed/chunked/chunk_corpus.json \
+        --path_bm25 retrieve/sparse/bm25_model.pkl --path_index bge.bin --path_meta corpus_meta.pkl \
+        --path_bge <bge checkpoint> --path_m3 <bge-m3 checkpoint> --index_dir <hybrid index dir>
+
+Synthetic corpus + stub encoders (no torch needed, only checks the plumbing
+and the non-model part of the latency):
+    python benchmark/compare_m3_hybrid.py --stub --num_questions 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmark.run_benchmark import _load_json, summarize, timed_calls  # noqa: E402
+from utils.evaluate import compute_macro_f2, load_ground_truth, predictions_from_results  # noqa: E402
+
+
+def run_pair(queries, bm25_model, chunk_ids, bge_model, index, meta, args):
+    """BM25 + BGE + product_rank, one query at a time. Returns (results, latencies)."""
+    from retrieve.dense.predict_bge import search_and_build_results
+    from retrieve.sparse.search import search_questions
+    from utils.ensemble_with_bm25 import fuse_product_rank
+
+    results = []
+
+    def one(q):
+        bm25 = search_questions([q], bm25_model, chunk_ids, top_n=args.bm25_topn, show_progress=False)[0]
+        dense = search_and_build_results([q], bge_model, index, meta, topk=args.dense_topk)[0]
+        bm25_map = {c["chunk_id"]: c["score"] for c in bm25["top_chunks"]}
+        dense_map = {c["chunk_id"]: c["score"] for c in dense["top_chunks"]}
+        rank_map = {c["chunk_id"]: r for r, c in enumerate(dense["top_chunks"], start=1)}
+        topk = fuse_product_rank(dense_map, bm25_map, rank_map, 1.0, 1.0, args.fusion_k)
+        results.append({"qid": q["qid"], "top_chunks": [{"chunk_id": c, "score": s} for c, s in topk]})
+
+    return results, timed_calls(queries, one)
+
+
+def run_hybrid(queries, searcher, args):
+    """One BGE-M3 encode per query. Returns (results, latencies)."""
+    results = []
+
+    def one(q):
+        results.extend(searcher.search(
+            [q], dense_topk=args.dense_topk, sparse_topn=args.bm25_topn, K=args.fusion_k,
+            fusion=args.hybrid_fusion, batch_size=1
+        ))
+
+    return results, timed_calls(queries, one)
+
+
+def hybrid_index_matches(index_dir: str, chunks, dim: int) -> bool:
+    """True if index_dir holds a hybrid index of exactly these chunks with this dimension."""
+    from retrieve.dense.bge_m3_hybrid import MANIFEST, corpus_signature
+
+    path = os.path.join(index_dir, MANIFEST)
+    if not os.path.exists(path):
+        return False
+    manifest = _load_json(path)
+    return (manifest.get("dim") == dim and manifest.get("num_chunks") == len(chunks)
+            and manifest.get("corpus_sha1") == corpus_signature(chunks))
+
+
+def prepare_stub(args):
+    """Synthetic data, BM25 model, stub BGE index and stub hybrid index in a work dir."""
+    import faiss
+    import numpy as np
+    from benchmark.run_benchmark import ensure_bm25_model, ensure_chunks
+    from benchmark.stub_encoder import HashingEncoder, HashingM3Encoder
+    from benchmark.synthetic_data import write_dataset
+    from retrieve.dense.bge_m3_hybrid import build_hybrid_index
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="vlsp_m3_")
+    data_dir = os.path.join(work_dir, "data")
+    paths = write_dataset(out_dir=data_dir, num_laws=args.num_laws, num_questions=args.num_questions, seed=args.seed)
+    ctx = {"data_dir": data_dir, "paths": paths}
+    args.path_test = paths["test"]
+    args.path_chunk = ensure_chunks(ctx)
+    args.path_bm25 = ensure_bm25_model(ctx)
+    chunks = _load_json(args.path_chunk)
+
+    bge_model = HashingEncoder(dim=args.dim)
+    index = faiss.IndexFlatIP(args.dim)
+    index.add(np.ascontiguousarray(
+        bge_model.encode([c["content_Article"] for c in chunks], normalize_embeddings=True), dtype=np.float32
+    ))
+    meta = [(c["aid"], c["chunk_id"]) for c in chunks]
+
+    m3_model = HashingM3Encoder(dim=args.dim)
+    args.index_dir = os.path.join(work_dir, "m3_hybrid")
+    # Work dir dùng lại được giữa các lần chạy, nhưng chỉ khi index khớp --dim và corpus hiện tại
+    if not hybrid_index_matches(args.index_dir, chunks, args.dim):
+        build_hybrid_index(chunks, m3_model, args.index_dir)
+    return bge_model, index, meta, m3_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and F2 of BGE-M3 hybrid vs BM25 + BGE")
+    parser.add_argument("--stub", action="store_true", help="Synthetic corpus and stub encoders")
+    parser.add_argument("--path_test", type=str, default=None, help="Questions with relevant_laws")
+    parser.add_argument("--path_chunk", type=str, default=None, help="Chunk corpus JSON")
+    parser.add_argument("--path_bm25", type=str, default=None, help="bm25_model.pkl")
+    parser.add_argument("--path_index", type=str, default=None, help="BGE FAISS index (bge.bin)")
+    parser.add_argument("--path_meta", type=str, default=None, help="corpus_meta.pkl")
+    parser.add_argument("--path_bge", type=str, default=None, help="BGE checkpoint used by predict_bge.py")
+    parser.add_argument("--path_m3", type=str, default=None, help="BGE-M3 checkpoint for the hybrid mode")
+    parser.add_argument("--index_dir", type=str, default=None, help="Hybrid index dir (bge_m3_hybrid.py build)")
+    parser.add_argument("--num_laws", type=int, default=20, help="--stub: number of documents")
+    parser.add_argument("--num_questions", type=int, default=200, help="--stub: number of questions")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dim", type=int, default=1024, help="--stub: encoder dimension")
+    parser.add_argument("--work_dir", type=str, default=None, help="--stub: work dir (default: temp dir)")
+    parser.add_argument("--bm25_topn", type=int, default=2000, help="BM25 / sparse candidates per query")
+    parser.add_argument("--dense_topk", type=int, default=100, help="Dense candidates per query")
+    parser.add_argument("--fusion_k", type=int, default=1000, help="K kept by fusion")
+    parser.add_argument("--hybrid_fusion", type=str, default="product_rank", choices=["product_rank", "sum"],
+                        help="Fusion of the hybrid mode (the pair always uses product_rank)")
+    parser.add_argument("--eval_topk", type=int, default=3, help="Top ids per query for F2 (as evaluate.py)")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    from retrieve.dense.bge_m3_hybrid import HybridSearcher
+    from retrieve.sparse.search import load_bm25_model, load_chunk_ids
+
+    if args.stub:
+        bge_model, index, meta, m3_model = prepare_stub(args)
+    else:
+        required = ["path_test", "path_chunk", "path_bm25", "path_index", "path_meta", "path_bge", "path_m3", "index_dir"]
+        missing = [name for name in required if getattr(args, name) is None]
+        if missing:
+            parser.error(f"missing {', '.join('--' + m for m in missing)} (or use --stub)")
+        from retrieve.dense.bge_m3_hybrid import load_m3_model
+        from retrieve.dense.predict_bge import load_data, load_model
+        _, index, meta = load_data(args.path_test, args.path_index, args.path_meta)
+        bge_model, _ = load_model(args.path_bge)
+        m3_model = load_m3_model(args.path_m3)
+
+    queries = _load_json(args.path_test)
+    bm25_model = load_bm25_model(args.path_bm25)
+    chunk_ids = load_chunk_ids(args.path_chunk)
+    searcher = HybridSearcher(args.index_dir, m3_model)
+    gt = load_ground_truth(Path(args.path_test))
+
+    report = {"n_queries": len(queries), "params": {
+        "bm25_topn": args.bm25_topn, "dense_topk": args.dense_topk,
+        "fusion_k": args.fusion_k, "hybrid_fusion": args.hybrid_fusion, "eval_topk": args.eval_topk, "stub": args.stub,
+    }}
+    for name, run in (
+        ("bm25_bge_pair", lambda: run_pair(queries, bm25_model, chunk_ids, bge_model, index, meta, args)),
+        ("m3_hybrid", lambda: run_hybrid(queries, searcher, args)),
+    ):
+        print(f"Running {name}...")
+        results, latencies = run()
+        summary = summarize(latencies, len(queries), "query")
+        summary["f2"] = compute_macro_f2(gt, predictions_from_results(results, args.eval_topk))
+        report[name] = summary
+
+    pair, hybrid = report["bm25_bge_pair"], report["m3_hybrid"]
+    print(f"\n{'pipeline':<16} {'p50 ms':>10} {'p95 ms':>10} {'F2':>8}")
+    for name in ("bm25_bge_pair", "m3_hybrid"):
+        s = report[name]
+        print(f"{name:<16} {s['latency_ms']['p50']:>10.2f} {s['latency_ms']['p95']:>10.2f} {s['f2']:>8.4f}")
+    print(f"speedup (mean latency): {pair['latency_ms']['mean'] / hybrid['latency_ms']['mean']:.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Đã lưu báo cáo vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
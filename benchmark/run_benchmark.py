@@ -0,0 +1,535 @@
+"""
+Benchmark the retrieval pipeline on a synthetic corpus.
+
+Each stage runs in its own spawned process so that the reported peak RSS
+belongs to that stage only. Results are written as JSON and can be compared
+against a previous run with --baseline.
+
+Example:
+    python benchmark/run_benchmark.py --num_laws 100 --num_questions 500 \
+        --output bench.json --baseline bench_main.json
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmark.synthetic_data import write_dataset  # noqa: E402
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# --------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in [0, 100]) of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(q / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def timed_calls(items, fn):
+    """Call fn(item) for every item, returning per-call latencies (seconds)."""
+    latencies = []
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def summarize(latencies, n_items, unit):
+    wall = sum(latencies)
+    summary = {
+        "status": "ok",
+        "unit": unit,
+        "n_items": n_items,
+        "n_calls": len(latencies),
+        "wall_s": wall,
+        "throughput_per_s": n_items / wall if wall > 0 else None,
+        "latency_ms": {"mean": 1000.0 * wall / len(latencies), "max": 1000.0 * max(latencies)},
+    }
+    for q in PERCENTILES:
+        summary["latency_ms"][f"p{q}"] = 1000.0 * percentile(latencies, q)
+    return summary
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _dump_json(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+# --------------------------------------------------------------------------
+# Fixtures (untimed, cached in the work dir and shared between stages)
+# --------------------------------------------------------------------------
+
+def ensure_chunks(ctx):
+    path = os.path.join(ctx["data_dir"], "processed", "chunked", "chunk_corpus.json")
+    if not os.path.exists(path):
+        from utils.chunk import chunk_corpus
+        _dump_json(chunk_corpus(_load_json(ctx["paths"]["corpus"])), path)
+    return path
+
+
+def ensure_bm25_model(ctx):
+    import pickle
+    path = os.path.join(ctx["data_dir"], "bm25_model.pkl")
+    if not os.path.exists(path):
+        from retrieve.sparse.create_model_bm25 import build_bm25_model
+        model = build_bm25_model(_load_json(ensure_chunks(ctx)), show_progress=False)
+        with open(path, "wb") as f:
+            pickle.dump(model, f)
+    return path
+
+
+def ensure_bm25_shards(ctx):
+    import pickle
+    path = os.path.join(ctx["data_dir"], "bm25_shards")
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        from retrieve.sparse.shard_bm25 import build_shards
+        with open(ensure_bm25_model(ctx), "rb") as f:
+            build_shards(pickle.load(f), path, ctx["bm25_workers"])
+    return path
+
+
+def ensure_chunk_store(ctx):
+    path = os.path.join(ctx["data_dir"], "processed", "chunked", "chunk_store")
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        from utils.chunk_store import build_chunk_store
+        build_chunk_store(_load_json(ensure_chunks(ctx)), path)
+    return path
+
+
+def ensure_dense_index(ctx):
+    """bge.bin + corpus_meta.pkl built with the stub encoder."""
+    import pickle
+    index_path = os.path.join(ctx["data_dir"], "faiss_index", "bge.bin")
+    meta_path = os.path.join(ctx["data_dir"], "faiss_index", "corpus_meta.pkl")
+    if not os.path.exists(index_path):
+        import faiss
+        import numpy as np
+        from benchmark.stub_encoder import HashingEncoder
+        chunks = _load_json(ensure_chunks(ctx))
+        vectors = HashingEncoder(dim=ctx["dim"]).encode([c["content_Article"] for c in chunks],
+                                                        normalize_embeddings=True)
+        index = faiss.IndexFlatIP(ctx["dim"])
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        faiss.write_index(index, index_path)
+        with open(meta_path, "wb") as f:
+            pickle.dump([(c["aid"], c["chunk_id"]) for c in chunks], f)
+    return index_path, meta_path
+
+
+def ensure_run_files(ctx):
+    """Synthetic BM25 / dense result files in the search.py / predict_bge.py schema."""
+    bm25_path = os.path.join(ctx["data_dir"], "results", "bm25_test.json")
+    dense_path = os.path.join(ctx["data_dir"], "results", "bge_test.json")
+    if os.path.exists(bm25_path) and os.path.exists(dense_path):
+        return bm25_path, dense_path
+
+    rng = random.Random(ctx["seed"])
+    aids = [item["aid"] for item in _load_json(ctx["paths"]["corpus"])]
+    chunk_ids = [f"{aid}_{i}" for aid in aids for i in range(2)]
+    bm25_n = min(ctx["bm25_topn"], len(chunk_ids))
+    dense_n = min(ctx["dense_topk"], len(chunk_ids))
+
+    bm25_runs, dense_runs = [], []
+    for q in _load_json(ctx["paths"]["test"]):
+        bm25_ids = rng.sample(chunk_ids, bm25_n)
+        bm25_scores = sorted((rng.expovariate(0.2) for _ in bm25_ids), reverse=True)
+        # Dense top-k chủ yếu nằm trong top đầu của BM25, phần còn lại ngẫu nhiên
+        head = bm25_ids[:dense_n * 2]
+        dense_ids = rng.sample(head, min(len(head), dense_n * 3 // 4))
+        seen = set(dense_ids)
+        dense_ids += [c for c in rng.sample(chunk_ids, dense_n) if c not in seen]
+        dense_ids = dense_ids[:dense_n]
+        dense_scores = sorted((rng.uniform(0.3, 0.9) for _ in dense_ids), reverse=True)
+        bm25_runs.append({"qid": q["qid"], "question": q["question"], "top_chunks": [
+            {"chunk_id": c, "score": s} for c, s in zip(bm25_ids, bm25_scores)]})
+        dense_runs.append({"qid": q["qid"], "top_chunks": [
+            {"chunk_id": c, "score": s} for c, s in zip(dense_ids, dense_scores)]})
+    _dump_json(bm25_runs, bm25_path)
+    _dump_json(dense_runs, dense_path)
+    return bm25_path, dense_path
+
+
+# --------------------------------------------------------------------------
+# Stages
+# --------------------------------------------------------------------------
+
+def bench_chunk(ctx):
+    from utils.chunk import build_text_splitter, chunk_corpus
+    corpus = _load_json(ctx["paths"]["corpus"])
+    splitter = build_text_splitter()
+    latencies = timed_calls(corpus, lambda item: chunk_corpus([item], splitter))
+    return summarize(latencies, len(corpus), "article")
+
+
+def bench_bm25_build(ctx):
+    from retrieve.sparse.create_model_bm25 import build_bm25_model
+    chunks = _load_json(ensure_chunks(ctx))
+    latencies = timed_calls(range(ctx["repeat_build"]), lambda _: build_bm25_model(chunks, show_progress=False))
+    return summarize(latencies, len(chunks) * len(latencies), "chunk")
+
+
+def bench_bm25_query(ctx):
+    from retrieve.sparse.search import load_bm25_model, load_chunk_ids, search_questions
+    model = load_bm25_model(ensure_bm25_model(ctx))
+    chunk_ids = load_chunk_ids(ensure_chunks(ctx))
+    queries = _load_json(ctx["paths"]["test"])
+    latencies = timed_calls(
+        queries,
+        lambda q: search_questions([q], model, chunk_ids, top_n=ctx["bm25_topn"], show_progress=False),
+    )
+    return summarize(latencies, len(queries), "query")
+
+
+def bench_bm25_query_sharded(ctx):
+    from retrieve.sparse.search import bm25_tokenizer
+    from retrieve.sparse.shard_bm25 import ShardedBM25Searcher
+    shard_dir = ensure_bm25_shards(ctx)
+    queries = _load_json(ctx["paths"]["test"])
+    # Tokenize trước (đã đo ở bm25_query), stage này chỉ đo phần scoring song song
+    tokenized = [bm25_tokenizer(q["question"]) for q in queries]
+    with ShardedBM25Searcher(shard_dir, num_workers=ctx["bm25_workers"]) as searcher:
+        searcher.search_tokenized(tokenized[:1], top_n=ctx["bm25_topn"])  # warm up pool
+        latencies = timed_calls(
+            range(ctx["repeat"]),
+            lambda _: searcher.search_tokenized(tokenized, top_n=ctx["bm25_topn"]),
+        )
+    return summarize(latencies, len(queries) * len(latencies), "query")
+
+
+def _bench_load_chunk_ids(ctx, path):
+    from retrieve.sparse.search import load_chunk_ids
+
+    def run(_):
+        # Truy cập vài id như search_questions
+        chunk_ids = load_chunk_ids(path)
+        return [chunk_ids[i] for i in range(0, len(chunk_ids), 97)]
+
+    latencies = timed_calls(range(ctx["repeat"]), run)
+    return summarize(latencies, len(latencies), "load")
+
+
+def bench_dense_search(ctx):
+    import faiss
+    import numpy as np
+    from benchmark.stub_encoder import HashingEncoder
+    from retrieve.dense.predict_bge import search_and_build_results
+
+    chunks = _load_json(ensure_chunks(ctx))
+    encoder = HashingEncoder(dim=ctx["dim"])
+    vectors = encoder.encode([c["content_Article"] for c in chunks], normalize_embeddings=True)
+    index = faiss.IndexFlatIP(ctx["dim"])
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    meta = [(c["aid"], c["chunk_id"]) for c in chunks]
+
+    queries = _load_json(ctx["paths"]["test"])
+    latencies = timed_calls(
+        queries,
+        lambda q: search_and_build_results([q], encoder, index, meta, topk=ctx["dense_topk"]),
+    )
+    return summarize(latencies, len(queries), "query")
+
+
+def bench_dense_rescore(ctx):
+    import numpy as np
+    from benchmark.stub_encoder import HashingEncoder
+    from retrieve.dense.rescore_bge import VectorStore, load_row_map, rescore_and_build_results
+
+    index_path, meta_path = ensure_dense_index(ctx)
+    store, row_map = VectorStore(index_path), load_row_map(meta_path)
+    chunk_ids = list(row_map)
+    rng = np.random.default_rng(ctx["seed"])
+    n = min(ctx["bm25_topn"], len(chunk_ids))
+
+    queries = _load_json(ctx["paths"]["test"])
+    # Ứng viên giả lập top-N của BM25: N row ngẫu nhiên mỗi câu hỏi
+    candidates = {
+        q["qid"]: [{"chunk_id": chunk_ids[r], "score": 1.0} for r in rng.choice(len(chunk_ids), n, replace=False)]
+        for q in queries
+    }
+    encoder = HashingEncoder(dim=ctx["dim"])
+    latencies = timed_calls(
+        queries,
+        lambda q: rescore_and_build_results([q], candidates, encoder, store, row_map, topk=ctx["dense_topk"]),
+    )
+    return summarize(latencies, len(queries), "query")
+
+
+def _bench_fusion(ctx, method):
+    from utils.ensemble_with_bm25 import ensemble_pairs
+    bm25_path, dense_path = ensure_run_files(ctx)
+    results_dir = os.path.dirname(bm25_path)
+    pairs = [{
+        "model": os.path.basename(dense_path),
+        "bm25": os.path.basename(bm25_path),
+        "output": "ensemble_bench.json",
+    }]
+    n_queries = len(_load_json(bm25_path))
+    latencies = timed_calls(
+        range(ctx["repeat"]),
+        lambda _: ensemble_pairs(results_dir=results_dir, pairs=pairs, method=method, K=ctx["fusion_k"]),
+    )
+    return summarize(latencies, n_queries * len(latencies), "query")
+
+
+def bench_fusion_threshold(ctx):
+    from utils.fusion import fuse_files
+    bm25_path, dense_path = ensure_run_files(ctx)
+    n_queries = len(_load_json(bm25_path))
+    latencies = timed_calls(
+        range(ctx["repeat"]),
+        lambda _: fuse_files([dense_path, bm25_path], method="product_rank", K=ctx["fusion_k"]),
+    )
+    return summarize(latencies, n_queries * len(latencies), "query")
+
+
+def bench_evaluate(ctx):
+    from pathlib import Path
+    from utils.evaluate import compute_macro_f2, load_ground_truth, load_predictions
+    bm25_path, _ = ensure_run_files(ctx)
+    n_queries = len(_load_json(bm25_path))
+
+    def run(_):
+        gt = load_ground_truth(Path(ctx["paths"]["test"]))
+        compute_macro_f2(gt, load_predictions(Path(bm25_path), 3))
+
+    latencies = timed_calls(range(ctx["repeat"]), run)
+    return summarize(latencies, n_queries * len(latencies), "query")
+
+
+STAGES = {
+    "chunk": bench_chunk,
+    "bm25_build": bench_bm25_build,
+    "bm25_query": bench_bm25_query,
+    "bm25_query_sharded": bench_bm25_query_sharded,
+    "load_chunk_ids_json": lambda ctx: _bench_load_chunk_ids(ctx, ensure_chunks(ctx)),
+    "load_chunk_ids_store": lambda ctx: _bench_load_chunk_ids(ctx, ensure_chunk_store(ctx)),
+    "dense_search": bench_dense_search,
+    "dense_rescore": bench_dense_rescore,
+    "fusion_sum": lambda ctx: _bench_fusion(ctx, "sum"),
+    "fusion_product": lambda ctx: _bench_fusion(ctx, "product"),
+    "fusion_product_rank": lambda ctx: _bench_fusion(ctx, "product_rank"),
+    "fusion_product_bm25_rank": lambda ctx: _bench_fusion(ctx, "product_bm25_rank"),
+    "fusion_threshold": bench_fusion_threshold,
+    "evaluate": bench_evaluate,
+}
+
+
+def run_stage(name, ctx):
+    """Run one stage in the current process and attach its peak RSS."""
+    try:
+        result = STAGES[name](ctx)
+    except ImportError as e:
+        return {"status": "skipped", "reason": f"missing dependency: {e}"}
+    except Exception as e:
+        return {"status": "error", "reason": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def _stage_worker(name, ctx, queue):
+    queue.put(run_stage(name, ctx))
+
+
+def run_stage_isolated(name, ctx):
+    """Run one stage in a fresh spawned process (per-stage peak RSS)."""
+    mp_ctx = mp.get_context("spawn")
+    queue = mp_ctx.Queue()
+    proc = mp_ctx.Process(target=_stage_worker, args=(name, ctx, queue))
+    proc.start()
+    try:
+        result = queue.get()
+    finally:
+        proc.join()
+    return result
+
+
+# --------------------------------------------------------------------------
+# Baseline comparison
+# --------------------------------------------------------------------------
+
+def compare_with_baseline(current, baseline, tolerance: float = 0.10):
+    """
+    So sánh kết quả hiện tại với baseline
+
+    Returns:
+        rows: list of dicts (stage, metric, baseline, current, ratio, regression)
+    """
+    rows = []
+    checks = [
+        ("latency_ms.p50", lambda s: s["latency_ms"]["p50"], True),
+        ("latency_ms.p95", lambda s: s["latency_ms"]["p95"], True),
+        ("throughput_per_s", lambda s: s["throughput_per_s"], False),
+        ("peak_rss_mb", lambda s: s["peak_rss_mb"], True),
+    ]
+    for stage, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or base.get("status") != "ok" or cur.get("status") != "ok":
+            continue
+        for metric, get, lower_is_better in checks:
+            b, c = get(base), get(cur)
+            if not b or c is None:
+                continue
+            ratio = c / b
+            regression = ratio > 1 + tolerance if lower_is_better else ratio < 1 / (1 + tolerance)
+            rows.append({
+                "stage": stage, "metric": metric, "baseline": b, "current": c,
+                "ratio": ratio, "regression": regression,
+            })
+    return rows
+
+
+def print_summary(report, comparison=None):
+    print(f"\n{'stage':<26}{'status':>8}{'p50 ms':>12}{'p95 ms':>12}{'items/s':>12}{'RSS MB':>10}")
+    for name, s in report["stages"].items():
+        if s["status"] != "ok":
+            print(f"{name:<26}{s['status']:>8}  {s.get('reason', '')}")
+            continue
+        print(f"{name:<26}{'ok':>8}{s['latency_ms']['p50']:>12.3f}{s['latency_ms']['p95']:>12.3f}"
+              f"{s['throughput_per_s']:>12.1f}{s['peak_rss_mb']:>10.1f}")
+    if comparison:
+        print(f"\n{'stage':<26}{'metric':<20}{'baseline':>12}{'current':>12}{'ratio':>8}")
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['stage']:<26}{row['metric']:<20}{row['baseline']:>12.3f}"
+                  f"{row['current']:>12.3f}{row['ratio']:>8.2f}{flag}")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval pipeline on synthetic data")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES),
+                        help="Comma-separated stages to run (default: all)")
+    parser.add_argument("--num_laws", type=int, default=50, help="Synthetic corpus: number of documents")
+    parser.add_argument("--articles_per_law", type=int, default=40, help="Synthetic corpus: articles per document")
+    parser.add_argument("--num_questions", type=int, default=500, help="Synthetic corpus: number of questions")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="Directory for synthetic data and fixtures (default: temp dir)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions for whole-file stages")
+    parser.add_argument("--repeat_build", type=int, default=1, help="Repetitions for index build stages")
+    parser.add_argument("--bm25_topn", type=int, default=2000, help="BM25 candidates per query")
+    parser.add_argument("--bm25_workers", type=int, default=os.cpu_count() or 1,
+                        help="Shards / worker processes for bm25_query_sharded")
+    parser.add_argument("--dense_topk", type=int, default=100, help="Dense candidates per query")
+    parser.add_argument("--fusion_k", type=int, default=1000, help="K kept by fusion")
+    parser.add_argument("--dim", type=int, default=1024, help="Stub encoder dimension")
+    parser.add_argument("--in_process", action="store_true",
+                        help="Run stages in this process (peak RSS is then cumulative)")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", type=str, default=None, help="Baseline JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as regression")
+    parser.add_argument("--fail_on_regression", action="store_true", help="Exit 1 if any regression is found")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {unknown} (available: {list(STAGES)})")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="vlsp_bench_")
+    data_dir = os.path.join(work_dir, "data")
+    print(f"Generating synthetic data in {data_dir}...")
+    paths = write_dataset(
+        out_dir=data_dir,
+        num_laws=args.num_laws,
+        articles_per_law=args.articles_per_law,
+        num_questions=args.num_questions,
+        seed=args.seed,
+    )
+
+    ctx = {
+        "data_dir": data_dir,
+        "paths": paths,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "repeat_build": args.repeat_build,
+        "bm25_topn": args.bm25_topn,
+        "bm25_workers": args.bm25_workers,
+        "dense_topk": args.dense_topk,
+        "fusion_k": args.fusion_k,
+        "dim": args.dim,
+    }
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": {
+                "num_laws": args.num_laws,
+                "articles_per_law": args.articles_per_law,
+                "num_questions": args.num_questions,
+                "num_articles": len(_load_json(paths["corpus"])),
+            },
+            "params": {k: v for k, v in ctx.items() if k not in ("data_dir", "paths")},
+        },
+        "stages": {},
+    }
+
+    for name in stages:
+        print(f"Running stage: {name}...")
+        result = run_stage(name, ctx) if args.in_process else run_stage_isolated(name, ctx)
+        report["stages"][name] = result
+
+    comparison = None
+    if args.baseline:
+        comparison = compare_with_baseline(report, _load_json(args.baseline), args.tolerance)
+        report["baseline_comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "rows": comparison}
+
+    print_summary(report, comparison)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Đã lưu báo cáo vào {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.fail_on_regression and comparison and any(r["regression"] for r in comparison):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Startup benchmark for the CLI entry points.
+
+Each entry point runs in a fresh interpreter that imports its module and
+produces one result on the synthetic corpus. Reported per entry:
+
+    import_s        time to import the module
+    first_result_s  time from interpreter start-up (after ``python`` itself)
+                    to the first result, imports + loads + one query
+    wall_s          wall-clock of the whole process, seen from the parent
+
+Dense entries use the hashing stub encoder, so model load time is not included.
+
+Example:
+    python benchmark/startup_benchmark.py --output startup.json --max_light_s 1.0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmark.run_benchmark import (  # noqa: E402
+    ensure_bm25_model, ensure_chunk_store, ensure_dense_index, ensure_run_files,
+)
+from benchmark.synthetic_data import write_dataset  # noqa: E402
+
+# Driver chạy trong process con: {ctx} là dict fixture, đo import rồi tới kết quả đầu tiên
+_PRELUDE = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+ctx = json.loads({ctx!r})
+"""
+
+_EPILOGUE = """
+t2 = time.perf_counter()
+print("__STARTUP__" + json.dumps({"import_s": t1 - t0, "first_result_s": t2 - t0}))
+"""
+
+ENTRIES = {
+    "search": ("""
+from retrieve.sparse.search import load_bm25_model, load_chunk_ids, search_questions
+t1 = time.perf_counter()
+q = json.load(open(ctx["test"], encoding="utf-8"))[:1]
+search_questions(q, load_bm25_model(ctx["bm25"]), load_chunk_ids(ctx["chunk_store"]), show_progress=False)
+""", False),
+    "predict_bge": ("""
+from retrieve.dense.predict_bge import load_index, search_and_build_results
+t1 = time.perf_counter()
+from benchmark.stub_encoder import HashingEncoder
+q = json.load(open(ctx["test"], encoding="utf-8"))[:1]
+index, meta = load_index(ctx["faiss"], ctx["meta"])
+search_and_build_results(q, HashingEncoder(dim=ctx["dim"]), index, meta)
+""", False),
+    "ensemble_with_bm25": ("""
+from utils.ensemble_with_bm25 import ensemble_pair_product_rank
+t1 = time.perf_counter()
+ensemble_pair_product_rank(ctx["dense_run"], ctx["bm25_run"], 1.0, 1.0, 1000, ctx["fused_run"])
+""", True),
+    "evaluate": ("""
+from pathlib import Path
+from utils.evaluate import compute_macro_f2, load_ground_truth, load_predictions
+t1 = time.perf_counter()
+compute_macro_f2(load_ground_truth(Path(ctx["test"])), load_predictions(Path(ctx["bm25_run"]), 3))
+""", True),
+    "chunk": ("""
+from utils.chunk import chunk_corpus
+t1 = time.perf_counter()
+chunk_corpus(json.load(open(ctx["corpus"], encoding="utf-8"))[:1])
+""", False),
+}
+
+
+def run_entry(name, fixtures, python=sys.executable):
+    body, _ = ENTRIES[name]
+    code = _PRELUDE.format(root=ROOT_DIR, ctx=json.dumps(fixtures)) + body + _EPILOGUE
+    t0 = time.perf_counter()
+    proc = subprocess.run([python, "-c", code], capture_output=True, text=True, cwd=ROOT_DIR)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+        status = "skipped" if "ModuleNotFoundError" in proc.stderr or "ImportError" in proc.stderr else "error"
+        return {"status": status, "error": last, "wall_s": wall}
+    line = [l for l in proc.stdout.splitlines() if l.startswith("__STARTUP__")][-1]
+    result = json.loads(line[len("__STARTUP__"):])
+    result.update({"status": "ok", "wall_s": wall})
+    return result
+
+
+def interpreter_startup(python=sys.executable, repeat: int = 3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([python, "-c", "pass"], check=True)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and first-result time of the CLI entry points")
+    parser.add_argument("--entries", type=str, default=",".join(ENTRIES), help="Comma-separated entries")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per entry (best run is reported)")
+    parser.add_argument("--num_laws", type=int, default=20, help="Synthetic corpus: number of documents")
+    parser.add_argument("--num_questions", type=int, default=100, help="Synthetic corpus: number of questions")
+    parser.add_argument("--dim", type=int, default=1024, help="Stub encoder dimension")
+    parser.add_argument("--work_dir", type=str, default=None, help="Fixture directory (default: temp dir)")
+    parser.add_argument("--max_light_s", type=float, default=1.0,
+                        help="Budget for lightweight tools (ensemble, evaluate) first result")
+    parser.add_argument("--fail_over_budget", action="store_true", help="Exit 1 if a lightweight tool is over budget")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    entries = [e.strip() for e in args.entries.split(",") if e.strip()]
+    unknown = [e for e in entries if e not in ENTRIES]
+    if unknown:
+        parser.error(f"unknown entries: {unknown} (available: {list(ENTRIES)})")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="vlsp_startup_")
+    data_dir = os.path.join(work_dir, "data")
+    print(f"Preparing fixtures in {data_dir}...")
+    paths = write_dataset(out_dir=data_dir, num_laws=args.num_laws, num_questions=args.num_questions)
+    ctx = {"data_dir": data_dir, "paths": paths, "seed": 42, "bm25_topn": 2000, "dense_topk": 100,
+           "dim": args.dim}
+    bm25_run, dense_run = ensure_run_files(ctx)
+    fixtures = {
+        "test": paths["test"],
+        "corpus": paths["corpus"],
+        "bm25": ensure_bm25_model(ctx),
+        "chunk_store": ensure_chunk_store(ctx),
+        "bm25_run": bm25_run,
+        "dense_run": dense_run,
+        "fused_run": os.path.join(data_dir, "results", "startup_fused.json"),
+        "dim": args.dim,
+    }
+    if "predict_bge" in entries:
+        fixtures["faiss"], fixtures["meta"] = ensure_dense_index(ctx)
+
+    report = {"interpreter_s": interpreter_startup(), "max_light_s": args.max_light_s, "entries": {}}
+    over_budget = []
+    for name in entries:
+        runs = [run_entry(name, fixtures) for _ in range(args.repeat)]
+        ok = [r for r in runs if r["status"] == "ok"]
+        result = min(ok, key=lambda r: r["first_result_s"]) if ok else runs[-1]
+        result["lightweight"] = ENTRIES[name][1]
+        if result["status"] == "ok" and result["lightweight"] and result["first_result_s"] > args.max_light_s:
+            over_budget.append(name)
+        report["entries"][name] = result
+
+    print(f"\nInterpreter start-up: {report['interpreter_s'] * 1000:.0f} ms")
+    print(f"{'entry':<22} {'status':>8} {'import ms':>10} {'first ms':>10} {'wall ms':>10}")
+    for name, r in report["entries"].items():
+        if r["status"] == "ok":
+            print(f"{name:<22} {'ok':>8} {r['import_s'] * 1000:>10.0f} {r['first_result_s'] * 1000:>10.0f} "
+                  f"{r['wall_s'] * 1000:>10.0f}")
+        else:
+            print(f"{name:<22} {r['status']:>8}  {r['error']}")
+    if over_budget:
+        print(f"\nOver the {args.max_light_s}s budget: {', '.join(over_budget)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Đã lưu báo cáo vào {args.output}")
+
+    if args.fail_over_budget and over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Deterministic stand-in for the BGE-M3 SentenceTransformer.
+
+Used by the benchmarks so dense search can be timed without torch or model
+weights. Embeddings are hashed bag-of-words vectors, so texts sharing words
+still land close to each other.
+"""
+import zlib
+
+import numpy as np
+
+
+class HashingEncoder:
+    """Minimal ``SentenceTransformer.encode`` compatible encoder."""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            h = zlib.crc32(word.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return vec
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False,
+               convert_to_numpy: bool = True, show_progress_bar: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embs = np.stack([self._encode_one(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embs, axis=1, keepdims=True)
+            embs = embs / np.maximum(norms, 1e-12)
+        return embs[0] if single else embs
+
+
+class HashingM3Encoder(HashingEncoder):
+    """Minimal ``BGEM3FlagModel.encode`` compatible encoder (dense + lexical weights)."""
+
+    def __init__(self, dim: int = 1024, vocab_size: int = 250002):
+        super().__init__(dim)
+        self.vocab_size = vocab_size
+
+    def _lexical_weights(self, text: str):
+        counts = {}
+        for word in text.lower().split():
+            tid = str(zlib.crc32(word.encode("utf-8")) % self.vocab_size)
+            counts[tid] = counts.get(tid, 0) + 1
+        # Như BGE-M3: mỗi token một weight dương, token lặp lại lấy weight lớn hơn
+        return {tid: float(np.log1p(c)) * 0.2 for tid, c in counts.items()}
+
+    def encode(self, sentences, batch_size: int = 32, max_length: int = 512, return_dense: bool = True,
+               return_sparse: bool = False, return_colbert_vecs: bool = False, **kwargs):
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        out = {"dense_vecs": None, "lexical_weights": None, "colbert_vecs": None}
+        if return_dense:
+            out["dense_vecs"] = HashingEncoder.encode(self, texts, normalize_embeddings=True)
+        if return_sparse:
+            out["lexical_weights"] = [self._lexical_weights(t) for t in texts]
+        return out
@@ -0,0 +1,247 @@
+"""
+Generate a synthetic Vietnamese-like legal corpus and question set.
+
+The output mirrors the real data layout (``legal_corpus.json`` / ``train.json``
+schema) so every script in the repo can run on it offline:
+
+    <out_dir>/raw/legal_corpus.json
+    <out_dir>/raw/train.json
+    <out_dir>/processed/corpus.json
+    <out_dir>/processed/train.json
+    <out_dir>/processed/test.json
+    <out_dir>/private_test/private_test.json
+"""
+import argparse
+import json
+import os
+import random
+
+# Âm tiết / cụm từ hay gặp trong văn bản pháp luật, dùng để sinh văn bản giả
+LEGAL_TERMS = [
+    "quyền", "nghĩa vụ", "công dân", "cơ quan", "nhà nước", "hợp đồng",
+    "lao động", "doanh nghiệp", "tổ chức", "cá nhân", "giấy phép", "đăng ký",
+    "kết hôn", "ly hôn", "tài sản", "thừa kế", "đất đai", "xây dựng",
+    "thuế", "phí", "lệ phí", "xử phạt", "vi phạm", "hành chính", "hình sự",
+    "dân sự", "tố tụng", "tòa án", "viện kiểm sát", "công an", "bảo hiểm",
+    "xã hội", "y tế", "giáo dục", "môi trường", "tài nguyên", "giao thông",
+    "phương tiện", "người lao động", "người sử dụng lao động", "tiền lương",
+    "bồi thường", "thiệt hại", "trách nhiệm", "thẩm quyền", "ủy ban nhân dân",
+    "cấp tỉnh", "cấp huyện", "cấp xã", "hồ sơ", "thủ tục", "thời hạn",
+    "khiếu nại", "tố cáo", "quyết định", "văn bản", "quy định", "điều kiện",
+    "trình tự", "chứng nhận", "quản lý", "sử dụng", "chuyển nhượng", "thế chấp",
+    "cho thuê", "góp vốn", "cổ phần", "cổ đông", "hội đồng", "thành viên",
+    "giám đốc", "kế toán", "kiểm toán", "ngân sách", "đầu tư", "dự án",
+    "cư trú", "hộ tịch", "quốc tịch", "căn cước", "hộ chiếu", "xuất cảnh",
+    "nhập cảnh", "an ninh", "quốc phòng", "nghĩa vụ quân sự", "trẻ em",
+    "người cao tuổi", "người khuyết tật", "phụ nữ", "gia đình", "vợ chồng",
+    "cha mẹ", "con", "nuôi con nuôi", "giám hộ", "đại diện", "ủy quyền",
+]
+
+FILLER_WORDS = [
+    "của", "và", "các", "có", "được", "theo", "tại", "trong", "về", "hoặc",
+    "người", "này", "khoản", "cho", "không", "từ", "phải", "việc", "để",
+    "đến", "với", "là", "khi", "trên", "đã", "thì", "thuộc", "do", "một",
+]
+
+LAW_TYPES = [
+    ("Luật", "QH"), ("Nghị định", "NĐ-CP"), ("Thông tư", "TT-BTC"),
+    ("Thông tư", "TT-BLĐTBXH"), ("Quyết định", "QĐ-TTg"),
+]
+
+# Dùng để sinh từ vựng đuôi dài (tên riêng, thuật ngữ hiếm) cho từng điều luật
+ONSETS = ["b", "c", "ch", "d", "đ", "g", "gi", "h", "kh", "l", "m", "n", "ng",
+          "nh", "ph", "qu", "s", "t", "th", "tr", "v", "x"]
+RIMES = ["a", "á", "à", "ả", "ạ", "ăn", "âm", "ân", "ê", "ênh", "i", "inh", "o",
+         "ông", "ơn", "u", "ưng", "uyên", "oan", "iệt", "ước", "ương", "ai", "ao"]
+
+QUESTION_TEMPLATES = [
+    "{a} có được {b} không?",
+    "Quy định về {a} khi {b} như thế nào?",
+    "Trường hợp {a} thì {b} ra sao?",
+    "Điều kiện để {a} và {b} là gì?",
+    "Thủ tục {a} liên quan đến {b} được thực hiện thế nào?",
+    "Mức xử phạt đối với {a} khi {b} là bao nhiêu?",
+]
+
+
+def _zipf_weights(n: int, s: float = 1.1):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+class _TextGenerator:
+    """Sample Vietnamese-like legal sentences with a Zipfian vocabulary."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.terms = list(LEGAL_TERMS)
+        rng.shuffle(self.terms)
+        self.term_weights = _zipf_weights(len(self.terms))
+        self.rare_terms = []
+
+    def rare_term(self) -> str:
+        syllables = [self.rng.choice(ONSETS) + self.rng.choice(RIMES) for _ in range(2)]
+        return " ".join(syllables)
+
+    def phrase(self, n_terms: int) -> str:
+        terms = self.rng.choices(self.terms, weights=self.term_weights, k=n_terms)
+        if self.rare_terms and self.rng.random() < 0.5:
+            terms[self.rng.randrange(n_terms)] = self.rng.choice(self.rare_terms)
+        words = []
+        for term in terms:
+            words.append(term)
+            if self.rng.random() < 0.6:
+                words.append(self.rng.choice(FILLER_WORDS))
+        return " ".join(words)
+
+    def sentence(self, n_words: int) -> str:
+        words = []
+        while len(words) < n_words:
+            words.extend(self.phrase(self.rng.randint(2, 5)).split())
+        text = " ".join(words[:n_words])
+        return text[0].upper() + text[1:] + "."
+
+    def article(self, number: int, n_words: int) -> str:
+        # Mỗi điều luật có vài thuật ngữ riêng để BM25 có tín hiệu phân biệt
+        self.rare_terms = [self.rare_term() for _ in range(self.rng.randint(2, 6))]
+        title = self.phrase(self.rng.randint(2, 4))
+        lines = [f"Điều {number}. {title[0].upper() + title[1:]}"]
+        remaining = n_words
+        clause = 1
+        while remaining > 0:
+            size = min(remaining, self.rng.randint(20, 80))
+            lines.append(f"{clause}. {self.sentence(size)}")
+            remaining -= size
+            clause += 1
+        return "\n".join(lines)
+
+
+def generate_legal_corpus(num_laws: int, articles_per_law: int, mean_article_words: int, rng: random.Random):
+    """Sinh legal_corpus.json: list các văn bản, mỗi văn bản có list điều luật."""
+    gen = _TextGenerator(rng)
+    corpus = []
+    aid = 1
+    for law_idx in range(num_laws):
+        law_type, suffix = rng.choice(LAW_TYPES)
+        year = rng.randint(2005, 2024)
+        number = rng.randint(1, 150)
+        if suffix == "QH":
+            suffix = f"QH{rng.randint(11, 15)}"
+        law_id = f"{number}/{year}/{suffix}"
+        n_articles = max(1, int(rng.gauss(articles_per_law, articles_per_law * 0.3)))
+        content = []
+        for number_in_law in range(1, n_articles + 1):
+            # Độ dài điều luật phân phối log-normal, một số điều > 400 từ để kích hoạt chunking
+            n_words = max(15, int(rng.lognormvariate(0, 0.7) * mean_article_words))
+            content.append({
+                "aid": aid,
+                "content_Article": gen.article(number_in_law, n_words),
+            })
+            aid += 1
+        corpus.append({
+            "id": law_idx + 1,
+            "law_id": law_id,
+            "title": f"{law_type} {gen.phrase(2)}",
+            "content": content,
+        })
+    return corpus
+
+
+def generate_questions(legal_corpus, num_questions: int, rng: random.Random):
+    """Sinh train.json: mỗi câu hỏi gồm qid, question và relevant_laws (list aid)."""
+    articles = [article for law in legal_corpus for article in law["content"]]
+    questions = []
+    for qid in range(1, num_questions + 1):
+        n_relevant = 1 if rng.random() < 0.8 else 2
+        relevant = rng.sample(articles, k=min(n_relevant, len(articles)))
+        words = [
+            w for w in " ".join(a["content_Article"] for a in relevant).split()
+            if not w.rstrip(".").isdigit()
+        ]
+        # Lấy cụm từ trong điều luật liên quan (bỏ số thứ tự và chữ "Điều" đầu tiên)
+        start_a = rng.randint(1, max(1, len(words) - 6))
+        start_b = rng.randint(1, max(1, len(words) - 6))
+        a = " ".join(words[start_a:start_a + rng.randint(3, 6)]).strip(".").lower()
+        b = " ".join(words[start_b:start_b + rng.randint(2, 5)]).strip(".").lower()
+        questions.append({
+            "qid": qid,
+            "question": rng.choice(QUESTION_TEMPLATES).format(a=a, b=b),
+            "relevant_laws": [article["aid"] for article in relevant],
+        })
+    return questions
+
+
+def _dump(obj, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+
+def write_dataset(out_dir: str,
+                  num_laws: int = 50,
+                  articles_per_law: int = 40,
+                  num_questions: int = 500,
+                  mean_article_words: int = 180,
+                  seed: int = 42):
+    """
+    Ghi toàn bộ dataset giả vào out_dir theo cấu trúc giống thư mục data/
+
+    Returns:
+        paths: dict tên file -> đường dẫn đã ghi
+    """
+    rng = random.Random(seed)
+    legal_corpus = generate_legal_corpus(num_laws, articles_per_law, mean_article_words, rng)
+    questions = generate_questions(legal_corpus, num_questions, rng)
+
+    # Giống create_corpus.py
+    corpus = [
+        {"aid": article["aid"], "law_id": law["law_id"], "content_Article": article["content_Article"]}
+        for law in legal_corpus for article in law["content"]
+    ]
+    # Giống split_data.py
+    shuffled = list(questions)
+    random.Random(seed).shuffle(shuffled)
+    split_index = int(0.8 * len(shuffled))
+    private_test = [{"qid": q["qid"], "question": q["question"]} for q in shuffled[split_index:]]
+
+    paths = {
+        "legal_corpus": os.path.join(out_dir, "raw", "legal_corpus.json"),
+        "raw_train": os.path.join(out_dir, "raw", "train.json"),
+        "corpus": os.path.join(out_dir, "processed", "corpus.json"),
+        "train": os.path.join(out_dir, "processed", "train.json"),
+        "test": os.path.join(out_dir, "processed", "test.json"),
+        "private_test": os.path.join(out_dir, "private_test", "private_test.json"),
+    }
+    _dump(legal_corpus, paths["legal_corpus"])
+    _dump(questions, paths["raw_train"])
+    _dump(corpus, paths["corpus"])
+    _dump(shuffled[:split_index], paths["train"])
+    _dump(shuffled[split_index:], paths["test"])
+    _dump(private_test, paths["private_test"])
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic legal corpus and question set")
+    parser.add_argument("--out_dir", type=str, required=True, help="Output directory (data/ layout)")
+    parser.add_argument("--num_laws", type=int, default=50, help="Number of legal documents")
+    parser.add_argument("--articles_per_law", type=int, default=40, help="Mean number of articles per document")
+    parser.add_argument("--num_questions", type=int, default=500, help="Number of questions")
+    parser.add_argument("--mean_article_words", type=int, default=180, help="Median article length in words")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    paths = write_dataset(
+        out_dir=args.out_dir,
+        num_laws=args.num_laws,
+        articles_per_law=args.articles_per_law,
+        num_questions=args.num_questions,
+        mean_article_words=args.mean_article_words,
+        seed=args.seed,
+    )
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+    print("✅ Đã sinh dữ liệu giả")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Script to run single-pass BGE-M3 hybrid retrieval (dense + learned sparse)
+
+BGE-M3 trả về cả dense embedding và lexical weights (trọng số sparse theo
+token id) trong cùng một forward pass. Chế độ này thay cặp BM25 (underthesea
+word_tokenize ở search.py) + BGE (predict_bge.py) bằng một lần encode mỗi
+batch câu hỏi:
+
+    build:  encode chunk corpus -> dense.bin (FAISS IndexFlatIP)
+                                -> inverted index của lexical weights (CSR theo token id)
+    search: encode câu hỏi một lần -> FAISS top-k + sparse top-n -> fuse trong process
+
+Điểm sparse giống FlagEmbedding compute_lexical_matching_score: tổng
+q_weight * d_weight trên các token chung. Fusion mặc định là product_rank
+(fuse_product_rank của ensemble_with_bm25.py, dense đóng vai model, sparse
+đóng vai BM25), output cùng schema với search.py / predict_bge.py.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from retrieve.dense.predict_bge import save_results
+from retrieve.sparse.shard_bm25 import topk_indices
+from utils.ensemble_with_bm25 import fuse_product_rank
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+from utils.result_cache import add_cache_args, build_cache, cached_search
+from utils.semantic_cache import add_semantic_cache_args, build_semantic_cache
+
+MANIFEST = "manifest.json"
+DENSE_INDEX = "dense.bin"
+META = "corpus_meta.pkl"
+FUSION_METHODS = ("product_rank", "sum")
+
+
+def load_m3_model(model_path: str, use_fp16: bool = None):
+    """
+    Load BGE-M3 with FlagEmbedding (dense + sparse heads)
+
+    Args:
+        model_path: Path to the model checkpoint
+        use_fp16: Dùng fp16 (mặc định: bật khi có GPU)
+
+    Returns:
+        model: BGEM3FlagModel
+    """
+    # Import ở đây để build/search dùng được với encoder khác (benchmark)
+    import torch
+    from FlagEmbedding import BGEM3FlagModel
+
+    if use_fp16 is None:
+        use_fp16 = torch.cuda.is_available()
+    print("Loading BGE-M3 model...")
+    with get_tracer().stage("load_model"):
+        model = BGEM3FlagModel(model_path, use_fp16=use_fp16)
+    return model
+
+
+def encode_m3(model, texts, batch_size: int = 32, max_length: int = 512):
+    """
+    Encode texts once, returning both dense and sparse outputs
+
+    Returns:
+        dense: float32 array (n, dim), L2-normalized
+        sparse: list of {token_id (int): weight (float)}
+    """
+    out = model.encode(
+        list(texts),
+        batch_size=batch_size,
+        max_length=max_length,
+        return_dense=True,
+        return_sparse=True,
+        return_colbert_vecs=False,
+    )
+    dense = np.asarray(out["dense_vecs"], dtype=np.float32).reshape(len(texts), -1)
+    dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+    # FlagEmbedding trả key là token id dạng str
+    sparse = [{int(t): float(w) for t, w in lw.items()} for lw in out["lexical_weights"]]
+    return dense, sparse
+
+
+def build_sparse_arrays(sparse_weights):
+    """
+    Inverted index (CSR theo token id) của lexical weights
+
+    Returns:
+        term_ptr: int64 (vocab_size + 1,), postings của token t nằm ở [term_ptr[t], term_ptr[t+1])
+        post_doc: int32 row của chunk
+        post_w: float32 weight của token trong chunk
+    """
+    sizes = [len(w) for w in sparse_weights]
+    total = sum(sizes)
+    terms = np.empty(total, dtype=np.int64)
+    weights = np.empty(total, dtype=np.float32)
+    docs = np.repeat(np.arange(len(sparse_weights), dtype=np.int32), sizes)
+    pos = 0
+    for w in sparse_weights:
+        n = len(w)
+        terms[pos:pos + n] = list(w.keys())
+        weights[pos:pos + n] = list(w.values())
+        pos += n
+
+    vocab_size = int(terms.max()) + 1 if total else 0
+    order = np.argsort(terms, kind="stable")
+    term_ptr = np.zeros(vocab_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=vocab_size), out=term_ptr[1:])
+    return term_ptr, docs[order], weights[order]
+
+
+def corpus_signature(chunk_data) -> str:
+    """sha1 of chunk ids + texts, stored in the manifest to detect an index built from another corpus."""
+    h = hashlib.sha1()
+    for c in chunk_data:
+        h.update(f"{c['chunk_id']}\0{c['content_Article']}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def build_hybrid_index(chunk_data, model, out_dir: str, batch_size: int = 256, max_length: int = 512):
+    """
+    Encode chunk corpus một lần và lưu cả dense index lẫn sparse inverted index
+
+    Args:
+        chunk_data: List chunk (aid, chunk_id, content_Article) như chunk_corpus.json
+        model: BGEM3FlagModel (hoặc encoder có cùng encode)
+        out_dir: Thư mục output
+        batch_size: Số chunk mỗi lần encode
+        max_length: Độ dài tối đa (token) của chunk
+
+    Returns:
+        manifest: dict mô tả index
+    """
+    import faiss
+
+    os.makedirs(out_dir, exist_ok=True)
+    index = None
+    sparse_weights = []
+    for b in range(0, len(chunk_data), batch_size):
+        batch = chunk_data[b:b + batch_size]
+        dense, sparse = encode_m3(model, [c["content_Article"] for c in batch], batch_size, max_length)
+        if index is None:
+            index = faiss.IndexFlatIP(dense.shape[1])
+        index.add(dense)
+        sparse_weights.extend(sparse)
+        print(f"Encoded {min(b + batch_size, len(chunk_data))}/{len(chunk_data)} chunks...")
+
+    term_ptr, post_doc, post_w = build_sparse_arrays(sparse_weights)
+    faiss.write_index(index, os.path.join(out_dir, DENSE_INDEX))
+    np.save(os.path.join(out_dir, "term_ptr.npy"), term_ptr)
+    np.save(os.path.join(out_dir, "post_doc.npy"), post_doc)
+    np.save(os.path.join(out_dir, "post_w.npy"), post_w)
+    with open(os.path.join(out_dir, META), "wb") as f:
+        pickle.dump([(c["aid"], c["chunk_id"]) for c in chunk_data], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    manifest = {
+        "num_chunks": len(chunk_data),
+        "dim": int(index.d),
+        "vocab_size": int(len(term_ptr) - 1),
+        "postings": int(len(post_doc)),
+        "max_length": max_length,
+        "corpus_sha1": corpus_signature(chunk_data),
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Đã lưu hybrid index ({len(chunk_data)} chunks, {len(post_doc)} postings) vào {out_dir}")
+    return manifest
+
+
+class HybridSearcher:
+    """
+    Dense + learned-sparse search with one encoder call per query batch
+
+    Args:
+        index_dir: Thư mục build_hybrid_index
+        model: BGEM3FlagModel (hoặc encoder có cùng encode)
+        mmap: Memory-map sparse postings thay vì đọc hết vào RAM
+    """
+
+    def __init__(self, index_dir: str, model, mmap: bool = True):
+        tracer = get_tracer()
+        mode = "r" if mmap else None
+        self.model = model
+        with tracer.stage("load_index"):
+            import faiss
+            self.index = faiss.read_index(os.path.join(index_dir, DENSE_INDEX))
+            self.term_ptr = np.load(os.path.join(index_dir, "term_ptr.npy"), mmap_mode=mode)
+            self.post_doc = np.load(os.path.join(index_dir, "post_doc.npy"), mmap_mode=mode)
+            self.post_w = np.load(os.path.join(index_dir, "post_w.npy"), mmap_mode=mode)
+        with tracer.stage("load_meta"):
+            with open(os.path.join(index_dir, META), "rb") as f:
+                self.meta = pickle.load(f)
+        self.vocab_size = len(self.term_ptr) - 1
+
+    def sparse_scores(self, query_weights):
+        """Lexical matching score của mọi chunk cho một câu hỏi."""
+        scores = np.zeros(len(self.meta))
+        for tid, w in query_weights.items():
+            if tid >= self.vocab_size:
+                continue
+            lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+            if lo == hi:
+                continue
+            scores[self.post_doc[lo:hi]] += w * self.post_w[lo:hi].astype(np.float64)
+        return scores
+
+    def search(self, queries, dense_topk: int = 100, sparse_topn: int = 2000, K: int = 1000,
+               fusion: str = "product_rank", dense_weight: float = 1.0, sparse_weight: float = 1.0,
+               batch_size: int = 32, max_length: int = 512, semantic_cache=None):
+        """
+        Encode, search both indexes and fuse
+
+        Args:
+            queries: List of query dictionaries with 'qid' and 'question'
+            dense_topk: Số chunk lấy từ FAISS
+            sparse_topn: Số chunk lấy từ sparse index (chỉ chunk có điểm > 0)
+            K: Số chunk giữ lại sau fusion
+            fusion: "product_rank" hoặc "sum"
+            dense_weight / sparse_weight: Trọng số fusion
+            semantic_cache: SemanticCache; câu hỏi có dense embedding gần một câu
+                hỏi đã trả lời dùng lại kết quả fuse của nó (bỏ qua search + fusion)
+
+        Returns:
+            output: List of results with qid and top_chunks
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"fusion must be one of {FUSION_METHODS}")
+        tracer = get_tracer()
+        output = []
+        print(f"Processing {len(queries)} queries...")
+
+        def search_fuse(q, d_scores, d_rows, q_sparse):
+            with tracer.stage("sparse_search"):
+                idx, vals = topk_indices(self.sparse_scores(q_sparse), sparse_topn)
+                keep = vals > 0
+                sparse_map = {self.meta[i][1]: float(v) for i, v in zip(idx[keep], vals[keep])}
+            dense_map, rank_map = {}, {}
+            for rank, (score, row) in enumerate(zip(d_scores, d_rows), start=1):
+                if row < 0:
+                    continue
+                cid = self.meta[row][1]
+                dense_map[cid] = float(score)
+                rank_map[cid] = rank
+
+            with tracer.stage("fuse"):
+                if fusion == "product_rank":
+                    topk = fuse_product_rank(dense_map, sparse_map, rank_map, dense_weight, sparse_weight, K)
+                else:
+                    fused = {cid: dense_weight * sc for cid, sc in dense_map.items()}
+                    for cid, sc in sparse_map.items():
+                        fused[cid] = fused.get(cid, 0.0) + sparse_weight * sc
+                    topk = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:K]
+            return {
+                "qid": q["qid"],
+                "top_chunks": [{"chunk_id": cid, "score": sc} for cid, sc in topk]
+            }
+
+        for b in range(0, len(queries), batch_size):
+            batch = queries[b:b + batch_size]
+            t0 = time.perf_counter()
+            with tracer.stage("encode"):
+                dense, sparse = encode_m3(self.model, [q["question"] for q in batch], batch_size, max_length)
+
+            if semantic_cache is None:
+                with tracer.stage("index_search"):
+                    D, I = self.index.search(dense, min(dense_topk, self.index.ntotal))
+                for q, d_scores, d_rows, q_sparse in zip(batch, D, I, sparse):
+                    output.append(search_fuse(q, d_scores, d_rows, q_sparse))
+            else:
+                # Từng câu hỏi một: câu diễn đạt lại trong cùng batch cũng hit
+                for i, (q, q_sparse) in enumerate(zip(batch, sparse)):
+                    records, _ = semantic_cache.lookup(dense[i:i + 1])
+                    if records[0] is not None:
+                        output.append({"qid": q["qid"], "top_chunks": records[0]["top_chunks"]})
+                        continue
+                    with tracer.stage("index_search"):
+                        D, I = self.index.search(dense[i:i + 1], min(dense_topk, self.index.ntotal))
+                    record = search_fuse(q, D[0], I[0], q_sparse)
+                    semantic_cache.put(dense[i], record, q["question"])
+                    output.append(record)
+
+            elapsed = time.perf_counter() - t0
+            for _ in batch:
+                tracer.observe("query_latency_seconds", elapsed / len(batch))
+            print(f"Processed {min(b + batch_size, len(queries))}/{len(queries)} queries...")
+
+        return output
+
+
+def main():
+    """Build the hybrid index or run hybrid search"""
+    parser = argparse.ArgumentParser(
+        description="Single-pass BGE-M3 dense + learned-sparse retrieval"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Encode chunk corpus and build dense + sparse index")
+    p_build.add_argument("--path_chunk", type=str, required=True, help="Path to chunk corpus JSON file")
+    p_build.add_argument("--path_model", type=str, required=True, help="Path to BGE-M3 model checkpoint")
+    p_build.add_argument("--out_dir", type=str, required=True, help="Output directory for the hybrid index")
+    p_build.add_argument("--batch_size", type=int, default=256, help="Chunks per encode call")
+    p_build.add_argument("--max_length", type=int, default=512, help="Max tokens per chunk")
+
+    p_search = sub.add_parser("search", help="Search questions with one encoder call per batch")
+    p_search.add_argument("--path_test", type=str, required=True, help="Path to test queries JSON file")
+    p_search.add_argument("--index_dir", type=str, required=True, help="Directory written by 'build'")
+    p_search.add_argument("--path_model", type=str, required=True, help="Path to BGE-M3 model checkpoint")
+    p_search.add_argument("--output_file", type=str, required=True, help="Output file path for results JSON")
+    p_search.add_argument("--dense_topk", type=int, default=100, help="Chunks from the dense index (default: 100)")
+    p_search.add_argument("--sparse_topn", type=int, default=2000, help="Chunks from the sparse index (default: 2000)")
+    p_search.add_argument("--K", type=int, default=1000, help="Chunks kept after fusion (default: 1000)")
+    p_search.add_argument("--fusion", type=str, default="product_rank", choices=FUSION_METHODS)
+    p_search.add_argument("--dense_weight", type=float, default=1.0)
+    p_search.add_argument("--sparse_weight", type=float, default=1.0)
+    p_search.add_argument("--batch_size", type=int, default=32, help="Queries per encode call")
+    p_search.add_argument("--max_length", type=int, default=512, help="Max tokens per question")
+    add_tracing_args(p_search)
+    add_cache_args(p_search)
+    add_semantic_cache_args(p_search)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.path_chunk, "r", encoding="utf-8") as f:
+            chunk_data = json.load(f)
+        model = load_m3_model(args.path_model)
+        build_hybrid_index(chunk_data, model, args.out_dir, batch_size=args.batch_size, max_length=args.max_length)
+        return
+
+    init_tracing("bge_m3_hybrid", args.trace_json, args.trace_prom)
+    print("Loading test queries...")
+    with get_tracer().stage("load_questions"):
+        with open(args.path_test, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+    params = {k: getattr(args, k) for k in (
+        "dense_topk", "sparse_topn", "K", "fusion", "dense_weight", "sparse_weight", "max_length", "path_model"
+    )}
+    cache = build_cache(args, "bge_m3_hybrid", [args.index_dir], params)
+    # Exact cache chạy trước; semantic cache chỉ thấy các câu hỏi exact miss
+    semantic_cache = build_semantic_cache(args, "bge_m3_hybrid", [args.index_dir], params)
+
+    def run_search(questions):
+        # Model và index chỉ được load khi có câu hỏi chưa có trong cache
+        searcher = HybridSearcher(args.index_dir, load_m3_model(args.path_model))
+        return searcher.search(
+            questions,
+            dense_topk=args.dense_topk,
+            sparse_topn=args.sparse_topn,
+            K=args.K,
+            fusion=args.fusion,
+            dense_weight=args.dense_weight,
+            sparse_weight=args.sparse_weight,
+            batch_size=args.batch_size,
+            max_length=args.max_length,
+            semantic_cache=semantic_cache,
+        )
+
+    output = cached_search(queries, cache, run_search)
+    save_results(output, args.output_file)
+    if cache is not None:
+        cache.save()
+    if semantic_cache is not None:
+        semantic_cache.print_stats()
+        semantic_cache.save()
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
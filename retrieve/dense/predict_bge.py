@@ -2,12 +2,20 @@
 Script to perform dense retrieval using BGE M3 model and FAISS index
 """
 import json
-import torch
-import faiss
+import os
+import sys
+import time
 import pickle
 import numpy as np
 import argparse
-from sentence_transformers import SentenceTransformer
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+from utils.checkpoint import add_checkpoint_args, run_checkpointed
+from utils.result_cache import add_cache_args, build_cache, cached_search, index_fingerprint
 
 
 def load_data(path_test: str, path_index: str, path_meta: str):
@@ -24,18 +32,40 @@ def load_data(path_test: str, path_index: str, path_meta: str):
         index: FAISS index object
         meta: List of (aid, chunk_id) tuples
     """
+    queries = load_queries(path_test)
+    index, meta = load_index(path_index, path_meta)
+    return queries, index, meta
+
+
+def load_queries(path_test: str):
+    """Load test queries"""
     print("Loading test queries...")
-    with open(path_test, "r", encoding="utf-8") as f:
-        queries = json.load(f)
-    
+    with get_tracer().stage("load_questions"):
+        with open(path_test, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def load_index(path_index: str, path_meta: str):
+    """
+    Load FAISS index and metadata
+
+    Returns:
+        index: FAISS index object
+        meta: List of (aid, chunk_id) tuples
+    """
+    tracer = get_tracer()
+
     print("Loading FAISS index...")
-    index = faiss.read_index(path_index)
+    with tracer.stage("load_index"):
+        import faiss
+        index = faiss.read_index(path_index)
     
     print("Loading metadata...")
-    with open(path_meta, "rb") as f:
-        meta = pickle.load(f)
+    with tracer.stage("load_meta"):
+        with open(path_meta, "rb") as f:
+            meta = pickle.load(f)
     
-    return queries, index, meta
+    return index, meta
 
 
 def load_model(model_path: str):
@@ -49,10 +79,15 @@ def load_model(model_path: str):
         model: SentenceTransformer model
         device: Device (cuda or cpu)
     """
+    # Import ở đây để search_and_build_results dùng được với encoder khác (benchmark)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
     print("Loading BGE M3 model...")
-    model = SentenceTransformer(model_path)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
+    with get_tracer().stage("load_model"):
+        model = SentenceTransformer(model_path)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model.to(device)
     print(f"Model loaded on device: {device}")
     
     return model, device
@@ -73,35 +108,42 @@ def search_and_build_results(queries, model, index, meta, topk: int = 100):
         output: List of results with qid and top_chunks
     """
     print(f"Processing {len(queries)} queries...")
+    tracer = get_tracer()
     output = []
     
     for i, q in enumerate(queries):
         if (i + 1) % 10 == 0:
             print(f"Processed {i + 1}/{len(queries)} queries...")
-            
+
+        t0 = time.perf_counter()
         qid = q["qid"]
         question = q["question"]
 
         # Encode query
-        q_emb = model.encode(
-            question, 
-            normalize_embeddings=True, 
-            convert_to_numpy=True
-        )
+        with tracer.stage("encode"):
+            q_emb = model.encode(
+                question, 
+                normalize_embeddings=True, 
+                convert_to_numpy=True
+            )
 
         # Search top-k
-        D, I = index.search(np.array([q_emb]), k=topk)
+        with tracer.stage("index_search"):
+            D, I = index.search(np.array([q_emb]), k=topk)
 
         # Chuyển thành list các dict {\"chunk_id\": ..., \"score\": ...}
-        top_chunks = [
-            {"chunk_id": meta[idx][1], "score": float(D[0][j])}
-            for j, idx in enumerate(I[0])
-        ]
+        with tracer.stage("build_results"):
+            top_chunks = [
+                {"chunk_id": meta[idx][1], "score": float(D[0][j])}
+                for j, idx in enumerate(I[0])
+            ]
 
         output.append({
             "qid": qid,
             "top_chunks": top_chunks
         })
+        tracer.observe("query_latency_seconds", time.perf_counter() - t0)
+        tracer.count("candidates", len(top_chunks))
     
     return output
 
@@ -115,8 +157,9 @@ def save_results(output, output_file: str):
         output_file: Output file path
     """
     print(f"Saving results to {output_file}...")
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    with get_tracer().stage("serialize"):
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
     
     print("✅ Đã lưu kết quả")
 
@@ -162,20 +205,53 @@ def main():
         default=100,
         help="Number of top results to retrieve (default: 100)"
     )
+    add_tracing_args(parser)
+    add_cache_args(parser)
+    add_checkpoint_args(parser)
     
     args = parser.parse_args()
+    init_tracing("predict_bge", args.trace_json, args.trace_prom)
+    # Checkpoint cục bộ cũng nằm trong fingerprint (fine-tune lại -> cache mới)
+    model_files = [args.path_model] if os.path.exists(args.path_model) else []
+    cache = build_cache(
+        args, "predict_bge", [args.path_index, args.path_meta] + model_files,
+        {"topk": args.topk, "model": args.path_model}
+    )
     
     # Load data
-    queries, index, meta = load_data(args.path_test, args.path_index, args.path_meta)
-    
-    # Load model
-    model, device = load_model(args.path_model)
-    
-    # Search and build results
-    output = search_and_build_results(queries, model, index, meta, topk=args.topk)
-    
-    # Save results
-    save_results(output, args.output_file)
+    queries = load_queries(args.path_test)
+
+    loaded = {}
+
+    def run_search(questions):
+        # Index, metadata và model chỉ được load khi có câu hỏi chưa có trong cache, và chỉ một lần
+        if not loaded:
+            loaded["index"], loaded["meta"] = load_index(args.path_index, args.path_meta)
+            loaded["model"], _ = load_model(args.path_model)
+        return search_and_build_results(
+            questions, loaded["model"], loaded["index"], loaded["meta"], topk=args.topk
+        )
+
+    if args.checkpoint:
+        fingerprint = index_fingerprint(
+            [args.path_test, args.path_index, args.path_meta] + model_files,
+            {"topk": args.topk, "model": args.path_model}
+        )
+        stats = run_checkpointed(
+            queries, lambda qs: cached_search(qs, cache, run_search), args.output_file,
+            fingerprint, args.checkpoint_every, args.overwrite, args.keep_checkpoint
+        )
+        print(f"✅ Đã lưu {stats['written']} kết quả ({stats['skipped']} câu hỏi lấy từ checkpoint)")
+    else:
+        # Search and build results
+        output = cached_search(queries, cache, run_search)
+
+        # Save results
+        save_results(output, args.output_file)
+    if cache is not None:
+        cache.save()
+
+    finish_tracing()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,376 @@
+"""
+Script to perform scatter-gather dense retrieval over shard workers
+
+The coordinator encodes queries with BGE M3, broadcasts the embeddings to
+every shard worker (shard_worker.py), gathers the per-shard top-k and merges
+them into the predict_bge.py result schema. Workers that fail or miss the
+timeout are skipped: the query still gets results from the remaining shards
+and is marked with "partial": true and the list of missing shards.
+
+Workers can run on other hosts (--workers host:port,...) or be started
+locally from a shard directory (--shard_dir), which is how it is tested on
+one machine. Worker cục bộ dùng authkey ngẫu nhiên sinh cho mỗi lần chạy;
+worker trên host khác dùng key chung đặt trong VLSP_SHARD_AUTHKEY.
+"""
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+import pickle
+import argparse
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from retrieve.dense.predict_bge import load_model, save_results
+from retrieve.dense.shard_worker import ENV_AUTHKEY, env_authkey
+from retrieve.dense.split_index import MANIFEST
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+
+def parse_addresses(workers: str):
+    """'host1:port1,host2:port2' -> [(host1, port1), (host2, port2)]"""
+    addresses = []
+    for item in workers.split(","):
+        host, port = item.strip().rsplit(":", 1)
+        addresses.append((host, int(port)))
+    return addresses
+
+
+class ScatterGatherSearcher:
+    """
+    Broadcast query embeddings to shard workers and merge their top-k
+
+    Args:
+        addresses: List of (host, port) of the shard workers
+        authkey: Shared key used by the workers
+        timeout: Seconds to wait for all shards per request
+        metric: "ip" (higher is better) or "l2" (lower is better)
+    """
+
+    def __init__(self, addresses, authkey: bytes, timeout: float = 10.0, metric: str = "ip"):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.metric = metric
+        self.conns = [None] * len(self.addresses)
+
+    def _connect(self, s):
+        if self.conns[s] is None:
+            self.conns[s] = Client(self.addresses[s], authkey=self.authkey)
+        return self.conns[s]
+
+    def _drop(self, s):
+        if self.conns[s] is not None:
+            try:
+                self.conns[s].close()
+            except OSError:
+                pass
+            self.conns[s] = None
+
+    def close(self):
+        for s in range(len(self.conns)):
+            self._drop(s)
+
+    def ping(self):
+        """Return the shard info of every reachable worker (None if unreachable)."""
+        infos = []
+        for s in range(len(self.addresses)):
+            try:
+                conn = self._connect(s)
+                conn.send(("ping",))
+                infos.append(conn.recv()[1] if conn.poll(self.timeout) else None)
+            except (OSError, EOFError):
+                self._drop(s)
+                infos.append(None)
+        return infos
+
+    def search(self, embeddings, k: int):
+        """
+        Search all shards
+
+        Returns:
+            D: (n_queries, k) merged scores
+            I: (n_queries, k) global FAISS rows (-1 if fewer than k results)
+            missing: list of shard indices that did not answer
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        pending, missing = [], []
+
+        # 1) Scatter: gửi request tới tất cả shard trước, rồi mới chờ
+        for s in range(len(self.addresses)):
+            try:
+                self._connect(s).send(("search", embeddings, k))
+                pending.append(s)
+            except (OSError, EOFError):
+                self._drop(s)
+                missing.append(s)
+
+        # 2) Gather với deadline chung cho cả request
+        deadline = time.monotonic() + self.timeout
+        parts = []
+        for s in pending:
+            conn = self.conns[s]
+            try:
+                if not conn.poll(max(0.0, deadline - time.monotonic())):
+                    raise TimeoutError(f"shard {s} timed out")
+                response = conn.recv()
+                if response[0] != "ok":
+                    raise RuntimeError(response[1])
+                parts.append((response[1], response[2]))
+            except (OSError, EOFError, TimeoutError, RuntimeError) as e:
+                print(f"Warning: shard {s} {self.addresses[s]} failed: {type(e).__name__} {e}")
+                # Kết nối có thể còn response dở dang -> bỏ, lần sau kết nối lại
+                self._drop(s)
+                missing.append(s)
+
+        D, I = self.merge(parts, len(embeddings), k)
+        return D, I, sorted(missing)
+
+    def merge(self, parts, n_queries: int, k: int):
+        """Merge per-shard (D, I) into the global top-k per query."""
+        fill = -np.inf if self.metric == "ip" else np.inf
+        if not parts:
+            return np.full((n_queries, k), fill, dtype=np.float32), np.full((n_queries, k), -1, dtype=np.int64)
+        D = np.concatenate([p[0] for p in parts], axis=1)
+        I = np.concatenate([p[1] for p in parts], axis=1).astype(np.int64)
+        D = np.where(I >= 0, D, fill)
+        key = -D if self.metric == "ip" else D
+        D_out = np.full((n_queries, k), fill, dtype=np.float32)
+        I_out = np.full((n_queries, k), -1, dtype=np.int64)
+        for q in range(n_queries):
+            # Sắp theo điểm, tie theo row nhỏ hơn trước
+            order = np.lexsort((I[q], key[q]))[:k]
+            n = len(order)
+            D_out[q, :n] = D[q, order]
+            I_out[q, :n] = I[q, order]
+        return D_out, I_out
+
+
+def _handshake(address, authkey: bytes, timeout: float):
+    """Ping one worker; returns its shard info, or None if it does not accept our key yet."""
+    try:
+        with Client(address, authkey=authkey) as conn:
+            conn.send(("ping",))
+            if not conn.poll(timeout):
+                return None
+            response = conn.recv()
+    except (OSError, EOFError, AuthenticationError):
+        return None
+    return response[1] if response[0] == "ok" else None
+
+
+def _kill_workers(procs, timeout: float = 5.0):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+    for proc in procs:
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def launch_local_workers(shard_dir: str, host: str = "127.0.0.1", base_port: int = 50100,
+                         startup_timeout: float = 120.0):
+    """
+    Start one shard_worker.py process per shard on this machine
+
+    Mỗi lần chạy sinh authkey ngẫu nhiên (truyền cho worker qua biến môi
+    trường), nên worker cũ còn sót lại trên cùng port không qua được bước
+    xác thực. Worker chỉ được coi là sẵn sàng khi process vừa start còn sống
+    và trả lời ping với đúng pid, shard_id và shard_dir; nếu không, mọi worker
+    đã start bị kill trước khi raise.
+
+    Returns:
+        procs: list of subprocess.Popen
+        addresses: list of (host, port)
+        authkey: Key of this run (bytes)
+    """
+    with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+        num_shards = len(json.load(f)["shards"])
+
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shard_worker.py")
+    authkey = secrets.token_hex(32).encode()
+    env = dict(os.environ, **{ENV_AUTHKEY: authkey.decode()})
+    shard_dir = os.path.abspath(shard_dir)
+    procs, addresses = [], []
+    try:
+        for s in range(num_shards):
+            port = base_port + s
+            procs.append(subprocess.Popen(
+                [sys.executable, worker_script, "--shard_dir", shard_dir, "--shard_id", str(s),
+                 "--host", host, "--port", str(port)],
+                env=env,
+            ))
+            addresses.append((host, port))
+
+        # Chờ tới khi mọi worker vừa start nhận kết nối và tự xác nhận đúng shard
+        deadline = time.monotonic() + startup_timeout
+        for s, address in enumerate(addresses):
+            while True:
+                if procs[s].poll() is not None:
+                    raise RuntimeError(f"Shard worker {s} exited with code {procs[s].returncode} "
+                                       f"(is {address[0]}:{address[1]} already in use?)")
+                info = _handshake(address, authkey, timeout=5.0)
+                if info is not None:
+                    expected = {"pid": procs[s].pid, "shard_id": s, "shard_dir": shard_dir}
+                    got = {key: info.get(key) for key in expected}
+                    if got != expected:
+                        raise RuntimeError(f"Worker on {address[0]}:{address[1]} is not shard worker {s}: "
+                                           f"expected {expected}, got {got}")
+                    break
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Shard worker {s} did not start on {address}")
+                time.sleep(0.2)
+    except BaseException:
+        _kill_workers(procs)
+        raise
+    return procs, addresses, authkey
+
+
+def shutdown_workers(searcher: ScatterGatherSearcher, procs=None, timeout: float = 10.0):
+    """Ask every worker to stop, then wait for local processes."""
+    for s in range(len(searcher.addresses)):
+        try:
+            conn = searcher._connect(s)
+            conn.send(("shutdown",))
+            if conn.poll(timeout):
+                conn.recv()
+        except (OSError, EOFError):
+            pass
+        searcher._drop(s)
+    for proc in procs or []:
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def search_and_build_results(queries, model, searcher, meta, topk: int = 100, batch_size: int = 64):
+    """
+    Encode queries in batches, scatter-gather search and build results
+
+    Args:
+        queries: List of query dictionaries with 'qid' and 'question'
+        model: SentenceTransformer model (or any object with .encode)
+        searcher: ScatterGatherSearcher
+        meta: Metadata list of (aid, chunk_id) tuples
+        topk: Number of top results to retrieve
+        batch_size: Queries per broadcast
+
+    Returns:
+        output: List of results with qid and top_chunks (same schema as predict_bge.py)
+    """
+    print(f"Processing {len(queries)} queries...")
+    tracer = get_tracer()
+    output = []
+    n_partial = 0
+
+    for b in range(0, len(queries), batch_size):
+        batch = queries[b:b + batch_size]
+        t0 = time.perf_counter()
+        with tracer.stage("encode"):
+            q_embs = model.encode(
+                [q["question"] for q in batch],
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+        with tracer.stage("index_search"):
+            D, I, missing = searcher.search(q_embs, topk)
+        with tracer.stage("build_results"):
+            for q, scores, rows in zip(batch, D, I):
+                top_chunks = [
+                    {"chunk_id": meta[idx][1], "score": float(score)}
+                    for score, idx in zip(scores, rows) if idx >= 0
+                ]
+                record = {"qid": q["qid"], "top_chunks": top_chunks}
+                if missing:
+                    record["partial"] = True
+                    record["missing_shards"] = missing
+                output.append(record)
+                tracer.count("candidates", len(top_chunks))
+        if missing:
+            n_partial += len(batch)
+        elapsed = time.perf_counter() - t0
+        for _ in batch:
+            tracer.observe("query_latency_seconds", elapsed / len(batch))
+        print(f"Processed {min(b + batch_size, len(queries))}/{len(queries)} queries...")
+
+    if n_partial:
+        print(f"Warning: {n_partial} queries have partial results (missing shards)")
+    return output
+
+
+def main():
+    """Main function to run the scatter-gather prediction pipeline"""
+    parser = argparse.ArgumentParser(
+        description="Scatter-gather dense retrieval over shard workers"
+    )
+    parser.add_argument("--path_test", type=str, required=True, help="Path to test queries JSON file")
+    parser.add_argument("--path_meta", type=str, required=True, help="Path to corpus_meta.pkl file")
+    parser.add_argument("--path_model", type=str, required=True, help="Path to BGE M3 model checkpoint")
+    parser.add_argument("--output_file", type=str, required=True, help="Output file path for results JSON")
+    parser.add_argument("--workers", type=str, default=None,
+                        help="Comma-separated host:port of running shard workers")
+    parser.add_argument("--shard_dir", type=str, default=None,
+                        help="Start local workers for the shards in this directory (split_index.py output)")
+    parser.add_argument("--base_port", type=int, default=50100, help="First port for local workers")
+    parser.add_argument("--metric", type=str, default="ip", choices=["ip", "l2"],
+                        help="Index metric when using --workers (read from the manifest with --shard_dir)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for shards per batch")
+    parser.add_argument("--batch_size", type=int, default=64, help="Queries per broadcast")
+    parser.add_argument("--topk", type=int, default=100, help="Number of top results to retrieve (default: 100)")
+    add_tracing_args(parser)
+
+    args = parser.parse_args()
+    if not args.workers and not args.shard_dir:
+        parser.error("either --workers or --shard_dir is required")
+    init_tracing("predict_bge_sharded", args.trace_json, args.trace_prom)
+
+    if not args.shard_dir and env_authkey() is None:
+        parser.error(f"--workers needs {ENV_AUTHKEY} set to the key the workers were started with")
+    procs, searcher = [], None
+    try:
+        metric = args.metric
+        if args.shard_dir:
+            with open(os.path.join(args.shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+                metric = json.load(f)["metric"]
+            print("Starting local shard workers...")
+            procs, addresses, authkey = launch_local_workers(args.shard_dir, base_port=args.base_port)
+        else:
+            addresses, authkey = parse_addresses(args.workers), env_authkey()
+        searcher = ScatterGatherSearcher(addresses, authkey, timeout=args.timeout, metric=metric)
+
+        print("Loading test queries...")
+        with open(args.path_test, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+        print("Loading metadata...")
+        with open(args.path_meta, "rb") as f:
+            meta = pickle.load(f)
+
+        model, device = load_model(args.path_model)
+        output = search_and_build_results(
+            queries, model, searcher, meta, topk=args.topk, batch_size=args.batch_size
+        )
+        save_results(output, args.output_file)
+    finally:
+        if searcher is not None:
+            if procs:
+                shutdown_workers(searcher, procs)
+            searcher.close()
+        elif procs:
+            _kill_workers(procs)
+
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
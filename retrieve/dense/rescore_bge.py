@@ -0,0 +1,257 @@
+"""
+Script to rescore BM25 candidates with BGE M3 instead of searching the whole FAISS index
+
+predict_bge.py tìm trên toàn bộ corpus (O(corpus) mỗi câu hỏi) dù top-N của
+BM25 thường đã chứa các điều luật liên quan. Script này:
+
+    1) Đọc kết quả của search.py, lấy top-N chunk_id của BM25 cho mỗi câu hỏi
+    2) Lấy vector của các row đó từ FAISS index (reconstruct), từ thư mục shard
+       của split_index.py hoặc từ file .npy (memory-map)
+    3) Encode câu hỏi và tính điểm dense chính xác cho N row bằng một phép nhân
+       ma trận-vector, O(N) mỗi câu hỏi
+    4) Ghi kết quả theo định dạng của predict_bge.py; tùy chọn ghép luôn với
+       BM25 bằng product_rank (fuse_product_rank của ensemble_with_bm25.py)
+
+Điểm của một row giống điểm FAISS trả về cho row đó; chỉ khác predict_bge.py ở
+chỗ các chunk ngoài top-N của BM25 không được xét.
+
+Example:
+    python retrieve/dense/rescore_bge.py --path_test data/processed/test.json \
+        --path_bm25_results results/test/bm25_test.json --vectors data/faiss_index/bge.bin \
+        --path_meta data/faiss_index/corpus_meta.pkl --path_model BAAI/bge-m3 \
+        --top_n 2000 --output_file results/test/bge_rescore_test.json \
+        --fused_output results/test/product_rank_rescore_test.json
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+
+class VectorStore:
+    """
+    Row -> vector access to the chunk embeddings
+
+    Args:
+        path: FAISS index (bge.bin), shard directory of split_index.py or .npy file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = None
+        self._shards = None
+        self._array = None
+        if os.path.isdir(path):
+            from retrieve.dense.split_index import MANIFEST
+            with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._shards = [
+                (s["start"], s["end"], np.load(os.path.join(path, s["name"]), mmap_mode="r"))
+                for s in manifest["shards"]
+            ]
+            self._starts = np.array([s[0] for s in self._shards], dtype=np.int64)
+            self.ntotal, self.dim, self.metric = manifest["ntotal"], manifest["dim"], manifest["metric"]
+        elif path.endswith(".npy"):
+            self._array = np.load(path, mmap_mode="r")
+            self.ntotal, self.dim = self._array.shape
+            self.metric = "ip"
+        else:
+            import faiss
+            self._index = faiss.read_index(path)
+            try:
+                # IVF cần direct map để reconstruct theo row
+                faiss.extract_index_ivf(self._index).make_direct_map()
+            except RuntimeError:
+                pass
+            self.ntotal, self.dim = self._index.ntotal, self._index.d
+            self.metric = "ip" if self._index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+    def gather(self, rows) -> np.ndarray:
+        """Vectors of the given rows, (len(rows), dim) float32 in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._array is not None:
+            # Đọc memmap theo thứ tự row tăng dần rồi trả về đúng thứ tự yêu cầu
+            order = np.argsort(rows, kind="stable")
+            out = np.empty((len(rows), self.dim), dtype=np.float32)
+            out[order] = self._array[rows[order]]
+            return out
+        if self._shards is not None:
+            out = np.empty((len(rows), self.dim), dtype=np.float32)
+            shard_ids = np.searchsorted(self._starts, rows, side="right") - 1
+            for s in np.unique(shard_ids):
+                mask = shard_ids == s
+                start, _, vectors = self._shards[s]
+                out[mask] = vectors[rows[mask] - start]
+            return out
+        return self._index.reconstruct_batch(rows)
+
+
+def rescore_rows(q_emb: np.ndarray, vectors: np.ndarray, metric: str = "ip"):
+    """
+    Exact dense scores of one query against the candidate vectors
+
+    Returns:
+        scores: (n,) inner products, or squared L2 distances for metric "l2"
+        order: Candidate positions from best to worst (ties keep candidate order)
+    """
+    if metric == "ip":
+        scores = vectors @ q_emb
+        order = np.argsort(-scores, kind="stable")
+    else:
+        diff = vectors - q_emb
+        scores = np.einsum("ij,ij->i", diff, diff)
+        order = np.argsort(scores, kind="stable")
+    return scores, order
+
+
+def load_bm25_candidates(path: str, top_n: int):
+    """search.py results -> {qid: top_chunks[:top_n]} (BM25 order kept)."""
+    with get_tracer().stage("load_runs"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    return {rec["qid"]: rec.get("top_chunks", [])[:top_n] for rec in data}
+
+
+def load_row_map(path_meta: str):
+    """chunk_id -> FAISS row from corpus_meta.pkl or a chunk store directory."""
+    with get_tracer().stage("load_meta"):
+        if os.path.isdir(path_meta):
+            from utils.chunk_store import ChunkIdView
+            return {cid: row for row, cid in enumerate(ChunkIdView(path_meta))}
+        with open(path_meta, "rb") as f:
+            meta = pickle.load(f)
+        return {cid: row for row, (_, cid) in enumerate(meta)}
+
+
+def rescore_and_build_results(queries, candidates, model, store, row_map, topk: int = 100,
+                              batch_size: int = 32):
+    """
+    Encode queries and rescore their BM25 candidates
+
+    Args:
+        queries: List of {"qid", "question"}
+        candidates: {qid: BM25 top_chunks}
+        model: SentenceTransformer-compatible encoder
+        store: VectorStore
+        row_map: chunk_id -> row
+        topk: Number of dense results kept per query
+        batch_size: Encode batch size
+
+    Returns:
+        output: List of {"qid", "top_chunks"} as predict_bge.py
+    """
+    tracer = get_tracer()
+    print(f"Encoding {len(queries)} queries...")
+    with tracer.stage("encode"):
+        q_embs = model.encode(
+            [q["question"] for q in queries],
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+    q_embs = np.asarray(q_embs, dtype=np.float32)
+
+    output = []
+    for q, q_emb in zip(queries, q_embs):
+        t0 = time.perf_counter()
+        cids = [c["chunk_id"] for c in candidates.get(q["qid"], [])]
+        known = [cid for cid in cids if cid in row_map]
+        if len(known) < len(cids):
+            tracer.count("unknown_chunk_ids", len(cids) - len(known))
+
+        with tracer.stage("gather_vectors"):
+            vectors = store.gather([row_map[cid] for cid in known])
+        with tracer.stage("rescore"):
+            scores, order = rescore_rows(q_emb, vectors, store.metric)
+
+        with tracer.stage("build_results"):
+            top_chunks = [
+                {"chunk_id": known[j], "score": float(scores[j])}
+                for j in order[:topk]
+            ]
+        output.append({"qid": q["qid"], "top_chunks": top_chunks})
+        tracer.observe("query_latency_seconds", time.perf_counter() - t0)
+        tracer.count("candidates", len(known))
+    return output
+
+
+def fuse_with_bm25(dense_output, candidates, model_weight: float = 1.0, bm25_weight: float = 1.0,
+                   K: int = 1000):
+    """product_rank fusion of the rescored results with the BM25 candidates."""
+    from utils.ensemble_with_bm25 import fuse_product_rank
+
+    fused = []
+    with get_tracer().stage("fuse"):
+        for rec in dense_output:
+            model_map = {c["chunk_id"]: c["score"] for c in rec["top_chunks"]}
+            rank_map = {c["chunk_id"]: i for i, c in enumerate(rec["top_chunks"], start=1)}
+            bm25_map = {c["chunk_id"]: c["score"] for c in candidates.get(rec["qid"], [])}
+            topk = fuse_product_rank(model_map, bm25_map, rank_map, model_weight, bm25_weight, K)
+            fused.append({
+                "qid": rec["qid"],
+                "top_chunks": [{"chunk_id": cid, "score": sc} for cid, sc in topk]
+            })
+    return fused
+
+
+def _save(output, path: str):
+    print(f"Saving results to {path}...")
+    with get_tracer().stage("serialize"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rescore BM25 candidates with BGE M3 (no full FAISS search)")
+    parser.add_argument("--path_test", type=str, required=True, help="Path to test queries JSON file")
+    parser.add_argument("--path_bm25_results", type=str, required=True, help="search.py results JSON")
+    parser.add_argument("--vectors", type=str, required=True,
+                        help="FAISS index, split_index.py shard directory or .npy embeddings")
+    parser.add_argument("--path_meta", type=str, required=True,
+                        help="corpus_meta.pkl or chunk store directory (chunk_id -> row)")
+    parser.add_argument("--path_model", type=str, required=True, help="Path to BGE M3 model checkpoint")
+    parser.add_argument("--output_file", type=str, required=True, help="Output file for the dense results")
+    parser.add_argument("--top_n", type=int, default=2000, help="BM25 candidates rescored per query")
+    parser.add_argument("--topk", type=int, default=100, help="Dense results kept per query (default: 100)")
+    parser.add_argument("--batch_size", type=int, default=32, help="Encode batch size")
+    parser.add_argument("--fused_output", type=str, default=None,
+                        help="Also write the product_rank fusion with BM25 here")
+    parser.add_argument("--model_weight", type=float, default=1.0, help="Dense weight for --fused_output")
+    parser.add_argument("--bm25_weight", type=float, default=1.0, help="BM25 weight for --fused_output")
+    parser.add_argument("--K", type=int, default=1000, help="Fused results per query")
+    add_tracing_args(parser)
+    args = parser.parse_args()
+    init_tracing("rescore_bge", args.trace_json, args.trace_prom)
+
+    from retrieve.dense.predict_bge import load_model, load_queries
+
+    queries = load_queries(args.path_test)
+    candidates = load_bm25_candidates(args.path_bm25_results, args.top_n)
+    row_map = load_row_map(args.path_meta)
+    with get_tracer().stage("load_index"):
+        store = VectorStore(args.vectors)
+    if store.ntotal != len(row_map):
+        raise ValueError(f"{args.vectors} has {store.ntotal} vectors but {args.path_meta} has {len(row_map)} chunks")
+    model, _ = load_model(args.path_model)
+
+    output = rescore_and_build_results(queries, candidates, model, store, row_map, args.topk, args.batch_size)
+    _save(output, args.output_file)
+    if args.fused_output:
+        _save(fuse_with_bm25(output, candidates, args.model_weight, args.bm25_weight, args.K), args.fused_output)
+
+    print("✅ Đã lưu kết quả")
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
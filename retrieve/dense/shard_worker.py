@@ -0,0 +1,158 @@
+"""
+Script to serve one dense vector shard over a socket for scatter-gather search
+
+The worker loads one shard written by split_index.py into a flat FAISS index
+and answers search requests from predict_bge_sharded.py. Requests and
+responses are pickled tuples sent over multiprocessing.connection, which
+authenticates both sides with a shared authkey taken from VLSP_SHARD_AUTHKEY
+(predict_bge_sharded.py sinh key ngẫu nhiên cho mỗi lần chạy worker cục bộ).
+Không có key mặc định: ai kết nối được vào port với đúng key là gửi được
+pickle, nên worker chỉ bind host ngoài loopback khi key được đặt tường minh:
+
+    ("ping",)                    -> ("ok", {"start", "end", "dim", "shard_id", "shard_dir", "pid"})
+    ("search", embeddings, k)    -> ("ok", D, I)   # I are global FAISS rows
+    ("shutdown",)                -> ("ok", None)
+"""
+import argparse
+import ipaddress
+import json
+import os
+import socket
+import sys
+import threading
+from multiprocessing.connection import Listener
+
+import faiss
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from retrieve.dense.split_index import MANIFEST
+
+ENV_AUTHKEY = "VLSP_SHARD_AUTHKEY"
+
+
+def is_loopback(host: str) -> bool:
+    """True if every address host resolves to is a loopback address."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0].split("%")[0]).is_loopback for info in infos)
+
+
+def env_authkey():
+    """Authkey from VLSP_SHARD_AUTHKEY as bytes, or None if unset / empty."""
+    key = os.environ.get(ENV_AUTHKEY, "")
+    return key.encode() if key else None
+
+
+def load_shard(shard_dir: str, shard_id: int):
+    """
+    Load one shard into a flat FAISS index
+
+    Returns:
+        index: faiss.IndexFlat over the shard vectors
+        info: dict with the global row range of the shard
+    """
+    with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    info = manifest["shards"][shard_id]
+    vectors = np.load(os.path.join(shard_dir, info["name"]))
+    if manifest["metric"] == "ip":
+        index = faiss.IndexFlatIP(manifest["dim"])
+    else:
+        index = faiss.IndexFlatL2(manifest["dim"])
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index, {
+        "start": info["start"],
+        "end": info["end"],
+        "dim": manifest["dim"],
+        "shard_id": shard_id,
+        "shard_dir": os.path.abspath(shard_dir),
+        "pid": os.getpid(),
+    }
+
+
+def handle_connection(conn, index, info, stop_event):
+    """Answer requests on one coordinator connection until it closes."""
+    start = info["start"]
+    with conn:
+        while not stop_event.is_set():
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            op = request[0]
+            try:
+                if op == "ping":
+                    conn.send(("ok", info))
+                elif op == "search":
+                    _, embeddings, k = request
+                    k = min(k, index.ntotal)
+                    D, I = index.search(np.ascontiguousarray(embeddings, dtype=np.float32), k)
+                    # Đổi row local của shard thành row toàn cục (khớp corpus_meta.pkl)
+                    I = np.where(I >= 0, I + start, -1)
+                    conn.send(("ok", D, I))
+                elif op == "shutdown":
+                    conn.send(("ok", None))
+                    stop_event.set()
+                    return
+                else:
+                    conn.send(("error", f"unknown op: {op}"))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def serve(shard_dir: str, shard_id: int, host: str, port: int, authkey: bytes):
+    """Serve one shard until a shutdown request arrives."""
+    if not authkey:
+        raise ValueError(f"an authkey is required (set {ENV_AUTHKEY})")
+    if not is_loopback(host) and env_authkey() is None:
+        raise ValueError(f"refusing to listen on non-loopback host {host!r} without {ENV_AUTHKEY} set explicitly")
+    print(f"Loading shard {shard_id} from {shard_dir}...")
+    index, info = load_shard(shard_dir, shard_id)
+    stop_event = threading.Event()
+
+    def accept_loop(listener):
+        while not stop_event.is_set():
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Rejected connection: {e}")
+                continue
+            threading.Thread(
+                target=handle_connection, args=(conn, index, info, stop_event), daemon=True
+            ).start()
+
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"Shard {shard_id} rows [{info['start']}, {info['end']}) listening on {host}:{port}", flush=True)
+        # accept() chặn, nên chạy trong daemon thread; thread chính chờ lệnh shutdown
+        threading.Thread(target=accept_loop, args=(listener,), daemon=True).start()
+        stop_event.wait()
+    print(f"Shard {shard_id} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve one dense vector shard for scatter-gather search"
+    )
+    parser.add_argument("--shard_dir", type=str, required=True, help="Directory written by split_index.py")
+    parser.add_argument("--shard_id", type=int, required=True, help="Index of the shard to serve")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, required=True, help="Port to bind")
+
+    args = parser.parse_args()
+    authkey = env_authkey()
+    if authkey is None:
+        parser.error(f"{ENV_AUTHKEY} must be set to the key shared with the coordinator")
+
+    serve(
+        shard_dir=args.shard_dir,
+        shard_id=args.shard_id,
+        host=args.host,
+        port=args.port,
+        authkey=authkey
+    )
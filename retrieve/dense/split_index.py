@@ -0,0 +1,88 @@
+"""
+Script to split a flat FAISS index into vector shards for scatter-gather search
+"""
+import argparse
+import json
+import os
+
+import faiss
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def split_index(path_index: str, out_dir: str, num_shards: int, batch_size: int = 100000):
+    """
+    Chia các vector của FAISS index thành num_shards shard liên tiếp
+
+    Args:
+        path_index: Đường dẫn đến FAISS index (bge.bin)
+        out_dir: Thư mục output, mỗi shard là một file .npy
+        num_shards: Số shard
+        batch_size: Số vector reconstruct mỗi lần
+
+    Returns:
+        manifest: dict mô tả các shard (row range toàn cục của mỗi shard)
+    """
+    print("Loading FAISS index...")
+    index = faiss.read_index(path_index)
+    n, dim = index.ntotal, index.d
+    num_shards = max(1, min(num_shards, n))
+    os.makedirs(out_dir, exist_ok=True)
+
+    bounds = np.linspace(0, n, num_shards + 1).astype(np.int64)
+    shards = []
+    for s in range(num_shards):
+        start, end = int(bounds[s]), int(bounds[s + 1])
+        vectors = np.empty((end - start, dim), dtype=np.float32)
+        for i in range(start, end, batch_size):
+            j = min(i + batch_size, end)
+            vectors[i - start:j - start] = index.reconstruct_n(i, j - i)
+        name = f"shard_{s:03d}.npy"
+        np.save(os.path.join(out_dir, name), vectors)
+        shards.append({"name": name, "start": start, "end": end})
+        print(f"Shard {s}: rows [{start}, {end})")
+
+    manifest = {
+        "ntotal": int(n),
+        "dim": int(dim),
+        "metric": "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"✅ Đã lưu {num_shards} shard vào {out_dir}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split a FAISS index into vector shards"
+    )
+    parser.add_argument(
+        "--path_index",
+        type=str,
+        required=True,
+        help="Path to FAISS index file"
+    )
+    parser.add_argument(
+        "--out_dir",
+        type=str,
+        required=True,
+        help="Output directory for the shards"
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        required=True,
+        help="Number of shards"
+    )
+
+    args = parser.parse_args()
+
+    split_index(
+        path_index=args.path_index,
+        out_dir=args.out_dir,
+        num_shards=args.num_shards
+    )
@@ -0,0 +1,270 @@
+"""
+Script to mine hard negatives for reranker fine-tuning
+
+Tạo training data cho notebook fine-tune reranker (FlagEmbedding,
+``--train_group_size 12``) từ data/processed/train.json:
+
+    1) BM25 trên shard (shard_bm25.py, tokenize + chấm điểm song song trên pool)
+       và dense (FAISS) cho từng batch câu hỏi
+    2) Lấy ứng viên trong các cửa sổ rank cấu hình được (vd. BM25 rank 10-100,
+       dense rank 5-50), bỏ mọi chunk thuộc relevant_laws, rồi sample negatives
+    3) Lấy text từ chunk store (utils/chunk_store.py), ghi JSONL dạng
+       {"query": str, "pos": [str], "neg": [str]}
+
+Output được ghi theo batch; file trạng thái ``<output>.state.json`` lưu số câu
+hỏi đã xong và số byte hợp lệ của output, nên chạy lại cùng lệnh sẽ tiếp tục
+từ batch dở dang. Sample dùng seed theo qid nên kết quả không phụ thuộc vào
+việc bị ngắt giữa chừng.
+
+Example:
+    python retrieve/rerank/mine_hard_negatives.py --path_train data/processed/train.json \
+        --chunk_store data/processed/chunked/chunk_store --shard_dir retrieve/sparse/bm25_shards \
+        --path_index data/faiss_index/bge.bin --path_model BAAI/bge-m3 \
+        --output data/processed/rerank/training.jsonl --num_neg 11
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.chunk_store import ChunkStore
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+
+def parse_window(text: str):
+    """'10:100' -> (10, 100): rank 10 tới 100 (tính từ 1, gồm cả hai đầu)."""
+    start, end = (int(x) for x in text.split(":"))
+    if start < 1 or end < start:
+        raise ValueError(f"invalid rank window: {text}")
+    return start, end
+
+
+def dense_search_rows(model, index, questions, k: int):
+    """Encode a batch of questions and return the FAISS rows (n, k)."""
+    tracer = get_tracer()
+    with tracer.stage("encode"):
+        embs = model.encode(questions, normalize_embeddings=True, convert_to_numpy=True)
+    with tracer.stage("index_search"):
+        _, I = index.search(np.ascontiguousarray(embs, dtype=np.float32), k)
+    return I
+
+
+def sample_negatives(candidate_lists, relevant, aids, num_neg: int, rng):
+    """
+    Sample negatives from candidate rows, skipping chunks of relevant articles
+
+    Args:
+        candidate_lists: Lists of chunk rows (one per retriever window)
+        relevant: Set of relevant aids
+        aids: aid of every chunk row
+        num_neg: Number of negatives
+        rng: random.Random
+
+    Returns:
+        rows: Up to num_neg chunk rows
+    """
+    pool, seen = [], set()
+    for rows in candidate_lists:
+        for r in rows:
+            r = int(r)
+            if r < 0 or r in seen or int(aids[r]) in relevant:
+                continue
+            seen.add(r)
+            pool.append(r)
+    if len(pool) <= num_neg:
+        return pool
+    return rng.sample(pool, num_neg)
+
+
+def mine_batch(batch, store, bm25_searcher, dense, args):
+    """
+    Mine one batch of training questions
+
+    Args:
+        batch: List of {"qid", "question", "relevant_laws"}
+        store: ChunkStore
+        bm25_searcher: ShardedBM25Searcher or None
+        dense: (model, index) or None
+        args: Namespace with bm25_window, dense_window, num_neg, seed
+
+    Returns:
+        records: List of {"query", "pos", "neg"} (questions without positives are skipped)
+    """
+    tracer = get_tracer()
+    questions = [q["question"] for q in batch]
+    candidates = [[] for _ in batch]
+
+    if bm25_searcher is not None:
+        start, end = args.bm25_window
+        with tracer.stage("tokenize"):
+            tokenized = bm25_searcher.tokenize(questions)
+        with tracer.stage("bm25_search"):
+            hits = bm25_searcher.search_tokenized(tokenized, top_n=end)
+        for cand, (idx, _) in zip(candidates, hits):
+            cand.append(idx[start - 1:end])
+
+    if dense is not None:
+        start, end = args.dense_window
+        model, index = dense
+        rows = dense_search_rows(model, index, questions, min(end, index.ntotal))
+        for cand, row in zip(candidates, rows):
+            cand.append(row[start - 1:end])
+
+    records = []
+    with tracer.stage("build_records"):
+        for q, cand in zip(batch, candidates):
+            relevant = {int(a) for a in q["relevant_laws"]}
+            pos_rows = [r for aid in q["relevant_laws"] for r in store.rows_of_aid(int(aid))]
+            if not pos_rows:
+                continue
+            # Seed theo qid: chạy lại / resume cho cùng kết quả
+            rng = random.Random(f"{args.seed}-{q['qid']}")
+            neg_rows = sample_negatives(cand, relevant, store.aids, args.num_neg, rng)
+            records.append({
+                "query": q["question"],
+                "pos": store.texts(pos_rows),
+                "neg": store.texts(neg_rows),
+            })
+            tracer.count("negatives", len(neg_rows))
+    return records
+
+
+def _config_fingerprint(args):
+    keys = ("path_train", "chunk_store", "shard_dir", "path_index", "path_model",
+            "bm25_window", "dense_window", "num_neg", "seed")
+    raw = json.dumps({k: getattr(args, k) for k in keys}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_state(output: str, fingerprint: str, overwrite: bool = False):
+    """Return (questions_done, valid_bytes) and truncate a partially written output."""
+    state_path = output + ".state.json"
+    if overwrite or not os.path.exists(state_path) or not os.path.exists(output):
+        return 0, 0
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state["fingerprint"] != fingerprint:
+        raise ValueError(
+            f"{output} was mined with other settings; use --overwrite or another --output"
+        )
+    # Bỏ phần batch ghi dở sau lần lưu state cuối
+    with open(output, "r+b") as f:
+        f.truncate(state["bytes"])
+    return state["done"], state["bytes"]
+
+
+def save_state(output: str, fingerprint: str, done: int, n_bytes: int):
+    state_path = output + ".state.json"
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "done": done, "bytes": n_bytes}, f)
+    os.replace(tmp_path, state_path)
+
+
+def mine(train_data, store, bm25_searcher, dense, args):
+    """
+    Mine the whole training set into args.output (resumable)
+
+    Returns:
+        stats: dict with questions processed / written / skipped
+    """
+    fingerprint = _config_fingerprint(args)
+    done, n_bytes = load_state(args.output, fingerprint, args.overwrite)
+    if done:
+        print(f"Resuming after {done}/{len(train_data)} questions")
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    written = skipped = 0
+    with open(args.output, "ab" if done else "wb") as f, \
+            tqdm(total=len(train_data), initial=done, desc="Mining") as bar:
+        for b in range(done, len(train_data), args.batch_size):
+            batch = train_data[b:b + args.batch_size]
+            records = mine_batch(batch, store, bm25_searcher, dense, args)
+            with get_tracer().stage("serialize"):
+                for rec in records:
+                    f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            n_bytes = f.tell()
+            save_state(args.output, fingerprint, b + len(batch), n_bytes)
+            written += len(records)
+            skipped += len(batch) - len(records)
+            bar.update(len(batch))
+
+    return {"questions": len(train_data), "written": written, "skipped_no_positive": skipped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mine hard negatives for reranker fine-tuning")
+    parser.add_argument("--path_train", type=str, default="./data/processed/train.json",
+                        help="Training questions with relevant_laws")
+    parser.add_argument("--chunk_store", type=str, default="./data/processed/chunked/chunk_store",
+                        help="Chunk store directory (utils/chunk_store.py)")
+    parser.add_argument("--shard_dir", type=str, default=None,
+                        help="BM25 shards (shard_bm25.py); omit to skip BM25 negatives")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for BM25 tokenize + scoring")
+    parser.add_argument("--path_index", type=str, default=None,
+                        help="Dense FAISS index (rows = chunk store rows); omit to skip dense negatives")
+    parser.add_argument("--path_model", type=str, default=None, help="Dense model checkpoint")
+    parser.add_argument("--bm25_window", type=parse_window, default="10:100",
+                        help="BM25 rank window for negatives, 1-based inclusive (default: 10:100)")
+    parser.add_argument("--dense_window", type=parse_window, default="5:50",
+                        help="Dense rank window for negatives, 1-based inclusive (default: 5:50)")
+    parser.add_argument("--num_neg", type=int, default=11,
+                        help="Negatives per question (train_group_size - 1, default: 11)")
+    parser.add_argument("--batch_size", type=int, default=256, help="Questions per batch")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", type=str, default="./data/processed/rerank/training.jsonl",
+                        help="Output JSONL (FlagEmbedding query/pos/neg format)")
+    parser.add_argument("--overwrite", action="store_true", help="Ignore previous progress")
+    add_tracing_args(parser)
+    args = parser.parse_args()
+
+    if not args.shard_dir and not args.path_index:
+        parser.error("need --shard_dir and/or --path_index")
+    if args.path_index and not args.path_model:
+        parser.error("--path_index requires --path_model")
+    init_tracing("mine_hard_negatives", args.trace_json, args.trace_prom)
+
+    with open(args.path_train, "r", encoding="utf-8") as f:
+        train_data = json.load(f)
+    store = ChunkStore(args.chunk_store)
+
+    dense = None
+    if args.path_index:
+        import faiss
+        from retrieve.dense.predict_bge import load_model
+        index = faiss.read_index(args.path_index)
+        if index.ntotal != len(store):
+            raise ValueError(f"FAISS index has {index.ntotal} vectors but the chunk store has {len(store)} chunks")
+        model, _ = load_model(args.path_model)
+        dense = (model, index)
+
+    bm25_searcher = None
+    if args.shard_dir:
+        from retrieve.sparse.shard_bm25 import ShardedBM25Searcher
+        bm25_searcher = ShardedBM25Searcher(args.shard_dir, num_workers=args.num_workers)
+
+    try:
+        stats = mine(train_data, store, bm25_searcher, dense, args)
+    finally:
+        if bm25_searcher is not None:
+            bm25_searcher.close()
+
+    print(f"✅ {stats['written']} câu hỏi -> {args.output} "
+          f"({stats['skipped_no_positive']} câu hỏi không tìm thấy chunk positive)")
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Citation fast path: questions that name an article or a law
+
+Nhiều câu hỏi trích thẳng điều luật cần tìm ("Điều 51 Luật Hôn nhân và gia
+đình", "Nghị định 81/2023/NĐ-CP") nhưng vẫn đi qua BM25 trên toàn bộ corpus và
+dense search. Script này:
+
+    build:  citation index từ legal_corpus.json: số hiệu văn bản (law_id, vd.
+            52/2014/QH13) và tên văn bản (title) đã chuẩn hóa (lowercase, bỏ
+            dấu) -> law; (law, số điều lấy từ heading "Điều N." của từng điều)
+            -> aid; aid -> chunk_id (nếu có chunk corpus)
+    search: bộ so khớp rẻ (regex cho "Điều N" / số hiệu, tra dict theo cặp từ
+            đầu cho tên văn bản) chạy trên mỗi câu hỏi:
+              --mode answer (mặc định): trích cả điều và văn bản -> trả lời
+                trực tiếp bằng các chunk của điều đó; còn lại BM25 toàn bộ
+                như search.py
+              --mode restrict: trích điều hoặc chỉ trích văn bản -> BM25 chỉ
+                trên các chunk được trích; không chunk nào có điểm > 0 (trích
+                điều) hoặc ít hơn --min_candidates chunk (chỉ trích văn bản:
+                khớp tên văn bản sai, điều luật liên quan nằm ở nghị định /
+                văn bản khác, ...) thì BM25 toàn bộ
+              không trích (hoặc chỉ có "Điều N" mà không rõ văn bản) -> BM25
+                toàn bộ
+
+Output cùng schema với search.py nên dùng tiếp được với ensemble / evaluate.
+Câu hỏi có relevant_laws thì in thêm tỉ lệ câu hỏi được resolve và độ chính
+xác của các aid được resolve.
+
+Example:
+    python retrieve/routing/citation.py build --legal_corpus data/raw/legal_corpus.json \
+        --path_chunk data/processed/chunked/chunk_corpus.json --output data/citation_index.json
+    python retrieve/routing/citation.py search --index data/citation_index.json \
+        --path_test data/processed/test.json --path_model retrieve/sparse/bm25_model.pkl \
+        --path_chunk data/processed/chunked/chunk_corpus.json --output_file results/test/bm25_citation_test.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+MODES = ("answer", "restrict")
+HEADING_RE = re.compile(r"^\s*Điều\s+(\d+[a-z]?)\s*[.:]", re.IGNORECASE)
+# Trên text đã normalize_text: "dieu 51", "dieu 51, 52 va 53"
+ARTICLE_RE = re.compile(r"\bdieu\s+(\d+[a-z]?(?:\s*(?:,|va|-)\s*\d+[a-z]?)*)\b")
+LAW_NUMBER_RE = re.compile(r"\b(\d+)\s*/\s*(\d{4})\s*/\s*([a-z0-9]+(?:\s*-\s*[a-z0-9]+)*)\b")
+YEAR_RE = re.compile(r"\d{4}")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, bỏ dấu tiếng Việt (đ -> d), gộp khoảng trắng."""
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return " ".join(text.split())
+
+
+def law_number_key(law_id: str) -> str:
+    """'52/2014/QH13', '81/2023/NĐ-CP', '81 / 2023 / nd-cp' -> cùng một key."""
+    return re.sub(r"\s+", "", normalize_text(law_id))
+
+
+def _title_words(text: str):
+    return re.findall(r"\w+", normalize_text(text))
+
+
+class CitationIndex:
+    """
+    Law numbers / titles -> laws, (law, article number) -> aid, aid -> chunk ids
+
+    Args:
+        laws: List of {"law_id", "title", "aids"}
+        articles: {"<law idx>:<article number>": aid}
+        chunks: {aid: [chunk_id, ...]} (có thể rỗng)
+    """
+
+    def __init__(self, laws, articles, chunks=None):
+        self.laws = laws
+        self.articles = articles
+        self.chunks = chunks or {}
+        self.by_number = defaultdict(list)
+        self.by_title = defaultdict(list)   # (w0, w1) -> [(title words, law idx)]
+        for i, law in enumerate(laws):
+            if law["law_id"]:
+                self.by_number[law_number_key(law["law_id"])].append(i)
+            words = tuple(_title_words(law["title"]))
+            # Tên một từ ("Luật") quá chung chung để coi là trích dẫn
+            if len(words) >= 2:
+                self.by_title[words[:2]].append((words, i))
+        for bucket in self.by_title.values():
+            bucket.sort(key=lambda x: len(x[0]), reverse=True)
+
+    @classmethod
+    def build(cls, legal_corpus, chunk_data=None):
+        """Citation index from legal_corpus.json (+ chunk_corpus.json for the chunk ids)."""
+        laws, articles = [], {}
+        for law in legal_corpus:
+            law_idx = len(laws)
+            aids = []
+            for article in law["content"]:
+                aids.append(article["aid"])
+                m = HEADING_RE.match(article["content_Article"])
+                if m:
+                    articles.setdefault(f"{law_idx}:{m.group(1).lower()}", article["aid"])
+            laws.append({"law_id": law.get("law_id", ""), "title": law.get("title", ""), "aids": aids})
+        chunks = defaultdict(list)
+        for c in chunk_data or []:
+            chunks[str(c["aid"])].append(c["chunk_id"])
+        return cls(laws, articles, dict(chunks))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"laws": self.laws, "articles": self.articles, "chunks": self.chunks}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        with get_tracer().stage("load_index"):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        return cls(data["laws"], data["articles"], data["chunks"])
+
+    def _match_titles(self, words):
+        """Laws whose title appears in the question (longest match at each position)."""
+        found = []
+        i = 0
+        while i < len(words) - 1:
+            for title, law_idx in self.by_title.get((words[i], words[i + 1]), ()):
+                if tuple(words[i:i + len(title)]) == title:
+                    # Cùng tên (các lần sửa đổi): năm ngay sau tên chọn đúng văn bản
+                    year = words[i + len(title)] if i + len(title) < len(words) else ""
+                    same = [l for t, l in self.by_title[words[i], words[i + 1]] if t == title]
+                    if YEAR_RE.fullmatch(year):
+                        same = [l for l in same if f"/{year}/" in self.laws[l]["law_id"]] or same
+                    found.extend(same)
+                    i += len(title) - 1
+                    break
+            i += 1
+        return found
+
+    def resolve(self, question: str):
+        """
+        Citations in one question
+
+        Returns:
+            citation: {"kind": "article" | "law" | None, "laws": [law idx], "aids": [aid]}
+        """
+        text = normalize_text(question)
+        laws = []
+        for number, year, suffix in LAW_NUMBER_RE.findall(text):
+            laws.extend(self.by_number.get(law_number_key(f"{number}/{year}/{suffix}"), []))
+        if not laws:
+            laws = self._match_titles(re.findall(r"\w+", text))
+        laws = list(dict.fromkeys(laws))
+        if not laws:
+            return {"kind": None, "laws": [], "aids": []}
+
+        numbers = []
+        for group in ARTICLE_RE.findall(text):
+            numbers.extend(re.findall(r"\d+[a-z]?", group))
+        aids = [self.articles[f"{l}:{n}"] for l in laws for n in dict.fromkeys(numbers)
+                if f"{l}:{n}" in self.articles]
+        if aids:
+            return {"kind": "article", "laws": laws, "aids": aids}
+        return {"kind": "law", "laws": laws, "aids": [a for l in laws for a in self.laws[l]["aids"]]}
+
+
+def _chunk_rows(chunk_ids):
+    rows = defaultdict(list)
+    for row, cid in enumerate(chunk_ids):
+        rows[str(cid).split("_")[0]].append(row)
+    return rows
+
+
+def restricted_scores(bm25_model, doc_len, tokens, rows):
+    """BM25 scores of the given rows only (same as get_scores at those rows)."""
+    rows = np.asarray(rows, dtype=np.int64)
+    scores = np.zeros(len(rows))
+    norm = bm25_model.k1 * (1 - bm25_model.b + bm25_model.b * doc_len[rows] / bm25_model.avgdl)
+    for q in tokens:
+        idf = bm25_model.idf.get(q)
+        if not idf:
+            continue
+        tf = np.array([bm25_model.doc_freqs[r].get(q, 0) for r in rows], dtype=np.float64)
+        scores += idf * tf * (bm25_model.k1 + 1) / (tf + norm)
+    return scores
+
+
+def search_with_citations(question_data, index: CitationIndex, bm25_model, chunk_ids, mode: str = "answer",
+                          top_n: int = 1000, min_candidates: int = 10):
+    """
+    BM25 search with the citation fast path
+
+    Args:
+        mode: "answer" (cited articles returned directly) or "restrict" (BM25 over cited articles / laws)
+        min_candidates: restrict, law-only citations: full search below this many positive-score chunks
+
+    Returns:
+        results: search.py schema, one record per question (input order)
+        citations: resolve() output per question, with "path" ("answer" | "restrict" | "full")
+        match_seconds: Total time spent resolving citations
+    """
+    from retrieve.sparse.search import bm25_tokenizer, search_questions
+    from retrieve.sparse.shard_bm25 import topk_indices
+
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    tracer = get_tracer()
+    rows_by_aid = _chunk_rows(chunk_ids)
+    doc_len = np.asarray(bm25_model.doc_len, dtype=np.float64)
+    results = [None] * len(question_data)
+    citations = []
+    full = []
+    match_seconds = 0.0
+    for pos, entry in enumerate(question_data):
+        t0 = time.perf_counter()
+        with tracer.stage("citation_match"):
+            citation = index.resolve(entry["question"])
+        match_seconds += time.perf_counter() - t0
+        citations.append(citation)
+        citation["path"] = "full"
+        rows = [r for aid in citation["aids"] for r in rows_by_aid.get(str(aid), ())]
+        if not rows or (mode == "answer" and citation["kind"] != "article"):
+            full.append(pos)
+            continue
+        if mode == "answer":
+            top_chunks = [{"chunk_id": chunk_ids[r], "score": 1.0} for r in rows]
+        else:
+            with tracer.stage("tokenize"):
+                tokens = bm25_tokenizer(entry["question"])
+            with tracer.stage("index_search"):
+                scores = restricted_scores(bm25_model, doc_len, tokens, rows)
+            # Trích cả điều: chỉ cần một chunk có điểm; chỉ trích văn bản: cần min_candidates
+            needed = min_candidates if citation["kind"] == "law" else 1
+            if int((scores > 0).sum()) < needed:
+                full.append(pos)
+                continue
+            idx, vals = topk_indices(scores, top_n)
+            top_chunks = [{"chunk_id": chunk_ids[rows[i]], "score": float(v)} for i, v in zip(idx, vals)]
+        citation["path"] = mode
+        results[pos] = {"qid": entry["qid"], "question": entry["question"], "top_chunks": top_chunks}
+        tracer.observe("query_latency_seconds", time.perf_counter() - t0)
+
+    tracer.count("citation_fast_path", len(question_data) - len(full))
+    if full:
+        searched = search_questions([question_data[p] for p in full], bm25_model, chunk_ids, top_n=top_n)
+        for pos, record in zip(full, searched):
+            results[pos] = record
+    return results, citations, match_seconds
+
+
+def citation_report(question_data, citations):
+    """Share of resolved questions and precision / recall of the resolved aids against relevant_laws."""
+    kinds, paths = defaultdict(int), defaultdict(int)
+    hit, precision = defaultdict(list), defaultdict(list)
+    for entry, c in zip(question_data, citations):
+        kinds[c["kind"] or "none"] += 1
+        paths[c.get("path", "full")] += 1
+        if c["kind"] is None or "relevant_laws" not in entry:
+            continue
+        gold = {str(a) for a in entry["relevant_laws"]}
+        found = {str(a) for a in c["aids"]}
+        hit[c["kind"]].append(len(gold & found) / len(gold) if gold else 0.0)
+        precision[c["kind"]].append(len(gold & found) / len(found))
+    return {
+        "queries": len(question_data),
+        "kinds": dict(kinds),
+        "paths": dict(paths),
+        "recall": {k: float(np.mean(v)) for k, v in hit.items()},
+        "precision": {k: float(np.mean(v)) for k, v in precision.items()},
+    }
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Citation fast path for questions naming an article or a law")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Build the citation index")
+    p_build.add_argument("--legal_corpus", type=str, default="./data/raw/legal_corpus.json")
+    p_build.add_argument("--path_chunk", type=str, default="./data/processed/chunked/chunk_corpus.json")
+    p_build.add_argument("--output", type=str, default="./data/citation_index.json")
+
+    p_search = sub.add_parser("search", help="BM25 search with the citation fast path")
+    p_search.add_argument("--index", type=str, default="./data/citation_index.json")
+    p_search.add_argument("--path_test", type=str, required=True, help="Questions JSON")
+    p_search.add_argument("--path_model", type=str, default="./retrieve/sparse/bm25_model.pkl", help="bm25_model.pkl")
+    p_search.add_argument("--path_chunk", type=str, default="./data/processed/chunked/chunk_corpus.json",
+                          help="Chunk corpus JSON or chunk store directory")
+    p_search.add_argument("--mode", type=str, default="answer", choices=MODES,
+                          help="answer: return cited articles directly; "
+                               "restrict: BM25 over the cited articles or laws")
+    p_search.add_argument("--min_candidates", type=int, default=10,
+                          help="restrict: full search below this many positive-score chunks in a cited law")
+    p_search.add_argument("--top_n", type=int, default=1000, help="BM25 chunks per question")
+    p_search.add_argument("--output_file", type=str, required=True)
+    add_tracing_args(p_search)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = CitationIndex.build(_load_json(args.legal_corpus), _load_json(args.path_chunk))
+        index.save(args.output)
+        print(f"✅ Đã lưu citation index ({len(index.laws)} laws, {len(index.articles)} articles) vào {args.output}")
+        return
+
+    from retrieve.sparse.search import load_bm25_model, load_chunk_ids, save_results
+
+    init_tracing("citation", args.trace_json, args.trace_prom)
+    index = CitationIndex.load(args.index)
+    question_data = _load_json(args.path_test)
+    results, citations, match_seconds = search_with_citations(
+        question_data, index, load_bm25_model(args.path_model), load_chunk_ids(args.path_chunk),
+        mode=args.mode, top_n=args.top_n, min_candidates=args.min_candidates,
+    )
+    report = citation_report(question_data, citations)
+    match_us = match_seconds / max(len(question_data), 1) * 1e6
+    print(f"Citations: {report['kinds']}, search path: {report['paths']} ({match_us:.1f} µs / question to match)")
+    for kind in report["recall"]:
+        print(f"  {kind}: recall {report['recall'][kind]:.3f}, precision {report['precision'][kind]:.3f} "
+              f"of resolved aids vs relevant_laws")
+    save_results(results, args.output_file)
+    print(f"✅ Đã lưu kết quả vào {args.output_file}")
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
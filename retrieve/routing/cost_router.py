@@ -0,0 +1,238 @@
+"""
+Cost-aware query router: skip the dense stage when BM25 is confident
+
+Mọi câu hỏi hiện đều trả chi phí BM25 + encode BGE-M3 + FAISS search + fusion,
+kể cả khi top-1 của BM25 vượt trội rõ ràng (vd. câu hỏi trích nguyên văn điều
+luật). Router tính vài đặc trưng rẻ từ kết quả BM25 (search.py):
+
+    margin         (s1 - s2) / s1 giữa hai chunk đầu
+    concentration  tỉ lệ tổng điểm top-k rơi vào điều luật (aid) của top-1
+    aids           số điều luật khác nhau trong top-k
+
+``confidence`` là margin, concentration hoặc min của cả hai (``both``). Câu hỏi
+có confidence >= threshold giữ nguyên kết quả BM25; chỉ câu hỏi không chắc mới
+đi qua encoder dense và product_rank fusion (fuse_product_rank).
+
+    report  với kết quả BM25 và dense đã có cho data/processed/test.json: tỉ lệ
+            câu hỏi đi qua dense và F2 theo từng threshold, so với BM25 thuần
+            và fusion cho mọi câu hỏi -> chọn threshold
+    run     chạy router thật: chỉ encode + search dense cho câu hỏi không chắc
+
+Example:
+    python retrieve/routing/cost_router.py report --path_test data/processed/test.json \
+        --bm25_results results/test/bm25_test.json --dense_results results/test/bge_512_test.json \
+        --feature both --max_f2_drop 0.005
+    python retrieve/routing/cost_router.py run --path_test data/processed/test.json \
+        --bm25_results results/test/bm25_test.json --threshold 0.35 --path_index data/faiss_index/bge.bin \
+        --path_meta data/faiss_index/corpus_meta.pkl --path_model BAAI/bge-m3 \
+        --output_file results/test/routed_test.json
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.ensemble_with_bm25 import fuse_product_rank
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+FEATURES = ("margin", "concentration", "both")
+
+
+def _aid(chunk_id) -> str:
+    # Cùng quy ước với utils/evaluate.py: aid là phần trước dấu "_"
+    return str(chunk_id).split("_")[0]
+
+
+def confidence_features(top_chunks, k: int = 10):
+    """
+    Cheap confidence features of one BM25 result list
+
+    Returns:
+        features: dict with top1, margin, concentration, aids
+    """
+    head = top_chunks[:k]
+    if not head or head[0]["score"] <= 0:
+        return {"top1": 0.0, "margin": 0.0, "concentration": 0.0, "aids": len({_aid(c["chunk_id"]) for c in head})}
+    s1 = head[0]["score"]
+    s2 = head[1]["score"] if len(head) > 1 else 0.0
+    mass = defaultdict(float)
+    for c in head:
+        mass[_aid(c["chunk_id"])] += max(c["score"], 0.0)
+    total = sum(mass.values())
+    return {
+        "top1": s1,
+        "margin": (s1 - s2) / s1,
+        "concentration": mass[_aid(head[0]["chunk_id"])] / total if total > 0 else 0.0,
+        "aids": len(mass),
+    }
+
+
+def confidence(features: dict, feature: str = "both") -> float:
+    if feature == "both":
+        return min(features["margin"], features["concentration"])
+    return features[feature]
+
+
+def fuse_with_dense(bm25_rec, dense_rec, model_weight: float = 1.0, bm25_weight: float = 1.0, K: int = 1000):
+    """product_rank fusion of one query, same as ensemble_pair_product_rank."""
+    model_map = {c["chunk_id"]: c["score"] for c in dense_rec["top_chunks"]}
+    rank_map = {c["chunk_id"]: i for i, c in enumerate(dense_rec["top_chunks"], start=1)}
+    bm25_map = {c["chunk_id"]: c["score"] for c in bm25_rec["top_chunks"]}
+    topk = fuse_product_rank(model_map, bm25_map, rank_map, model_weight, bm25_weight, K)
+    return {"qid": bm25_rec["qid"], "top_chunks": [{"chunk_id": cid, "score": sc} for cid, sc in topk]}
+
+
+def routed_results(bm25_results, dense_by_qid, confidences, threshold: float, **fuse_kwargs):
+    """BM25 result when confidence >= threshold, otherwise product_rank fusion with the dense result."""
+    out = []
+    for rec in bm25_results:
+        dense_rec = dense_by_qid.get(rec["qid"])
+        if confidences[rec["qid"]] >= threshold or dense_rec is None:
+            out.append({"qid": rec["qid"], "top_chunks": rec["top_chunks"]})
+        else:
+            out.append(fuse_with_dense(rec, dense_rec, **fuse_kwargs))
+    return out
+
+
+def threshold_report(bm25_results, dense_results, gt, feature: str = "both", k: int = 10, topk: int = 3,
+                     steps: int = 10, **fuse_kwargs):
+    """
+    F2 and dense fraction per threshold; thresholds are confidence quantiles
+
+    Returns:
+        report: dict with the baselines and one row per threshold
+    """
+    from utils.evaluate import compute_macro_f2, predictions_from_results
+
+    dense_by_qid = {rec["qid"]: rec for rec in dense_results}
+    confidences = {rec["qid"]: confidence(confidence_features(rec["top_chunks"], k), feature)
+                   for rec in bm25_results}
+    values = np.array(list(confidences.values()))
+    # threshold = +inf: mọi câu hỏi đi qua dense; -inf: không câu hỏi nào
+    thresholds = sorted({float(np.quantile(values, q)) for q in np.linspace(0, 1, steps + 1)} | {np.inf})
+
+    def f2(results):
+        return compute_macro_f2(gt, predictions_from_results(results, topk))
+
+    rows = []
+    for t in thresholds:
+        routed = routed_results(bm25_results, dense_by_qid, confidences, t, **fuse_kwargs)
+        dense_frac = float(np.mean(values < t)) if len(values) else 0.0
+        rows.append({"threshold": t, "dense_fraction": dense_frac, "f2": f2(routed)})
+    return {
+        "feature": feature,
+        "queries": len(bm25_results),
+        "f2_bm25_only": f2([{"qid": r["qid"], "top_chunks": r["top_chunks"]} for r in bm25_results]),
+        "f2_fused_all": rows[-1]["f2"],
+        "rows": rows,
+    }
+
+
+def pick_threshold(report, max_f2_drop: float):
+    """Row with the smallest dense fraction whose F2 is within max_f2_drop of fusing every query."""
+    ok = [r for r in report["rows"] if r["f2"] >= report["f2_fused_all"] - max_f2_drop]
+    return min(ok, key=lambda r: (r["dense_fraction"], -r["f2"]))
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost-aware router: dense stage only for uncertain queries")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--path_test", type=str, required=True, help="Questions JSON")
+        p.add_argument("--bm25_results", type=str, required=True, help="search.py results for the questions")
+        p.add_argument("--feature", type=str, default="both", choices=FEATURES, help="Confidence feature")
+        p.add_argument("--k", type=int, default=10, help="BM25 top-k used for the features")
+        p.add_argument("--model_weight", type=float, default=1.0, help="Dense weight in product_rank")
+        p.add_argument("--bm25_weight", type=float, default=1.0, help="BM25 weight in product_rank")
+        p.add_argument("--K", type=int, default=1000, help="Fused results per query")
+
+    p_report = sub.add_parser("report", help="F2 / dense fraction per threshold")
+    common(p_report)
+    p_report.add_argument("--dense_results", type=str, required=True, help="predict_bge.py results")
+    p_report.add_argument("--topk", type=int, default=3, help="Top-k used for F2")
+    p_report.add_argument("--steps", type=int, default=10, help="Number of quantile thresholds")
+    p_report.add_argument("--max_f2_drop", type=float, default=0.005,
+                          help="Suggest the cheapest threshold within this F2 of fusing every query")
+    p_report.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+
+    p_run = sub.add_parser("run", help="Route queries, encoding only the uncertain ones")
+    common(p_run)
+    p_run.add_argument("--threshold", type=float, required=True, help="Confidence threshold from the report")
+    p_run.add_argument("--path_index", type=str, required=True, help="Path to FAISS index file")
+    p_run.add_argument("--path_meta", type=str, required=True, help="Path to corpus_meta.pkl file")
+    p_run.add_argument("--path_model", type=str, required=True, help="Path to BGE M3 model checkpoint")
+    p_run.add_argument("--topk", type=int, default=100, help="Dense results per uncertain query")
+    p_run.add_argument("--output_file", type=str, required=True, help="Output results JSON")
+    add_tracing_args(p_run)
+
+    args = parser.parse_args()
+    fuse_kwargs = {"model_weight": args.model_weight, "bm25_weight": args.bm25_weight, "K": args.K}
+    bm25_results = _load_json(args.bm25_results)
+
+    if args.command == "report":
+        from utils.evaluate import load_ground_truth
+
+        gt = load_ground_truth(Path(args.path_test))
+        report = threshold_report(bm25_results, _load_json(args.dense_results), gt, args.feature, args.k,
+                                  args.topk, args.steps, **fuse_kwargs)
+        print(f"Feature: {report['feature']}, {report['queries']} queries")
+        print(f"F2 BM25 only: {report['f2_bm25_only']:.4f}, F2 fused (all queries): {report['f2_fused_all']:.4f}")
+        print(f"{'threshold':>10} {'dense %':>8} {'F2':>8} {'dF2':>8}")
+        for r in report["rows"]:
+            print(f"{r['threshold']:>10.4f} {r['dense_fraction']:>8.1%} {r['f2']:>8.4f} "
+                  f"{r['f2'] - report['f2_fused_all']:>+8.4f}")
+        best = pick_threshold(report, args.max_f2_drop)
+        report["suggested"] = best
+        print(f"\nSuggested --threshold {best['threshold']:.4f}: {best['dense_fraction']:.1%} of queries "
+              f"through dense, F2 {best['f2']:.4f}")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"✅ Đã lưu báo cáo vào {args.output}")
+        return
+
+    init_tracing("cost_router", args.trace_json, args.trace_prom)
+    tracer = get_tracer()
+    questions = {q["qid"]: q for q in _load_json(args.path_test)}
+    with tracer.stage("route"):
+        confidences = {rec["qid"]: confidence(confidence_features(rec["top_chunks"], args.k), args.feature)
+                       for rec in bm25_results}
+        uncertain = [questions[rec["qid"]] for rec in bm25_results
+                     if confidences[rec["qid"]] < args.threshold and rec["qid"] in questions]
+    tracer.count("routed_dense", len(uncertain))
+    print(f"Router: {len(uncertain)}/{len(bm25_results)} queries through dense")
+
+    dense_by_qid = {}
+    if uncertain:
+        from retrieve.dense.predict_bge import load_index, load_model, search_and_build_results
+
+        index, meta = load_index(args.path_index, args.path_meta)
+        model, _ = load_model(args.path_model)
+        dense_by_qid = {rec["qid"]: rec for rec in
+                        search_and_build_results(uncertain, model, index, meta, topk=args.topk)}
+
+    with tracer.stage("fuse"):
+        output = routed_results(bm25_results, dense_by_qid, confidences, args.threshold, **fuse_kwargs)
+    with tracer.stage("serialize"):
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã lưu kết quả vào {args.output_file}")
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,585 @@
+"""
+Law-partitioned routing index: search only inside the statutes a question is about
+
+legal_corpus.json nhóm điều luật theo văn bản (mỗi law có list "content"),
+nhưng corpus.json / chunk_corpus.json làm phẳng tất cả thành một index. Phần
+lớn câu hỏi chỉ liên quan tới vài văn bản, nên:
+
+    build:  gán partition (law) cho mọi chunk theo law_id của chunk, sắp chunk theo partition để mỗi
+            law là một đoạn liên tục của index sparse (CSR giống shard_bm25.py,
+            idf / avgdl global) và dense (vector đã normalize)
+            + router rẻ: BM25 trên "summary" của mỗi law (title + token của các
+            chunk) và centroid embedding của mỗi law
+    search: router chọn top-P law -> BM25 / dense chỉ chấm điểm chunk trong các
+            law đó. Khi router không tự tin (không có token nào khớp) hoặc có ít
+            hơn --min_candidates chunk có điểm BM25 > 0 thì tìm trên toàn bộ index.
+    report: recall và latency theo P, so với tìm trên toàn bộ index
+
+Điểm BM25 / dense của một chunk giống hệt khi tìm toàn bộ, nên khi law đúng
+được chọn thì thứ hạng giữa các chunk được giữ nguyên. Output cùng schema với
+search.py / predict_bge.py.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from retrieve.sparse.shard_bm25 import build_inverted_arrays
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+
+MANIFEST = "manifest.json"
+ROUTERS = ("bm25", "centroid", "hybrid")
+RRF_K = 60
+
+
+# --------------------------------------------------------------------------
+# Build
+# --------------------------------------------------------------------------
+
+def law_assignments(chunk_data, legal_corpus=None):
+    """
+    Partition (law) of every chunk from the law_id kept by create_corpus.py / chunk.py
+
+    Chunk không có law_id (chunk corpus cũ) lấy law theo aid từ legal_corpus;
+    legal_corpus (nếu có) còn cho title của mỗi law cho router.
+
+    Returns:
+        partition: int32 array, law index of every chunk
+        laws: List of {"law_id", "title"}
+    """
+    titles, aid_to_law_id = {}, {}
+    for law_idx, law in enumerate(legal_corpus or []):
+        law_id = law.get("law_id", str(law.get("id", law_idx)))
+        titles.setdefault(law_id, law.get("title", ""))
+        for article in law["content"]:
+            aid_to_law_id[article["aid"]] = law_id
+
+    law_index, laws = {}, []
+    partition = np.empty(len(chunk_data), dtype=np.int32)
+    for i, c in enumerate(chunk_data):
+        law_id = c.get("law_id", aid_to_law_id.get(c["aid"]))
+        if law_id is None:
+            raise ValueError(f"chunk {c['chunk_id']} has no law_id and its aid {c['aid']} is not in legal_corpus "
+                             "(rebuild corpus.json / chunk_corpus.json or pass --legal_corpus)")
+        if law_id not in law_index:
+            law_index[law_id] = len(laws)
+            laws.append({"law_id": law_id, "title": titles.get(law_id, "")})
+        partition[i] = law_index[law_id]
+    return partition, laws
+
+
+def load_chunk_records(path: str):
+    """aid / chunk_id / law_id of every chunk from chunk_corpus.json or a chunk store (no texts)."""
+    from utils.chunk_store import ChunkIdView, is_chunk_store
+
+    if is_chunk_store(path):
+        view = ChunkIdView(path)
+        return [dict(view.extra(i), aid=view.aid(i), chunk_id=view.chunk_id(i)) for i in range(len(view))]
+    return _load_json(path)
+
+
+def build_routing_index(chunk_data, bm25_model, out_dir: str, faiss_index=None, legal_corpus=None,
+                        batch_size: int = 100000):
+    """
+    Build the law-partitioned sparse / dense index and the router
+
+    Args:
+        chunk_data: chunk_corpus.json records with law_id (row i = BM25 doc i = FAISS row i)
+        bm25_model: rank_bm25.BM25Okapi (bm25_model.pkl)
+        out_dir: Output directory
+        faiss_index: FAISS index (bge.bin), None to build the sparse side only
+        legal_corpus: data/raw/legal_corpus.json, optional (law titles; law of chunks without law_id)
+        batch_size: Vectors reconstructed per call
+
+    Returns:
+        manifest: dict mô tả index
+    """
+    from rank_bm25 import BM25Okapi
+    from retrieve.sparse.search import bm25_tokenizer
+
+    n = len(chunk_data)
+    if bm25_model.corpus_size != n:
+        raise ValueError(f"BM25 model has {bm25_model.corpus_size} docs but chunk corpus has {n} chunks")
+    partition, laws = law_assignments(chunk_data, legal_corpus)
+
+    os.makedirs(out_dir, exist_ok=True)
+    # perm[pos] = row gốc; chunk của cùng một law nằm liền nhau, giữ thứ tự row trong law
+    perm = np.argsort(partition, kind="stable").astype(np.int64)
+    part_ptr = np.zeros(len(laws) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(partition, minlength=len(laws)), out=part_ptr[1:])
+    np.save(os.path.join(out_dir, "partition.npy"), partition)
+    np.save(os.path.join(out_dir, "perm.npy"), perm)
+    np.save(os.path.join(out_dir, "part_ptr.npy"), part_ptr)
+    with open(os.path.join(out_dir, "laws.json"), "w", encoding="utf-8") as f:
+        json.dump(laws, f, ensure_ascii=False)
+
+    # Sparse: CSR trên thứ tự partition, idf / avgdl global như bm25_model.pkl
+    print("Building partitioned BM25 arrays...")
+    terms = sorted(bm25_model.idf)
+    vocab = {t: i for i, t in enumerate(terms)}
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    np.save(os.path.join(out_dir, "idf.npy"), np.array([bm25_model.idf[t] for t in terms], dtype=np.float64))
+    term_ptr, post_doc, post_tf = build_inverted_arrays([bm25_model.doc_freqs[r] for r in perm], vocab)
+    np.save(os.path.join(out_dir, "term_ptr.npy"), term_ptr)
+    np.save(os.path.join(out_dir, "post_doc.npy"), post_doc)
+    np.save(os.path.join(out_dir, "post_tf.npy"), post_tf)
+    np.save(os.path.join(out_dir, "doc_len.npy"), np.asarray(bm25_model.doc_len, dtype=np.int64)[perm])
+
+    # Router sparse: mỗi law là một document = title + token của mọi chunk
+    print("Building law router...")
+    law_docs = [bm25_tokenizer(law["title"]) if law["title"] else [] for law in laws]
+    for row in perm:
+        doc = law_docs[partition[row]]
+        for term, tf in bm25_model.doc_freqs[row].items():
+            doc.extend([term] * tf)
+    law_docs = [doc if doc else [""] for doc in law_docs]
+    with open(os.path.join(out_dir, "law_bm25.pkl"), "wb") as f:
+        pickle.dump(BM25Okapi(law_docs), f)
+
+    dim = None
+    if faiss_index is not None:
+        import faiss
+        if faiss_index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            raise ValueError("only inner-product (normalized) FAISS indexes are supported")
+        if faiss_index.ntotal != n:
+            raise ValueError(f"FAISS index has {faiss_index.ntotal} vectors but chunk corpus has {n} chunks")
+        print("Reordering dense vectors...")
+        dim = faiss_index.d
+        vectors = np.lib.format.open_memmap(
+            os.path.join(out_dir, "dense.npy"), mode="w+", dtype=np.float32, shape=(n, dim)
+        )
+        for i in range(0, n, batch_size):
+            j = min(i + batch_size, n)
+            vectors[i:j] = np.stack([faiss_index.reconstruct(int(r)) for r in perm[i:j]])
+        centroids = np.zeros((len(laws), dim), dtype=np.float32)
+        for p in range(len(laws)):
+            a, b = part_ptr[p], part_ptr[p + 1]
+            if b > a:
+                c = np.asarray(vectors[a:b]).mean(axis=0)
+                centroids[p] = c / max(np.linalg.norm(c), 1e-12)
+        vectors.flush()
+        del vectors
+        np.save(os.path.join(out_dir, "centroids.npy"), centroids)
+
+    manifest = {
+        "num_chunks": n,
+        "num_laws": len(laws),
+        "avgdl": float(bm25_model.avgdl),
+        "k1": float(bm25_model.k1),
+        "b": float(bm25_model.b),
+        "dim": dim,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Đã lưu routing index ({n} chunks, {len(laws)} laws) vào {out_dir}")
+    return manifest
+
+
+# --------------------------------------------------------------------------
+# Search
+# --------------------------------------------------------------------------
+
+def _rank_desc(scores, rows, k):
+    """Top-k by score, ties by lower original row (same order as the full search)."""
+    order = np.lexsort((rows, -scores))[:k]
+    return rows[order], scores[order]
+
+
+class LawRoutedSearcher:
+    """
+    Route questions to their top laws and search only inside them
+
+    Args:
+        index_dir: Directory written by build_routing_index
+        mmap: Memory-map postings / vectors
+    """
+
+    def __init__(self, index_dir: str, mmap: bool = True):
+        mode = "r" if mmap else None
+        tracer = get_tracer()
+        with tracer.stage("load_index"):
+            with open(os.path.join(index_dir, MANIFEST), "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            with open(os.path.join(index_dir, "laws.json"), "r", encoding="utf-8") as f:
+                self.laws = json.load(f)
+            with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+                self.vocab = {t: i for i, t in enumerate(json.load(f))}
+            with open(os.path.join(index_dir, "law_bm25.pkl"), "rb") as f:
+                self.law_bm25 = pickle.load(f)
+            self.idf = np.load(os.path.join(index_dir, "idf.npy"))
+            self.partition = np.load(os.path.join(index_dir, "partition.npy"))
+            self.perm = np.load(os.path.join(index_dir, "perm.npy"))
+            self.part_ptr = np.load(os.path.join(index_dir, "part_ptr.npy"))
+            self.term_ptr = np.load(os.path.join(index_dir, "term_ptr.npy"), mmap_mode=mode)
+            self.post_doc = np.load(os.path.join(index_dir, "post_doc.npy"), mmap_mode=mode)
+            self.post_tf = np.load(os.path.join(index_dir, "post_tf.npy"), mmap_mode=mode)
+            doc_len = np.load(os.path.join(index_dir, "doc_len.npy"))
+            m = self.manifest
+            self.k1 = m["k1"]
+            self.norm = m["k1"] * (1 - m["b"] + m["b"] * doc_len / m["avgdl"])
+            self.vectors = self.centroids = None
+            if m.get("dim"):
+                self.vectors = np.load(os.path.join(index_dir, "dense.npy"), mmap_mode=mode)
+                self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.num_laws = len(self.laws)
+        self.all_parts = np.arange(self.num_laws)
+
+    # ---- Router ----------------------------------------------------------
+
+    def route(self, tokens, q_emb=None, top_p: int = 3, router: str = "bm25"):
+        """
+        Returns:
+            parts: Indices of the top_p laws
+            confident: False when the router had no signal (fallback to full search)
+        """
+        if router not in ROUTERS:
+            raise ValueError(f"router must be one of {ROUTERS}")
+        if router != "bm25" and (q_emb is None or self.centroids is None):
+            raise ValueError(f"router '{router}' needs a dense index and a query embedding")
+        top_p = min(top_p, self.num_laws)
+
+        if router in ("bm25", "hybrid"):
+            sparse = np.asarray(self.law_bm25.get_scores(tokens))
+        if router in ("centroid", "hybrid"):
+            dense = self.centroids @ np.asarray(q_emb, dtype=np.float32)
+
+        if router == "bm25":
+            scores, confident = sparse, bool(sparse.max() > 0)
+        elif router == "centroid":
+            scores, confident = dense, True
+        else:
+            # Reciprocal rank fusion của hai router
+            scores = np.zeros(self.num_laws)
+            for s in (sparse, dense):
+                ranks = np.empty(self.num_laws)
+                ranks[np.lexsort((self.all_parts, -s))] = np.arange(1, self.num_laws + 1)
+                scores += 1.0 / (RRF_K + ranks)
+            confident = True
+        parts = np.lexsort((self.all_parts, -scores))[:top_p]
+        return np.sort(parts), confident
+
+    # ---- Restricted search ----------------------------------------------
+
+    def _ranges(self, parts):
+        return [(int(self.part_ptr[p]), int(self.part_ptr[p + 1])) for p in parts]
+
+    def _bm25_scores_all(self, tokens):
+        # Toàn bộ index: một lượt trên posting list của mỗi term, không cắt theo partition
+        scores = np.zeros(len(self.perm))
+        k1 = self.k1
+        for t in tokens:
+            tid = self.vocab.get(t)
+            if tid is None:
+                continue
+            lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+            if lo == hi:
+                continue
+            docs = self.post_doc[lo:hi]
+            tf = self.post_tf[lo:hi].astype(np.float64)
+            scores[docs] += self.idf[tid] * (tf * (k1 + 1) / (tf + self.norm[docs]))
+        return self.perm, scores
+
+    def bm25_scores(self, tokens, parts):
+        """BM25 scores of every chunk inside parts; returns (original rows, scores)."""
+        if len(parts) == self.num_laws:
+            return self._bm25_scores_all(tokens)
+        ranges = self._ranges(parts)
+        sizes = [b - a for a, b in ranges]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        scores = np.zeros(int(offsets[-1]))
+        k1 = self.k1
+        for t in tokens:
+            tid = self.vocab.get(t)
+            if tid is None:
+                continue
+            idf = self.idf[tid]
+            lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+            if lo == hi:
+                continue
+            docs = self.post_doc[lo:hi]
+            for (a, b), off in zip(ranges, offsets):
+                i, j = np.searchsorted(docs, a), np.searchsorted(docs, b)
+                if i == j:
+                    continue
+                d = docs[i:j]
+                tf = self.post_tf[lo + i:lo + j].astype(np.float64)
+                scores[d - a + off] += idf * (tf * (k1 + 1) / (tf + self.norm[d]))
+        positions = np.concatenate([np.arange(a, b) for a, b in ranges]) if ranges else np.empty(0, dtype=np.int64)
+        return self.perm[positions], scores
+
+    def dense_scores(self, q_emb, parts):
+        """Inner product of every chunk inside parts; returns (original rows, scores)."""
+        q = np.asarray(q_emb, dtype=np.float32)
+        if len(parts) == self.num_laws:
+            return self.perm, np.asarray(self.vectors) @ q
+        rows, scores = [], []
+        for a, b in self._ranges(parts):
+            rows.append(self.perm[a:b])
+            scores.append(np.asarray(self.vectors[a:b]) @ q)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(scores)
+
+    def search_one(self, tokens, q_emb=None, top_p: int = 3, top_n: int = 2000, dense_topk: int = 100,
+                   router: str = "bm25", min_candidates: int = 1):
+        """
+        Route one question and search inside the chosen laws
+
+        Returns:
+            bm25: (rows, scores) top_n
+            dense: (rows, scores) top dense_topk or None
+            info: {"parts", "fallback"}
+        """
+        tracer = get_tracer()
+        with tracer.stage("route"):
+            parts, confident = self.route(tokens, q_emb, top_p, router)
+        fallback = not confident
+        if not fallback:
+            with tracer.stage("bm25_search"):
+                rows, scores = self.bm25_scores(tokens, parts)
+            fallback = int((scores > 0).sum()) < min_candidates
+        if fallback:
+            parts = self.all_parts
+            with tracer.stage("bm25_search"):
+                rows, scores = self.bm25_scores(tokens, parts)
+        bm25 = _rank_desc(scores, rows, top_n)
+
+        dense = None
+        if q_emb is not None and self.vectors is not None:
+            with tracer.stage("dense_search"):
+                d_rows, d_scores = self.dense_scores(q_emb, parts)
+                dense = _rank_desc(d_scores, d_rows, dense_topk)
+        tracer.count("fallback", int(fallback))
+        return bm25, dense, {"parts": parts.tolist(), "fallback": fallback}
+
+    def search(self, question_data, chunk_ids, model=None, top_p: int = 3, top_n: int = 2000,
+               dense_topk: int = 100, router: str = "bm25", min_candidates: int = 1):
+        """
+        Search every question; returns (bm25_results, dense_results) in the
+        search.py / predict_bge.py schema (dense_results is None without a model)
+        """
+        from retrieve.sparse.search import bm25_tokenizer
+        tracer = get_tracer()
+        bm25_results, dense_results = [], [] if model is not None else None
+        n_fallback = 0
+        for entry in question_data:
+            t0 = time.perf_counter()
+            with tracer.stage("tokenize"):
+                tokens = bm25_tokenizer(entry["question"])
+            q_emb = None
+            if model is not None:
+                with tracer.stage("encode"):
+                    q_emb = model.encode(entry["question"], normalize_embeddings=True, convert_to_numpy=True)
+            bm25, dense, info = self.search_one(
+                tokens, q_emb, top_p=top_p, top_n=top_n, dense_topk=dense_topk,
+                router=router, min_candidates=min_candidates
+            )
+            n_fallback += info["fallback"]
+            laws = [self.laws[p]["law_id"] for p in info["parts"]] if not info["fallback"] else []
+            bm25_results.append({
+                "qid": entry["qid"],
+                "question": entry["question"],
+                "laws": laws,
+                "top_chunks": [{"chunk_id": chunk_ids[r], "score": float(s)} for r, s in zip(*bm25)],
+            })
+            if dense is not None:
+                dense_results.append({
+                    "qid": entry["qid"],
+                    "top_chunks": [{"chunk_id": chunk_ids[r], "score": float(s)} for r, s in zip(*dense)],
+                })
+            tracer.observe("query_latency_seconds", time.perf_counter() - t0)
+        print(f"Fallback to full search: {n_fallback}/{len(question_data)} questions")
+        return bm25_results, dense_results
+
+
+# --------------------------------------------------------------------------
+# Recall / latency report
+# --------------------------------------------------------------------------
+
+def _recall(rows, relevant, aids):
+    if not relevant:
+        return 1.0
+    found = {aids[r] for r in rows} & relevant
+    return len(found) / len(relevant)
+
+
+def routing_report(searcher, question_data, aids, model=None, top_ps=(1, 2, 3, 5, 10), top_n: int = 2000,
+                   dense_topk: int = 100, router: str = "bm25", min_candidates: int = 1,
+                   recall_at=(10, 100)):
+    """
+    Recall / latency of routed search for several top_p, against full search
+
+    Args:
+        searcher: LawRoutedSearcher
+        question_data: Questions with relevant_laws
+        aids: aid of every chunk row (chunk_corpus order)
+        model: Dense encoder (None = sparse only)
+        recall_at: Cutoffs for article recall of the BM25 / dense lists
+
+    Returns:
+        rows: one dict per setting ("full" + each top_p)
+    """
+    from retrieve.sparse.search import bm25_tokenizer
+    prepared = []
+    for q in question_data:
+        tokens = bm25_tokenizer(q["question"])
+        q_emb = None
+        if model is not None:
+            q_emb = model.encode(q["question"], normalize_embeddings=True, convert_to_numpy=True)
+        prepared.append((tokens, q_emb, {int(a) for a in q.get("relevant_laws", [])}))
+
+    aid_law = {}
+    for row, aid in enumerate(aids):
+        aid_law[int(aid)] = int(searcher.partition[row])
+
+    report = []
+    for top_p in [None] + list(top_ps):
+        stats = defaultdict(list)
+        for tokens, q_emb, relevant in prepared:
+            t0 = time.perf_counter()
+            if top_p is None:
+                parts = searcher.all_parts
+                rows, scores = searcher.bm25_scores(tokens, parts)
+                bm25 = _rank_desc(scores, rows, top_n)
+                dense = None
+                if q_emb is not None and searcher.vectors is not None:
+                    d_rows, d_scores = searcher.dense_scores(q_emb, parts)
+                    dense = _rank_desc(d_scores, d_rows, dense_topk)
+                info = {"parts": parts.tolist(), "fallback": False}
+            else:
+                bm25, dense, info = searcher.search_one(
+                    tokens, q_emb, top_p=top_p, top_n=top_n, dense_topk=dense_topk,
+                    router=router, min_candidates=min_candidates
+                )
+            stats["latency"].append(time.perf_counter() - t0)
+            stats["fallback"].append(float(info["fallback"]))
+            routed = set(info["parts"])
+            relevant_laws = {aid_law[a] for a in relevant if a in aid_law}
+            stats["law_recall"].append(
+                len(relevant_laws & routed) / len(relevant_laws) if relevant_laws else 1.0
+            )
+            for k in recall_at:
+                stats[f"bm25_recall@{k}"].append(_recall(bm25[0][:k], relevant, aids))
+                if dense is not None:
+                    stats[f"dense_recall@{k}"].append(_recall(dense[0][:k], relevant, aids))
+
+        lat = sorted(stats.pop("latency"))
+        row = {"top_p": "full" if top_p is None else top_p,
+               "latency_ms_mean": 1000.0 * sum(lat) / len(lat),
+               "latency_ms_p95": 1000.0 * lat[min(len(lat) - 1, int(0.95 * len(lat)))]}
+        row.update({k: float(np.mean(v)) for k, v in stats.items()})
+        report.append(row)
+    return report
+
+
+def print_report(report):
+    keys = [k for k in report[0] if k != "top_p"]
+    print(f"{'top_p':>6} " + " ".join(f"{k:>16}" for k in keys))
+    for row in report:
+        print(f"{str(row['top_p']):>6} " + " ".join(f"{row[k]:>16.4f}" for k in keys))
+
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Law-partitioned routing index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Build the routing index")
+    p_build.add_argument("--path_chunk", type=str, default="./data/processed/chunked/chunk_corpus.json",
+                         help="Chunk corpus JSON or chunk store directory (chunks carry law_id)")
+    p_build.add_argument("--legal_corpus", type=str, default="./data/raw/legal_corpus.json",
+                         help="Law titles for the router, used if the file exists")
+    p_build.add_argument("--path_bm25", type=str, default="./retrieve/sparse/bm25_model.pkl")
+    p_build.add_argument("--path_index", type=str, default=None, help="FAISS index (bge.bin), optional")
+    p_build.add_argument("--out_dir", type=str, default="./data/law_routing")
+
+    for name, help_text in (("search", "Routed BM25 (+ dense) search"),
+                            ("report", "Recall / latency for several top_p")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--index_dir", type=str, default="./data/law_routing")
+        p.add_argument("--path_test", type=str, required=True, help="Questions JSON")
+        p.add_argument("--path_chunk", type=str, default="./data/processed/chunked/chunk_corpus.json",
+                       help="Chunk corpus JSON or chunk store directory")
+        p.add_argument("--path_model", type=str, default=None, help="Dense model (omit for BM25 only)")
+        p.add_argument("--router", type=str, default="bm25", choices=ROUTERS)
+        p.add_argument("--top_n", type=int, default=2000, help="BM25 chunks per question")
+        p.add_argument("--dense_topk", type=int, default=100, help="Dense chunks per question")
+        p.add_argument("--min_candidates", type=int, default=1,
+                       help="Fall back to full search below this many BM25 hits in the routed laws")
+        add_tracing_args(p)
+    p_search = sub.choices["search"]
+    p_search.add_argument("--top_p", type=int, default=3, help="Laws searched per question")
+    p_search.add_argument("--output_bm25", type=str, required=True)
+    p_search.add_argument("--output_dense", type=str, default=None)
+    p_report = sub.choices["report"]
+    p_report.add_argument("--top_ps", type=str, default="1,2,3,5,10", help="Comma-separated top_p values")
+    p_report.add_argument("--output", type=str, default=None, help="Write the report JSON here")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        faiss_index = None
+        if args.path_index:
+            import faiss
+            faiss_index = faiss.read_index(args.path_index)
+        with open(args.path_bm25, "rb") as f:
+            bm25_model = pickle.load(f)
+        legal_corpus = _load_json(args.legal_corpus) if os.path.exists(args.legal_corpus) else None
+        build_routing_index(load_chunk_records(args.path_chunk), bm25_model, args.out_dir,
+                            faiss_index=faiss_index, legal_corpus=legal_corpus)
+        return
+
+    from retrieve.sparse.search import load_chunk_ids
+    init_tracing(f"law_router_{args.command}", args.trace_json, args.trace_prom)
+    searcher = LawRoutedSearcher(args.index_dir)
+    question_data = _load_json(args.path_test)
+    model = None
+    if args.path_model:
+        from retrieve.dense.predict_bge import load_model
+        model, _ = load_model(args.path_model)
+
+    if args.command == "search":
+        chunk_ids = load_chunk_ids(args.path_chunk)
+        bm25_results, dense_results = searcher.search(
+            question_data, chunk_ids, model=model, top_p=args.top_p, top_n=args.top_n,
+            dense_topk=args.dense_topk, router=args.router, min_candidates=args.min_candidates
+        )
+        from retrieve.sparse.search import save_results
+        save_results(bm25_results, args.output_bm25)
+        if dense_results is not None and args.output_dense:
+            save_results(dense_results, args.output_dense)
+    else:
+        chunk_ids = load_chunk_ids(args.path_chunk)
+        aids = [int(cid.split("_")[0]) for cid in chunk_ids]
+        report = routing_report(
+            searcher, question_data, aids, model=model,
+            top_ps=[int(x) for x in args.top_ps.split(",")], top_n=args.top_n, dense_topk=args.dense_topk,
+            router=args.router, min_candidates=args.min_candidates
+        )
+        print_report(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import json
 import string
-from rank_bm25 import BM25Okapi
-from underthesea import word_tokenize
 import pickle
 from tqdm import tqdm
 
+CHUNK_CORPUS_PATH = "./data/processed/chunked/chunk_corpus.json"
+MODEL_PATH = "./retrieve/sparse/bm25_model.pkl"
+
 number = [str(i) for i in range(1, 11)]
 chars = list("abcdefghijklmnoprstuvxyđ")  
 stop_word = number + chars + [
@@ -26,20 +27,33 @@ def lower_case(w):
     return w.lower()
 
 def bm25_tokenizer(text):
+    # Import underthesea (~0.6s) chỉ khi thực sự tokenize
+    from underthesea import word_tokenize
     tokens = word_tokenize(text)
     tokens = list(map(lower_case, tokens))
     tokens = list(filter(remove_punctuation, tokens))
     tokens = list(filter(remove_stopword, tokens))
     return tokens
 
-with open("./data/processed/chunked/chunk_corpus.json", "r", encoding="utf-8") as f:
-    chunk_data = json.load(f)
+def build_bm25_model(chunk_data, show_progress=True):
+    """Tokenize chunk corpus và tạo model BM25Okapi."""
+    # Import rank_bm25 (kéo theo numpy) chỉ khi thực sự build model
+    from rank_bm25 import BM25Okapi
+
+    law_chunks = [item["content_Article"] for item in chunk_data]
+
+    tokenized_chunks = [
+        bm25_tokenizer(text)
+        for text in tqdm(law_chunks, desc="Tokenizing", disable=not show_progress)
+    ]
 
-law_chunks = [item["content_Article"] for item in chunk_data]
+    return BM25Okapi(tokenized_chunks)
 
-tokenized_chunks = [bm25_tokenizer(text) for text in tqdm(law_chunks, desc="Tokenizing")]
+if __name__ == "__main__":
+    with open(CHUNK_CORPUS_PATH, "r", encoding="utf-8") as f:
+        chunk_data = json.load(f)
 
-bm25_model = BM25Okapi(tokenized_chunks)
+    bm25_model = build_bm25_model(chunk_data)
 
-with open("./retrieve/sparse/bm25_model.pkl", "wb") as f:
-    pickle.dump(bm25_model, f)
+    with open(MODEL_PATH, "wb") as f:
+        pickle.dump(bm25_model, f)
@@ -0,0 +1,346 @@
+"""
+Static pruning of the sharded BM25 index
+
+Index đầy đủ giữ mọi posting của mọi term, kể cả các posting gần như không
+đóng góp vào điểm (term xuất hiện một lần trong chunk 400 từ). Script này
+bỏ bớt posting theo impact = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)),
+tức đúng phần điểm BM25 mà posting đó cộng vào:
+
+    term    term-centric (Carmel et al.): với mỗi term, z_t = impact lớn thứ
+            --top_k của term; giữ posting có impact >= eps * z_t, eps chọn
+            theo ngân sách (top_k posting tốt nhất của mỗi term luôn được giữ;
+            nếu chỉ riêng chúng đã vượt ngân sách thì top_k tự giảm dần)
+    doc     document-centric (Büttcher & Clarke): mỗi chunk giữ
+            ceil(keep * số term) posting có impact cao nhất
+    global  một ngưỡng impact chung cho toàn index
+
+``--keep`` là tỉ lệ posting giữ lại; tỉ lệ thực tế được ghi vào
+``manifest["pruning"]["achieved_keep"]``, kèm cảnh báo khi vượt ``--keep``
+quá KEEP_TOLERANCE (vd. top_k = 1 vẫn nhiều hơn ngân sách vì nhiều term chỉ
+có một posting, hoặc quota tối thiểu 1 posting mỗi chunk của ``doc``).
+Index sau khi prune có cùng định dạng với shard_bm25.py (IDF, avgdl, độ dài
+chunk giữ nguyên), nên dùng được ngay với ``search.py --shard_dir``. Điểm của
+mỗi chunk là tổng các posting còn lại.
+
+Với ``--path_test``, script báo cáo kích thước index, latency truy vấn và
+F2 trên tập test cho index gốc và index đã prune (thêm ``--sweep`` để thử
+nhiều ngân sách mà không ghi index) để chọn điểm vận hành có chủ đích.
+
+Example:
+    python retrieve/sparse/prune_bm25.py --shard_dir retrieve/sparse/bm25_shards \
+        --out_dir retrieve/sparse/bm25_pruned --method term --keep 0.5 \
+        --path_test data/processed/test.json --path_chunk data/processed/chunked/chunk_corpus.json \
+        --sweep 0.2,0.3,0.5,0.7
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from retrieve.sparse.shard_bm25 import MANIFEST, ShardSet, build_shards, save_shard_arrays  # noqa: E402
+
+METHODS = ("term", "doc", "global")
+KEEP_TOLERANCE = 0.01
+INDEX_FILES = ("term_ptr.npy", "post_doc.npy", "post_tf.npy", "doc_len.npy")
+
+
+def posting_impacts(shard_set: ShardSet, s: int):
+    """
+    Term id and BM25 impact of every posting of one shard
+
+    Returns:
+        term_ids: int64 array, term of each posting (postings are sorted by term, then doc)
+        impacts: float64 array
+    """
+    shard = shard_set.shard(s)
+    term_ptr = np.asarray(shard.term_ptr)
+    term_ids = np.repeat(np.arange(len(term_ptr) - 1), np.diff(term_ptr))
+    docs = np.asarray(shard.post_doc)
+    tf = np.asarray(shard.post_tf).astype(np.float64)
+    k1 = shard.k1
+    impacts = shard_set.idf[term_ids] * (tf * (k1 + 1) / (tf + shard.norm[docs]))
+    return term_ids, impacts
+
+
+def _quantile_threshold(values: np.ndarray, keep: float) -> float:
+    """Smallest threshold keeping about a `keep` fraction of values (values >= threshold)."""
+    n_keep = int(round(keep * len(values)))
+    if n_keep >= len(values):
+        return -np.inf
+    if n_keep <= 0:
+        return np.inf
+    return float(np.partition(values, len(values) - n_keep)[len(values) - n_keep])
+
+
+def rank_term_impacts(shard_set: ShardSet):
+    """
+    Postings of all shards sorted by (term, -impact), computed once for several top_k
+
+    Returns:
+        ranked: dict with term_ids, impacts, order, starts, counts and per-shard bounds
+    """
+    parts = [posting_impacts(shard_set, s) for s in range(shard_set.num_shards)]
+    term_ids = np.concatenate([p[0] for p in parts])
+    impacts = np.concatenate([p[1] for p in parts])
+    # Sắp xếp theo (term, -impact): z_t là phần tử thứ top_k của đoạn của term t
+    order = np.lexsort((-impacts, term_ids))
+    counts = np.bincount(term_ids, minlength=len(shard_set.idf))
+    starts = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    bounds = np.cumsum([0] + [len(p[0]) for p in parts])
+    return {"term_ids": term_ids, "impacts": impacts, "order": order, "starts": starts,
+            "counts": counts, "bounds": bounds}
+
+
+def term_ratios(shard_set: ShardSet, top_k: int, ranked=None):
+    """impact / z_t of every posting, z_t = top_k-th largest impact of term t over all shards."""
+    if ranked is None:
+        ranked = rank_term_impacts(shard_set)
+    counts, impacts = ranked["counts"], ranked["impacts"]
+    has = counts > 0
+    pos = ranked["starts"][:-1] + np.minimum(counts, top_k) - 1
+    z = np.full(len(counts), np.inf)
+    z[has] = impacts[ranked["order"][pos[has]]]
+    ratios = impacts / z[ranked["term_ids"]]
+    bounds = ranked["bounds"]
+    return [ratios[bounds[s]:bounds[s + 1]] for s in range(len(bounds) - 1)]
+
+
+def prune_masks(shard_set: ShardSet, method: str, keep: float, top_k: int = 10):
+    """
+    Boolean keep-mask of every shard's postings
+
+    Returns:
+        masks: List of bool arrays (one per shard, posting order)
+        info: dict with the threshold (and for "term" the top_k) that was applied
+    """
+    if method == "term":
+        ranked = rank_term_impacts(shard_set)
+        total = len(ranked["impacts"])
+        for k in range(top_k, 0, -1):
+            ratios = term_ratios(shard_set, k, ranked)
+            eps = _quantile_threshold(np.concatenate(ratios), keep)
+            # top_k posting tốt nhất của mỗi term có ratio >= 1, luôn được giữ
+            eps = min(eps, 1.0)
+            masks = [r >= eps for r in ratios]
+            # Chỉ riêng top_k posting của mỗi term đã vượt ngân sách -> giảm top_k
+            if sum(int(m.sum()) for m in masks) <= (keep + KEEP_TOLERANCE) * total:
+                break
+        return masks, {"epsilon": eps, "top_k": k, "top_k_requested": top_k}
+
+    if method == "global":
+        impacts = [posting_impacts(shard_set, s)[1] for s in range(shard_set.num_shards)]
+        threshold = _quantile_threshold(np.concatenate(impacts), keep)
+        return [imp >= threshold for imp in impacts], {"threshold": threshold}
+
+    if method == "doc":
+        masks = []
+        for s in range(shard_set.num_shards):
+            _, impacts = posting_impacts(shard_set, s)
+            docs = np.asarray(shard_set.shard(s).post_doc)
+            # Xếp hạng posting trong từng chunk theo impact giảm dần
+            order = np.lexsort((-impacts, docs))
+            counts = np.bincount(docs, minlength=shard_set.shard(s).n_docs)
+            starts = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=starts[1:])
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - starts[docs[order]]
+            quota = np.maximum(1, np.ceil(keep * counts)).astype(np.int64)
+            masks.append(rank < quota[docs])
+        return masks, {}
+
+    raise ValueError(f"method must be one of {METHODS}")
+
+
+def write_pruned(shard_set: ShardSet, masks, out_dir: str, pruning: dict):
+    """Write the kept postings as a shard directory readable by ShardSet / search.py."""
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ("vocab.json", "idf.npy"):
+        shutil.copyfile(os.path.join(shard_set.shard_dir, name), os.path.join(out_dir, name))
+
+    manifest = json.loads(json.dumps(shard_set.manifest))
+    for s, mask in enumerate(masks):
+        shard = shard_set.shard(s)
+        term_ptr = np.asarray(shard.term_ptr)
+        term_ids = np.repeat(np.arange(len(term_ptr) - 1), np.diff(term_ptr))[mask]
+        new_ptr = np.zeros(len(term_ptr), dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(term_ptr) - 1), out=new_ptr[1:])
+        doc_len = np.load(os.path.join(shard_set.shard_dir, manifest["shards"][s]["name"], "doc_len.npy"))
+        save_shard_arrays(
+            os.path.join(out_dir, manifest["shards"][s]["name"]), new_ptr,
+            np.asarray(shard.post_doc)[mask], np.asarray(shard.post_tf)[mask], doc_len
+        )
+        manifest["shards"][s]["postings"] = int(mask.sum())
+
+    manifest["pruning"] = pruning
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def prune_index(shard_dir: str, out_dir: str, method: str = "term", keep: float = 0.5, top_k: int = 10):
+    """
+    Prune a shard directory to about `keep` of its postings
+
+    Returns:
+        manifest: Manifest of the pruned index (with a "pruning" section)
+    """
+    shard_set = ShardSet(shard_dir, mmap=True)
+    masks, info = prune_masks(shard_set, method, keep, top_k)
+    before = sum(len(m) for m in masks)
+    after = sum(int(m.sum()) for m in masks)
+    achieved = after / max(1, before)
+    if achieved > keep + KEEP_TOLERANCE:
+        print(f"Warning: {method} pruning kept {achieved:.1%} of the postings, above the --keep budget "
+              f"of {keep:.1%}")
+    elif info.get("top_k", top_k) < top_k:
+        print(f"Note: top_k lowered from {top_k} to {info['top_k']} to fit the --keep budget")
+    pruning = {"method": method, "keep": keep, "achieved_keep": achieved,
+               "postings_before": before, "postings_after": after, **info}
+    return write_pruned(shard_set, masks, out_dir, pruning)
+
+
+def index_size_bytes(shard_dir: str) -> int:
+    with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return sum(
+        os.path.getsize(os.path.join(shard_dir, info["name"], name))
+        for info in manifest["shards"] for name in INDEX_FILES
+    )
+
+
+def evaluate_index(shard_dir: str, tokenized, question_data, chunk_ids, gt, top_n: int = 2000, topk: int = 3):
+    """
+    Size, per-query latency (in-process, no pool) and F2 of one shard directory
+
+    Returns:
+        report: dict, plus "hits" (top-n rows per query) for overlap computations
+    """
+    from retrieve.sparse.shard_bm25 import ShardedBM25Searcher
+    from utils.evaluate import compute_macro_f2, predictions_from_results
+
+    searcher = ShardedBM25Searcher(shard_dir, num_workers=0)
+    hits, latencies = [], []
+    for tokens in tokenized:
+        t0 = time.perf_counter()
+        hits.append(searcher.search_tokenized([tokens], top_n=top_n)[0])
+        latencies.append(time.perf_counter() - t0)
+
+    results = [
+        {"qid": q["qid"], "top_chunks": [{"chunk_id": chunk_ids[i], "score": float(v)}
+                                         for i, v in zip(idx.tolist(), vals.tolist())]}
+        for q, (idx, vals) in zip(question_data, hits)
+    ]
+    latencies.sort()
+    return {
+        "postings": sum(s["postings"] for s in searcher.shards.manifest["shards"]),
+        "size_mb": index_size_bytes(shard_dir) / 1e6,
+        "latency_ms_mean": 1000 * sum(latencies) / max(1, len(latencies)),
+        "latency_ms_p50": 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+        "f2": compute_macro_f2(gt, predictions_from_results(results, topk)),
+        "hits": [idx for idx, _ in hits],
+    }
+
+
+def overlap_at(base_hits, hits, k: int = 100) -> float:
+    """Mean |top-k(base) ∩ top-k(pruned)| / k."""
+    vals = [len(set(a[:k].tolist()) & set(b[:k].tolist())) / max(1, min(k, len(a))) for a, b in zip(base_hits, hits)]
+    return sum(vals) / max(1, len(vals))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static impact pruning of the sharded BM25 index")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Shards built by shard_bm25.py")
+    parser.add_argument("--path_model", type=str, default=None,
+                        help="bm25_model.pkl (converted to a single shard first) if --shard_dir is not given")
+    parser.add_argument("--out_dir", type=str, required=True, help="Output directory for the pruned shards")
+    parser.add_argument("--method", type=str, default="term", choices=METHODS, help="Pruning criterion")
+    parser.add_argument("--keep", type=float, default=0.5, help="Fraction of postings kept (size budget)")
+    parser.add_argument("--top_k", type=int, default=10, help="Term-centric: postings per term always kept")
+    parser.add_argument("--path_test", type=str, default=None, help="Questions with relevant_laws for the report")
+    parser.add_argument("--path_chunk", type=str, default=None, help="Chunk corpus JSON or chunk store (for F2)")
+    parser.add_argument("--top_n", type=int, default=2000, help="Chunks retrieved per query in the report")
+    parser.add_argument("--topk", type=int, default=3, help="Top-k used for F2")
+    parser.add_argument("--sweep", type=str, default=None,
+                        help="Comma-separated extra --keep values evaluated without writing an index")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    if not args.shard_dir and not args.path_model:
+        parser.error("need --shard_dir or --path_model")
+    if args.path_test and not args.path_chunk:
+        parser.error("--path_test requires --path_chunk")
+    if not 0 < args.keep <= 1:
+        parser.error("--keep must be in (0, 1]")
+
+    tmp_dir = tempfile.mkdtemp(prefix="bm25_prune_")
+    try:
+        shard_dir = args.shard_dir
+        if not shard_dir:
+            print("Loading BM25 model...")
+            with open(args.path_model, "rb") as f:
+                bm25_model = pickle.load(f)
+            shard_dir = os.path.join(tmp_dir, "full")
+            build_shards(bm25_model, shard_dir, 1)
+            del bm25_model
+
+        manifest = prune_index(shard_dir, args.out_dir, args.method, args.keep, args.top_k)
+        p = manifest["pruning"]
+        print(f"✅ {p['postings_after']}/{p['postings_before']} postings "
+              f"({p['postings_after'] / max(1, p['postings_before']):.1%}) -> {args.out_dir}")
+
+        if args.path_test:
+            from retrieve.sparse.search import load_chunk_ids
+            from retrieve.sparse.shard_bm25 import _tokenize_batch
+            from utils.evaluate import load_ground_truth
+
+            with open(args.path_test, "r", encoding="utf-8") as f:
+                question_data = json.load(f)
+            gt = load_ground_truth(Path(args.path_test))
+            chunk_ids = load_chunk_ids(args.path_chunk)
+            print(f"Tokenizing {len(question_data)} questions...")
+            tokenized = _tokenize_batch([q["question"] for q in question_data])
+
+            def run(directory):
+                return evaluate_index(directory, tokenized, question_data, chunk_ids, gt, args.top_n, args.topk)
+
+            rows = [("full", run(shard_dir)), (f"{args.method}@{args.keep:g}", run(args.out_dir))]
+            for keep in [float(x) for x in args.sweep.split(",")] if args.sweep else []:
+                sweep_dir = os.path.join(tmp_dir, f"sweep_{keep:g}")
+                prune_index(shard_dir, sweep_dir, args.method, keep, args.top_k)
+                rows.append((f"{args.method}@{keep:g}", run(sweep_dir)))
+                shutil.rmtree(sweep_dir)
+
+            base = rows[0][1]
+            print(f"\n{'index':<14} {'postings':>10} {'size MB':>9} {'mean ms':>9} {'p50 ms':>8} "
+                  f"{'F2':>7} {'dF2':>8} {'ovl@100':>8}")
+            report = []
+            for name, r in rows:
+                r["overlap_at_100"] = overlap_at(base["hits"], r.pop("hits") if r is not base else base["hits"])
+                r["delta_f2"] = r["f2"] - base["f2"]
+                report.append({"index": name, **{k: v for k, v in r.items() if k != "hits"}})
+                print(f"{name:<14} {r['postings']:>10} {r['size_mb']:>9.2f} {r['latency_ms_mean']:>9.2f} "
+                      f"{r['latency_ms_p50']:>8.2f} {r['f2']:>7.4f} {r['delta_f2']:>+8.4f} "
+                      f"{r['overlap_at_100']:>8.3f}")
+
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump({"pruning": p, "report": report}, f, indent=2)
+                print(f"\n✅ Đã lưu báo cáo vào {args.output}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import json
 import pickle
-from rank_bm25 import BM25Okapi
-from underthesea import word_tokenize
 import string
 import os
+import sys
+import time
+import argparse
 from tqdm import tqdm
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import add_tracing_args, finish_tracing, get_tracer, init_tracing
+from utils.checkpoint import add_checkpoint_args, run_checkpointed
+from utils.result_cache import add_cache_args, build_cache, cached_search, index_fingerprint
+
 # Stopword giống corpus
 number = [str(i) for i in range(1, 11)]
 chars = list("abcdefghijklmnoprstuvxyđ")
@@ -28,16 +38,14 @@ def lower_case(w):
     return w.lower()
 
 def bm25_tokenizer(text):
+    # Import underthesea (~0.6s) chỉ khi thực sự tokenize
+    from underthesea import word_tokenize
     tokens = word_tokenize(text)
     tokens = list(map(lower_case, tokens))
     tokens = list(filter(remove_punctuation, tokens))
     tokens = list(filter(remove_stopword, tokens))
     return tokens
 
-# Load câu hỏi
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, os.pardir, os.pardir))
-
 # Construct paths relative to project root
 TEST_PATH = os.path.join(ROOT_DIR, "data/private_test/private_test.json")
 CHUNK_CORPUS_PATH = os.path.join(ROOT_DIR, "data/processed/chunked/chunk_corpus.json")
@@ -46,45 +54,138 @@ MODEL_PATH = os.path.join(BASE_DIR, "bm25_model.pkl")
 
 OUTPUT_PATH = os.path.join(ROOT_DIR, "results", "private_test", "bm25_512_private_test.json")
 
-os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-
-# Load câu hỏi
-with open(TEST_PATH, "r", encoding="utf-8") as f:
-    question_data = json.load(f)
-
-# Load mô hình BM25
-with open(MODEL_PATH, "rb") as f:
-    bm25_model = pickle.load(f)
-
-# Load chunk_id gốc (dùng để truy vết)
-with open(CHUNK_CORPUS_PATH, "r", encoding="utf-8") as f:
-    chunk_data = json.load(f)
-chunk_ids = [item["chunk_id"] for item in chunk_data]
-
-# Truy xuất top 100 chunk_id cho từng câu hỏi
-results = []
-
-for entry in tqdm(question_data, desc="Processing Questions"):
-    qid = entry["qid"]
-    question = entry["question"]
-
-    tokenized_query = bm25_tokenizer(question)
-    scores = bm25_model.get_scores(tokenized_query)
-
-    top_n = 2000
-    top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_n]
-
-    top_chunks = [
-        {"chunk_id": chunk_ids[i], "score": float(scores[i])}
-        for i in top_indices
-    ]
-
-    results.append({
-        "qid": qid,
-        "question": question,
-        "top_chunks": top_chunks
-    })
-
-# Lưu kết quả ra file JSON
-with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-    json.dump(results, f, ensure_ascii=False, indent=2)
+TOP_N = 2000
+
+
+def load_questions(path: str):
+    # Load câu hỏi
+    with get_tracer().stage("load_questions"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def load_bm25_model(path: str):
+    # Load mô hình BM25
+    with get_tracer().stage("load_index"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def load_chunk_ids(path: str):
+    # Load chunk_id gốc (dùng để truy vết)
+    with get_tracer().stage("load_chunk_ids"):
+        if os.path.isdir(path):
+            # Chunk store (utils/chunk_store.py): chỉ mở phần id, không đọc text
+            from utils.chunk_store import ChunkIdView, is_chunk_store
+            if not is_chunk_store(path):
+                raise ValueError(f"{path} is not a chunk store (missing manifest.json)")
+            return ChunkIdView(path)
+        with open(path, "r", encoding="utf-8") as f:
+            chunk_data = json.load(f)
+        return [item["chunk_id"] for item in chunk_data]
+
+
+def search_questions(question_data, bm25_model, chunk_ids, top_n: int = TOP_N, show_progress=True):
+    # Truy xuất top_n chunk_id cho từng câu hỏi
+    tracer = get_tracer()
+    results = []
+
+    for entry in tqdm(question_data, desc="Processing Questions", disable=not show_progress):
+        t0 = time.perf_counter()
+        qid = entry["qid"]
+        question = entry["question"]
+
+        with tracer.stage("tokenize"):
+            tokenized_query = bm25_tokenizer(question)
+        with tracer.stage("index_search"):
+            scores = bm25_model.get_scores(tokenized_query)
+
+        with tracer.stage("rank"):
+            top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_n]
+
+        with tracer.stage("build_results"):
+            top_chunks = [
+                {"chunk_id": chunk_ids[i], "score": float(scores[i])}
+                for i in top_indices
+            ]
+
+        results.append({
+            "qid": qid,
+            "question": question,
+            "top_chunks": top_chunks
+        })
+        tracer.observe("query_latency_seconds", time.perf_counter() - t0)
+        tracer.count("candidates", len(top_chunks))
+
+    return results
+
+
+def save_results(results, output_path: str):
+    # Lưu kết quả ra file JSON
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with get_tracer().stage("serialize"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 retrieval over the chunk corpus")
+    parser.add_argument("--path_test", type=str, default=TEST_PATH, help="Path to queries JSON file")
+    parser.add_argument("--path_chunk", type=str, default=CHUNK_CORPUS_PATH, help="Path to chunk corpus JSON file or chunk store directory")
+    parser.add_argument("--path_model", type=str, default=MODEL_PATH, help="Path to bm25_model.pkl")
+    parser.add_argument("--output_file", type=str, default=OUTPUT_PATH, help="Output file path for results JSON")
+    parser.add_argument("--top_n", type=int, default=TOP_N, help="Number of chunks kept per query (default: 2000)")
+    parser.add_argument("--shard_dir", type=str, default=None,
+                        help="Use shards built by shard_bm25.py instead of bm25_model.pkl")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for sharded search (default: all cores)")
+    add_tracing_args(parser)
+    add_cache_args(parser)
+    add_checkpoint_args(parser)
+    args = parser.parse_args()
+
+    init_tracing("search", args.trace_json, args.trace_prom)
+
+    question_data = load_questions(args.path_test)
+    chunk_ids = load_chunk_ids(args.path_chunk)
+    # Shard và bm25_model.pkl cho cùng kết quả, nhưng fingerprint theo file thực sự được đọc
+    cache = build_cache(args, "search", [args.shard_dir or args.path_model, args.path_chunk], {"top_n": args.top_n})
+
+    loaded = {}
+
+    def run_search(questions):
+        # Model / worker pool chỉ được load khi có câu hỏi chưa có trong cache, và chỉ một lần
+        if args.shard_dir:
+            if "searcher" not in loaded:
+                from retrieve.sparse.shard_bm25 import ShardedBM25Searcher
+                loaded["searcher"] = ShardedBM25Searcher(args.shard_dir, num_workers=args.num_workers)
+            return loaded["searcher"].search(questions, chunk_ids, top_n=args.top_n)
+        if "model" not in loaded:
+            loaded["model"] = load_bm25_model(args.path_model)
+        return search_questions(questions, loaded["model"], chunk_ids, top_n=args.top_n)
+
+    try:
+        if args.checkpoint:
+            fingerprint = index_fingerprint(
+                [args.path_test, args.shard_dir or args.path_model, args.path_chunk], {"top_n": args.top_n}
+            )
+            stats = run_checkpointed(
+                question_data, lambda qs: cached_search(qs, cache, run_search), args.output_file,
+                fingerprint, args.checkpoint_every, args.overwrite, args.keep_checkpoint
+            )
+            print(f"✅ {stats['written']} kết quả -> {args.output_file} "
+                  f"({stats['skipped']} câu hỏi lấy từ checkpoint)")
+        else:
+            results = cached_search(question_data, cache, run_search)
+            save_results(results, args.output_file)
+    finally:
+        if "searcher" in loaded:
+            loaded["searcher"].close()
+    if cache is not None:
+        cache.save()
+
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Multi-core sharded BM25 search.
+
+The BM25Okapi model built by create_model_bm25.py is split into N contiguous
+chunk shards, each stored as an inverted index (CSR arrays in .npy files).
+IDF, average document length, k1 and b stay global, so every chunk gets
+exactly the score ``BM25Okapi.get_scores`` would give it.
+
+Workers of a persistent process pool memory-map the shard arrays (the page
+cache is shared between processes), score query batches on their shard and
+return per-shard top-n lists, which the parent merges. Ties are broken by
+chunk index like the ``sorted(...)`` call in search.py, so the output is
+identical to the single-core path.
+
+Build shards:
+    python retrieve/sparse/shard_bm25.py --path_model retrieve/sparse/bm25_model.pkl \
+        --out_dir retrieve/sparse/bm25_shards --num_shards 8
+
+Search with them:
+    python retrieve/sparse/search.py --shard_dir retrieve/sparse/bm25_shards --num_workers 8
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import pickle
+import sys
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import get_tracer  # noqa: E402
+
+MANIFEST = "manifest.json"
+
+
+# --------------------------------------------------------------------------
+# Build
+# --------------------------------------------------------------------------
+
+def build_inverted_arrays(doc_freqs, vocab):
+    """
+    Build CSR inverted-index arrays for a list of {term: tf} documents
+
+    Args:
+        doc_freqs: List of per-document term frequency dicts
+        vocab: Mapping term -> term id (global)
+
+    Returns:
+        term_ptr: int64 array (V + 1,), postings of term t are [term_ptr[t], term_ptr[t+1])
+        post_doc: int32 array of local document indices
+        post_tf: int32 array of term frequencies
+    """
+    n_postings = sum(len(d) for d in doc_freqs)
+    term_ids = np.empty(n_postings, dtype=np.int64)
+    docs = np.empty(n_postings, dtype=np.int32)
+    tfs = np.empty(n_postings, dtype=np.int32)
+    pos = 0
+    for local_idx, freqs in enumerate(doc_freqs):
+        n = len(freqs)
+        term_ids[pos:pos + n] = [vocab[t] for t in freqs]
+        docs[pos:pos + n] = local_idx
+        tfs[pos:pos + n] = list(freqs.values())
+        pos += n
+
+    # Sắp xếp theo (term, doc) để postings của mỗi term liền nhau, doc tăng dần
+    order = np.lexsort((docs, term_ids))
+    term_ids, docs, tfs = term_ids[order], docs[order], tfs[order]
+    counts = np.bincount(term_ids, minlength=len(vocab))
+    term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(counts, out=term_ptr[1:])
+    return term_ptr, docs, tfs
+
+
+def save_shard_arrays(shard_path, term_ptr, post_doc, post_tf, doc_len):
+    os.makedirs(shard_path, exist_ok=True)
+    np.save(os.path.join(shard_path, "term_ptr.npy"), term_ptr)
+    np.save(os.path.join(shard_path, "post_doc.npy"), post_doc)
+    np.save(os.path.join(shard_path, "post_tf.npy"), post_tf)
+    np.save(os.path.join(shard_path, "doc_len.npy"), np.asarray(doc_len, dtype=np.int64))
+
+
+def build_shards(bm25_model, out_dir: str, num_shards: int):
+    """
+    Partition a BM25Okapi model into num_shards contiguous chunk shards
+
+    Args:
+        bm25_model: rank_bm25.BM25Okapi object (from bm25_model.pkl)
+        out_dir: Output directory for the shard files
+        num_shards: Number of shards
+
+    Returns:
+        manifest: dict describing the shards
+    """
+    n_docs = bm25_model.corpus_size
+    num_shards = max(1, min(num_shards, n_docs))
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Vocabulary global, idf global -> điểm số giống hệt model gốc
+    terms = sorted(bm25_model.idf)
+    vocab = {t: i for i, t in enumerate(terms)}
+    idf = np.array([bm25_model.idf[t] for t in terms], dtype=np.float64)
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    np.save(os.path.join(out_dir, "idf.npy"), idf)
+
+    bounds = np.linspace(0, n_docs, num_shards + 1).astype(np.int64)
+    shards = []
+    for s in range(num_shards):
+        start, end = int(bounds[s]), int(bounds[s + 1])
+        term_ptr, post_doc, post_tf = build_inverted_arrays(bm25_model.doc_freqs[start:end], vocab)
+        name = f"shard_{s:03d}"
+        save_shard_arrays(os.path.join(out_dir, name), term_ptr, post_doc, post_tf,
+                          bm25_model.doc_len[start:end])
+        shards.append({"name": name, "start": start, "end": end, "postings": int(len(post_doc))})
+        print(f"Shard {s}: chunks [{start}, {end}), {len(post_doc)} postings")
+
+    manifest = {
+        "corpus_size": int(n_docs),
+        "avgdl": float(bm25_model.avgdl),
+        "k1": float(bm25_model.k1),
+        "b": float(bm25_model.b),
+        "vocab_size": len(terms),
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# --------------------------------------------------------------------------
+# Scoring
+# --------------------------------------------------------------------------
+
+class BM25Shard:
+    """Memory-mapped inverted index of one shard."""
+
+    def __init__(self, shard_path: str, start: int, avgdl: float, k1: float, b: float, mmap: bool = True):
+        mode = "r" if mmap else None
+        self.start = start
+        self.k1 = k1
+        self.term_ptr = np.load(os.path.join(shard_path, "term_ptr.npy"), mmap_mode=mode)
+        self.post_doc = np.load(os.path.join(shard_path, "post_doc.npy"), mmap_mode=mode)
+        self.post_tf = np.load(os.path.join(shard_path, "post_tf.npy"), mmap_mode=mode)
+        doc_len = np.load(os.path.join(shard_path, "doc_len.npy"))
+        self.n_docs = len(doc_len)
+        # Cùng biểu thức với BM25Okapi.get_scores để kết quả trùng từng bit
+        self.norm = k1 * (1 - b + b * doc_len / avgdl)
+
+    def get_scores(self, term_ids, idf_values):
+        """
+        BM25 scores of every chunk in the shard for one query
+
+        Args:
+            term_ids: Term ids of the query tokens (duplicates kept, like BM25Okapi)
+            idf_values: Global idf of each token
+        """
+        k1 = self.k1
+        scores = np.zeros(self.n_docs)
+        for tid, idf in zip(term_ids, idf_values):
+            lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+            if lo == hi:
+                continue
+            docs = self.post_doc[lo:hi]
+            tf = self.post_tf[lo:hi].astype(np.float64)
+            scores[docs] += idf * (tf * (k1 + 1) / (tf + self.norm[docs]))
+        return scores
+
+
+def topk_indices(scores, k: int, offset: int = 0):
+    """
+    Indices of the k highest scores, ties broken by lower index first
+    (same order as ``sorted(range(n), key=scores.__getitem__, reverse=True)``)
+
+    Returns:
+        idx: int64 array of indices (+ offset)
+        vals: scores of those indices
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+        # Lấy tất cả phần tử bằng ngưỡng để xử lý tie đúng thứ tự
+        cand = np.flatnonzero(scores >= scores[part].min())
+    else:
+        cand = np.arange(n)
+    order = np.lexsort((cand, -scores[cand]))[:k]
+    idx = cand[order]
+    return idx.astype(np.int64) + offset, scores[idx]
+
+
+def merge_topk(parts, k: int):
+    """Merge per-shard (global_idx, scores) lists into one global top-k."""
+    idx = np.concatenate([p[0] for p in parts])
+    vals = np.concatenate([p[1] for p in parts])
+    order = np.lexsort((idx, -vals))[:k]
+    return idx[order], vals[order]
+
+
+class ShardSet:
+    """All shards of a shard directory plus the global vocabulary."""
+
+    def __init__(self, shard_dir: str, mmap: bool = True):
+        with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(shard_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = {t: i for i, t in enumerate(json.load(f))}
+        self.idf = np.load(os.path.join(shard_dir, "idf.npy"))
+        self.shard_dir = shard_dir
+        self.mmap = mmap
+        self._shards = {}
+
+    @property
+    def num_shards(self):
+        return len(self.manifest["shards"])
+
+    def shard(self, s: int) -> BM25Shard:
+        if s not in self._shards:
+            info = self.manifest["shards"][s]
+            m = self.manifest
+            self._shards[s] = BM25Shard(os.path.join(self.shard_dir, info["name"]), info["start"],
+                                        m["avgdl"], m["k1"], m["b"], mmap=self.mmap)
+        return self._shards[s]
+
+    def encode_query(self, tokens):
+        """Map query tokens to (term_ids, idf) arrays; unknown tokens add 0 and are dropped."""
+        term_ids = [self.vocab[t] for t in tokens if t in self.vocab]
+        term_ids = np.array(term_ids, dtype=np.int64)
+        return term_ids, self.idf[term_ids]
+
+
+# Trạng thái của mỗi worker process (được load một lần trong initializer)
+_WORKER_SHARDS = None
+
+
+def _init_worker(shard_dir: str):
+    global _WORKER_SHARDS
+    _WORKER_SHARDS = ShardSet(shard_dir, mmap=True)
+
+
+def _score_task(shard_idx, encoded_queries, top_n, shard_set=None):
+    shard_set = shard_set or _WORKER_SHARDS
+    shard = shard_set.shard(shard_idx)
+    out = []
+    for term_ids, idf_values in encoded_queries:
+        scores = shard.get_scores(term_ids, idf_values)
+        out.append(topk_indices(scores, top_n, offset=shard.start))
+    return out
+
+
+def _tokenize_batch(questions):
+    from retrieve.sparse.search import bm25_tokenizer
+    return [bm25_tokenizer(q) for q in questions]
+
+
+class ShardedBM25Searcher:
+    """
+    Score query batches across a persistent pool of worker processes
+
+    Args:
+        shard_dir: Directory written by build_shards
+        num_workers: Number of worker processes (0 = score in this process)
+        batch_size: Queries per task; tasks are (shard, batch) pairs
+    """
+
+    def __init__(self, shard_dir: str, num_workers: int = None, batch_size: int = 64):
+        self.shards = ShardSet(shard_dir, mmap=True)
+        self.batch_size = batch_size
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.pool = None
+        if num_workers > 0:
+            self.pool = mp.get_context("spawn").Pool(
+                processes=num_workers, initializer=_init_worker, initargs=(shard_dir,)
+            )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tokenize(self, questions):
+        """Tokenize questions with bm25_tokenizer, spread over the pool."""
+        if self.pool is None:
+            return _tokenize_batch(questions)
+        batches = [questions[i:i + self.batch_size] for i in range(0, len(questions), self.batch_size)]
+        return [tokens for batch in self.pool.map(_tokenize_batch, batches) for tokens in batch]
+
+    def search_tokenized(self, tokenized_queries, top_n: int = 2000):
+        """
+        Returns:
+            results: list of (global_idx, scores) arrays, one per query
+        """
+        encoded = [self.shards.encode_query(tokens) for tokens in tokenized_queries]
+        batches = [(b, encoded[b:b + self.batch_size]) for b in range(0, len(encoded), self.batch_size)]
+        tasks = [(s, batch, top_n) for s in range(self.shards.num_shards) for _, batch in batches]
+
+        if self.pool is None:
+            outputs = [_score_task(s, batch, k, shard_set=self.shards) for s, batch, k in tasks]
+        else:
+            outputs = self.pool.starmap(_score_task, tasks)
+
+        # outputs[s * n_batches + b][i] là top-n của query (b, i) trên shard s
+        n_batches = len(batches)
+        results = []
+        for b, (start, batch) in enumerate(batches):
+            for i in range(len(batch)):
+                parts = [outputs[s * n_batches + b][i] for s in range(self.shards.num_shards)]
+                results.append(merge_topk(parts, top_n))
+        return results
+
+    def search(self, question_data, chunk_ids, top_n: int = 2000):
+        """Same output schema as search.search_questions."""
+        tracer = get_tracer()
+        questions = [entry["question"] for entry in question_data]
+        with tracer.stage("tokenize"):
+            tokenized = self.tokenize(questions)
+        with tracer.stage("index_search"):
+            hits = self.search_tokenized(tokenized, top_n=top_n)
+        results = []
+        with tracer.stage("build_results"):
+            for entry, (idx, vals) in zip(question_data, hits):
+                top_chunks = [
+                    {"chunk_id": chunk_ids[i], "score": float(v)}
+                    for i, v in zip(idx.tolist(), vals.tolist())
+                ]
+                tracer.count("candidates", len(top_chunks))
+                results.append({
+                    "qid": entry["qid"],
+                    "question": entry["question"],
+                    "top_chunks": top_chunks
+                })
+        return results
+
+
+def verify_against_model(bm25_model, shard_dir: str, tokenized_queries, top_n: int = 2000):
+    """
+    Compare sharded top-n with BM25Okapi.get_scores + sorted()
+
+    Returns:
+        n_mismatch: number of queries whose ranking or scores differ
+    """
+    shard_set = ShardSet(shard_dir, mmap=True)
+    n_mismatch = 0
+    for tokens in tokenized_queries:
+        ref = bm25_model.get_scores(tokens)
+        ref_idx = sorted(range(len(ref)), key=lambda i: ref[i], reverse=True)[:top_n]
+        term_ids, idf_values = shard_set.encode_query(tokens)
+        parts = [_score_task(s, [(term_ids, idf_values)], top_n, shard_set=shard_set)[0]
+                 for s in range(shard_set.num_shards)]
+        idx, vals = merge_topk(parts, top_n)
+        if idx.tolist() != ref_idx or vals.tolist() != [float(ref[i]) for i in ref_idx]:
+            n_mismatch += 1
+    return n_mismatch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split bm25_model.pkl into chunk shards for multi-core search")
+    parser.add_argument("--path_model", type=str, required=True, help="Path to bm25_model.pkl")
+    parser.add_argument("--out_dir", type=str, required=True, help="Output directory for the shards")
+    parser.add_argument("--num_shards", type=int, default=os.cpu_count() or 1, help="Number of shards")
+    parser.add_argument("--verify_queries", type=str, default=None,
+                        help="Optional queries JSON; check sharded results equal the original model")
+    args = parser.parse_args()
+
+    print("Loading BM25 model...")
+    with open(args.path_model, "rb") as f:
+        bm25_model = pickle.load(f)
+
+    build_shards(bm25_model, args.out_dir, args.num_shards)
+
+    if args.verify_queries:
+        with open(args.verify_queries, "r", encoding="utf-8") as f:
+            questions = [q["question"] for q in json.load(f)]
+        n_mismatch = verify_against_model(bm25_model, args.out_dir, _tokenize_batch(questions))
+        print(f"Verified {len(questions)} queries, mismatches: {n_mismatch}")
+
+    print(f"✅ Đã lưu shards vào {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
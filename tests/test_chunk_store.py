@@ -0,0 +1,42 @@
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.chunk import build_text_splitter, chunk_corpus
+from utils.chunk_store import ChunkIdView, ChunkStore, build_chunk_store
+
+CORPUS = [
+    {"aid": 1, "law_id": "52/2014/QH13", "content_Article": "Điều 1. Phạm vi điều chỉnh\n" + "từ " * 30},
+    {"aid": 2, "law_id": "52/2014/QH13", "content_Article": "Điều 2. Đối tượng áp dụng"},
+    {"aid": 3, "law_id": "81/2023/NĐ-CP", "content_Article": "Điều 1. Giải thích từ ngữ\n" + "câu " * 45},
+]
+
+
+def test_store_round_trips_chunk_corpus(tmp_path):
+    # Chunk corpus đúng như utils/chunk.py sinh ra từ corpus.json có law_id
+    chunk_data = chunk_corpus(CORPUS, build_text_splitter(chunk_size=16, chunk_overlap=4))
+    assert len(chunk_data) > len(CORPUS)
+    assert all("law_id" in c for c in chunk_data)
+
+    manifest = build_chunk_store(chunk_data, str(tmp_path))
+    assert manifest["extra_fields"] == ["law_id"]
+
+    store = ChunkStore(str(tmp_path))
+    assert [store.get(i) for i in range(len(store))] == chunk_data
+    assert store.get_by_aid(3) == [c for c in chunk_data if c["aid"] == 3]
+
+    view = ChunkIdView(str(tmp_path))
+    assert [view.extra(i)["law_id"] for i in range(len(view))] == [c["law_id"] for c in chunk_data]
+
+
+def test_store_without_extra_fields(tmp_path):
+    corpus = [{"aid": c["aid"], "content_Article": c["content_Article"]} for c in CORPUS]
+    chunk_data = chunk_corpus(corpus, build_text_splitter(chunk_size=16, chunk_overlap=4))
+    build_chunk_store(chunk_data, str(tmp_path))
+
+    store = ChunkStore(str(tmp_path))
+    assert [store.get(i) for i in range(len(store))] == chunk_data
+    assert store.extra(0) == {}
@@ -0,0 +1,174 @@
+"""
+Checkpointed, resumable batch retrieval shared by search.py and predict_bge.py
+
+Không có checkpoint, kết quả được gom trong một list và chỉ ghi ra JSON ở cuối:
+process chết giữa chừng là mất hết, và bộ nhớ tăng theo số câu hỏi. Với
+``--checkpoint``, câu hỏi được xử lý theo batch và mỗi batch được append vào
+
+    <output_file>.parts/results.jsonl   một record / dòng, append-only
+    <output_file>.parts/manifest.json   fingerprint, số record và số byte hợp lệ
+
+Chạy lại cùng lệnh sẽ cắt phần batch ghi dở (sau lần cập nhật manifest cuối),
+bỏ qua các qid đã có và tiếp tục. Khi xong, results.jsonl được compact (đọc
+từng dòng) thành file JSON chuẩn ở output_file, giống hệt file ghi một lần,
+rồi thư mục .parts bị xóa (trừ khi ``--keep_checkpoint``).
+
+Fingerprint gồm file câu hỏi, index và tham số search; checkpoint của cấu hình
+khác sẽ bị từ chối thay vì bị trộn vào output.
+
+Usage in an entry point::
+
+    fingerprint = index_fingerprint([args.path_test, args.path_model], {"top_n": args.top_n})
+    run_checkpointed(question_data, search_fn, args.output_file, fingerprint, args.checkpoint_every)
+"""
+import json
+import os
+import shutil
+
+from utils.instrumentation import get_tracer
+
+RESULTS = "results.jsonl"
+MANIFEST = "manifest.json"
+DEFAULT_CHECKPOINT_EVERY = 256
+
+
+class CheckpointedOutput:
+    """
+    Append-only JSONL output with a progress manifest
+
+    Args:
+        output_path: Final result file; the checkpoint lives in ``output_path + ".parts"``
+        fingerprint: index_fingerprint of the inputs and parameters
+    """
+
+    def __init__(self, output_path: str, fingerprint: str):
+        self.output_path = output_path
+        self.fingerprint = fingerprint
+        self.dir = output_path + ".parts"
+        self.results_path = os.path.join(self.dir, RESULTS)
+        self.manifest_path = os.path.join(self.dir, MANIFEST)
+        self.records = 0
+        self.bytes = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path) and os.path.exists(self.results_path)
+
+    def reset(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir, exist_ok=True)
+        open(self.results_path, "wb").close()
+        self.records = self.bytes = 0
+        self._save_manifest()
+
+    def resume(self):
+        """Truncate a partially written batch and return the set of finished qids."""
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["fingerprint"] != self.fingerprint:
+            raise ValueError(
+                f"{self.dir} was written with other inputs or settings; "
+                f"use --overwrite or another --output_file"
+            )
+        self.records, self.bytes = manifest["records"], manifest["bytes"]
+        with open(self.results_path, "r+b") as f:
+            f.truncate(self.bytes)
+        return {rec["qid"] for rec in self.iter_records()}
+
+    def iter_records(self):
+        """Stream the checkpointed records in write order."""
+        with open(self.results_path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def append(self, records):
+        """Append one batch, fsync it, then record the new valid length in the manifest."""
+        with get_tracer().stage("checkpoint"):
+            with open(self.results_path, "ab") as f:
+                for rec in records:
+                    f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                self.bytes = f.tell()
+            self.records += len(records)
+            self._save_manifest()
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "records": self.records, "bytes": self.bytes}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def compact(self, keep: bool = False):
+        """
+        Stream results.jsonl into output_path as a standard result JSON
+
+        The file is byte-identical to ``json.dump(results, f, ensure_ascii=False, indent=2)``.
+        """
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        tmp_path = self.output_path + ".tmp"
+        n = 0
+        with get_tracer().stage("serialize"):
+            with open(tmp_path, "w", encoding="utf-8") as out:
+                for rec in self.iter_records():
+                    out.write("[\n  " if n == 0 else ",\n  ")
+                    # Chuỗi JSON không chứa newline thật, nên thụt lề theo dòng là an toàn
+                    out.write(json.dumps(rec, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+                    n += 1
+                out.write("\n]" if n else "[]")
+            os.replace(tmp_path, self.output_path)
+        if not keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        return n
+
+
+def run_checkpointed(question_data, search_fn, output_path: str, fingerprint: str,
+                     batch_size: int = DEFAULT_CHECKPOINT_EVERY, overwrite: bool = False,
+                     keep: bool = False):
+    """
+    Search question_data batch by batch into a resumable checkpoint, then compact it
+
+    Args:
+        question_data: List of dicts with 'qid' and 'question'
+        search_fn: Callable taking a list of question dicts, returning one record per question
+        output_path: Final result JSON
+        fingerprint: index_fingerprint of the question file, index files and parameters
+        batch_size: Questions per checkpointed batch
+        overwrite: Ignore an existing checkpoint
+        keep: Keep the .parts directory after compaction
+
+    Returns:
+        stats: dict with questions, skipped (already done), searched and written records
+    """
+    checkpoint = CheckpointedOutput(output_path, fingerprint)
+    done = set()
+    if checkpoint.exists() and not overwrite:
+        done = checkpoint.resume()
+        print(f"Resuming from checkpoint: {len(done)} qids already done")
+    else:
+        checkpoint.reset()
+
+    pending = [q for q in question_data if q["qid"] not in done]
+    for b in range(0, len(pending), batch_size):
+        batch = pending[b:b + batch_size]
+        checkpoint.append(search_fn(batch))
+        print(f"Checkpoint: {checkpoint.records} records ({b + len(batch)}/{len(pending)} pending questions)")
+
+    written = checkpoint.compact(keep)
+    return {
+        "questions": len(question_data),
+        "skipped": len(question_data) - len(pending),
+        "searched": len(pending),
+        "written": written,
+    }
+
+
+def add_checkpoint_args(parser):
+    """Add --checkpoint / --checkpoint_every / --overwrite / --keep_checkpoint to an argparse parser."""
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Write results batch by batch to <output_file>.parts and resume after a crash")
+    parser.add_argument("--checkpoint_every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help=f"Questions per checkpointed batch (default: {DEFAULT_CHECKPOINT_EVERY})")
+    parser.add_argument("--overwrite", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--keep_checkpoint", action="store_true",
+                        help="Keep <output_file>.parts after writing the final result file")
+    return parser
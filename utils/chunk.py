@@ -1,31 +1,54 @@
 import json
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 input_path = "./data/processed/corpus.json"
 output_path = "./data/processed/chunked/chunk_corpus.json"
 
-with open(input_path, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=400,              # 400 từ
-    chunk_overlap=50,            # overlap 50 từ
-    length_function=lambda s: len(s.split()),
-    separators=["\n\n", "\n", " ", ""],  # giữ logic cắt gọn gàng
-)
-
-chunked_data = []
-
-for item in data:
-    aid = item["aid"]
-    content = item["content_Article"]
-    chunks = text_splitter.split_text(content)
-    for idx, chunk in enumerate(chunks):
-        chunked_data.append({
-            "aid": aid,
-            "chunk_id": f"{aid}_{idx}",
-            "content_Article": chunk
-        })
-
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(chunked_data, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+
+def build_text_splitter(chunk_size: int = 400, chunk_overlap: int = 50):
+    """Tạo text splitter đếm độ dài theo số từ."""
+    # Import langchain (~1s) chỉ khi thực sự chunk
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,          # 400 từ
+        chunk_overlap=chunk_overlap,    # overlap 50 từ
+        length_function=lambda s: len(s.split()),
+        separators=["\n\n", "\n", " ", ""],  # giữ logic cắt gọn gàng
+    )
+
+
+def chunk_record(item, idx: int, chunk: str):
+    """Record của chunk thứ idx của điều luật item (corpus.json), như trong chunk_corpus.json."""
+    record = {
+        "aid": item["aid"],
+        "chunk_id": f"{item['aid']}_{idx}",
+        "content_Article": chunk
+    }
+    if "law_id" in item:
+        record["law_id"] = item["law_id"]
+    return record
+
+
+def chunk_corpus(data, text_splitter=None):
+    """Chia các điều luật thành chunks với chunk_id `{aid}_{idx}`."""
+    if text_splitter is None:
+        text_splitter = build_text_splitter()
+
+    chunked_data = []
+
+    for item in data:
+        chunks = text_splitter.split_text(item["content_Article"])
+        for idx, chunk in enumerate(chunks):
+            chunked_data.append(chunk_record(item, idx, chunk))
+
+    return chunked_data
+
+
+if __name__ == "__main__":
+    with open(input_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    chunked_data = chunk_corpus(data)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(chunked_data, f, ensure_ascii=False, indent=4)
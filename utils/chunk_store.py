@@ -0,0 +1,256 @@
+"""
+Offset-indexed, memory-mapped chunk store
+
+chunk_corpus.json phải được json.load toàn bộ (kể cả nội dung chunk) chỉ để
+lấy danh sách chunk_id. Chunk store lưu cùng dữ liệu theo dạng:
+
+    texts.bin        nội dung các chunk nối liền (UTF-8)
+    text_offsets.npy int64 (n + 1,), text của row i là texts.bin[off[i]:off[i+1]]
+    ids.bin          chunk_id nối liền (UTF-8)
+    id_offsets.npy   int64 (n + 1,)
+    aids.npy         aid của từng row (int64, hoặc object nếu aid không phải số)
+    extras.bin       (nếu có) các field khác của chunk (vd. law_id), JSON mỗi row
+    extra_offsets.npy
+    manifest.json
+
+Row i là chunk thứ i của chunk_corpus.json, tức cũng là row của FAISS index,
+của corpus_meta.pkl và của BM25. Mọi file đều được memory-map, chỉ đoạn được
+truy cập mới được đọc từ đĩa.
+
+ChunkIdView chỉ mở ids.bin / aids.npy, dùng cho retriever (search.py) để không
+phải giải mã text. ChunkStore thêm truy cập text theo row, chunk_id hoặc aid.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+CORE_FIELDS = ("aid", "chunk_id", "content_Article")
+
+
+def _write_blob(strings, blob_path: str, offsets_path: str):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(blob_path, "wb") as f:
+        pos = 0
+        for i, s in enumerate(strings):
+            data = s.encode("utf-8")
+            f.write(data)
+            pos += len(data)
+            offsets[i + 1] = pos
+    np.save(offsets_path, offsets)
+    return int(offsets[-1])
+
+
+def build_chunk_store(chunk_data, out_dir: str):
+    """
+    Ghi chunk corpus thành chunk store
+
+    Args:
+        chunk_data: List chunk {"aid", "chunk_id", "content_Article", ...} như chunk_corpus.json;
+            các field khác (vd. law_id) được lưu nguyên trong extras.bin
+        out_dir: Thư mục output
+
+    Returns:
+        manifest: dict mô tả store
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    text_bytes = _write_blob(
+        [c["content_Article"] for c in chunk_data],
+        os.path.join(out_dir, "texts.bin"), os.path.join(out_dir, "text_offsets.npy")
+    )
+    id_bytes = _write_blob(
+        [str(c["chunk_id"]) for c in chunk_data],
+        os.path.join(out_dir, "ids.bin"), os.path.join(out_dir, "id_offsets.npy")
+    )
+    aids = [c["aid"] for c in chunk_data]
+    numeric = all(isinstance(a, int) and not isinstance(a, bool) for a in aids)
+    np.save(
+        os.path.join(out_dir, "aids.npy"),
+        np.asarray(aids, dtype=np.int64) if numeric else np.asarray(aids, dtype=object),
+        allow_pickle=not numeric
+    )
+
+    extras = [{k: v for k, v in c.items() if k not in CORE_FIELDS} for c in chunk_data]
+    extra_fields = sorted({k for e in extras for k in e})
+    extra_path = os.path.join(out_dir, "extras.bin")
+    extra_offsets_path = os.path.join(out_dir, "extra_offsets.npy")
+    if extra_fields:
+        _write_blob([json.dumps(e, ensure_ascii=False) if e else "" for e in extras], extra_path, extra_offsets_path)
+    else:
+        # Không để lại extras của lần build trước
+        for path in (extra_path, extra_offsets_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest = {
+        "num_chunks": len(chunk_data),
+        "text_bytes": text_bytes,
+        "id_bytes": id_bytes,
+        "aid_dtype": "int64" if numeric else "object",
+        "extra_fields": extra_fields,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Đã lưu {len(chunk_data)} chunks ({text_bytes / 1e6:.1f} MB text) vào {out_dir}")
+    return manifest
+
+
+class _Blob:
+    """Memory-mapped UTF-8 strings addressed by an offset array."""
+
+    def __init__(self, blob_path: str, offsets_path: str):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        # np.memmap không mở được file rỗng
+        if os.path.getsize(blob_path) > 0:
+            self.data = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return self.data[lo:hi].tobytes().decode("utf-8")
+
+
+class ChunkIdView:
+    """
+    Id-only view of a chunk store: row -> chunk_id / aid, never touches texts.bin
+
+    Dùng thay cho list chunk_ids của search.py (``chunk_ids[i]``, ``len(chunk_ids)``).
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self._ids = _Blob(os.path.join(store_dir, "ids.bin"), os.path.join(store_dir, "id_offsets.npy"))
+        numeric = self.manifest["aid_dtype"] == "int64"
+        self.aids = np.load(
+            os.path.join(store_dir, "aids.npy"),
+            mmap_mode="r" if numeric else None,
+            allow_pickle=not numeric
+        )
+        self._extras = None
+        if self.manifest.get("extra_fields"):
+            self._extras = _Blob(os.path.join(store_dir, "extras.bin"), os.path.join(store_dir, "extra_offsets.npy"))
+        self._row_by_id = None
+        self._aid_order = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        return self._ids[row]
+
+    def __iter__(self):
+        return (self._ids[i] for i in range(len(self)))
+
+    def chunk_id(self, row: int) -> str:
+        return self._ids[row]
+
+    def aid(self, row: int):
+        a = self.aids[row]
+        return int(a) if self.manifest["aid_dtype"] == "int64" else a
+
+    def extra(self, row: int) -> dict:
+        """Fields of the chunk other than aid / chunk_id / content_Article (e.g. law_id)."""
+        if self._extras is None:
+            return {}
+        data = self._extras[row]
+        return json.loads(data) if data else {}
+
+    def row_of(self, chunk_id: str) -> int:
+        """Row of a chunk id (KeyError if unknown); the lookup table is built on first use."""
+        if self._row_by_id is None:
+            self._row_by_id = {cid: i for i, cid in enumerate(self)}
+        return self._row_by_id[str(chunk_id)]
+
+    def rows_of_aid(self, aid):
+        """Rows of every chunk of one article, in row order."""
+        if self._aid_order is None:
+            order = np.argsort(self.aids, kind="stable")
+            self._aid_order = (order, np.asarray(self.aids)[order])
+        order, sorted_aids = self._aid_order
+        lo = np.searchsorted(sorted_aids, aid, side="left")
+        hi = np.searchsorted(sorted_aids, aid, side="right")
+        return sorted(order[lo:hi].tolist())
+
+    def meta(self):
+        """List of (aid, chunk_id) like corpus_meta.pkl."""
+        return [(self.aid(i), self._ids[i]) for i in range(len(self))]
+
+
+class ChunkStore(ChunkIdView):
+    """
+    Chunk store with texts: random access by FAISS row, chunk_id or aid
+
+    Example:
+        store = ChunkStore("data/processed/chunked/chunk_store")
+        store.text(row)
+        store.get_by_id("123_0")  # {"aid", "chunk_id", "content_Article", "law_id"}
+        store.get_by_aid(123)     # mọi chunk của điều 123
+    """
+
+    def __init__(self, store_dir: str):
+        super().__init__(store_dir)
+        self._texts = _Blob(os.path.join(store_dir, "texts.bin"), os.path.join(store_dir, "text_offsets.npy"))
+
+    def text(self, row: int) -> str:
+        return self._texts[row]
+
+    def texts(self, rows):
+        return [self._texts[r] for r in rows]
+
+    def get(self, row: int) -> dict:
+        """Chunk at a row, in the chunk_corpus.json format."""
+        item = {"aid": self.aid(row), "chunk_id": self._ids[row], "content_Article": self._texts[row]}
+        item.update(self.extra(row))
+        return item
+
+    def get_by_id(self, chunk_id: str) -> dict:
+        return self.get(self.row_of(chunk_id))
+
+    def get_by_aid(self, aid):
+        return [self.get(r) for r in self.rows_of_aid(aid)]
+
+
+def is_chunk_store(path: str) -> bool:
+    return bool(path) and os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an offset-indexed chunk store from chunk_corpus.json"
+    )
+    parser.add_argument(
+        "--path_chunk",
+        type=str,
+        default="./data/processed/chunked/chunk_corpus.json",
+        help="Path to chunk corpus JSON file"
+    )
+    parser.add_argument(
+        "--out_dir",
+        type=str,
+        default="./data/processed/chunked/chunk_store",
+        help="Output directory for the chunk store"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check every chunk of the store against the JSON file"
+    )
+
+    args = parser.parse_args()
+
+    with open(args.path_chunk, "r", encoding="utf-8") as f:
+        chunk_data = json.load(f)
+    build_chunk_store(chunk_data, args.out_dir)
+
+    if args.verify:
+        store = ChunkStore(args.out_dir)
+        mismatches = sum(store.get(i) != item for i, item in enumerate(chunk_data))
+        print(f"Verify: {len(chunk_data) - mismatches}/{len(chunk_data)} chunks khớp")
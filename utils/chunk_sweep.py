@@ -0,0 +1,431 @@
+"""
+Chunk size sweep: build and evaluate several chunk configurations in one job
+
+README khuyên thử chunk 256 / 512 / 1024 từ, nhưng mỗi lần thử phải chạy lại
+chunk.py, create_model_bm25.py, encode toàn bộ corpus và create_corpus_meta.py.
+Script này build mọi cấu hình trong một lần chạy và dùng chung phần việc nặng:
+
+    - chunk là cả điều luật dùng token của điều luật (word_tokenize một lần)
+    - --approx_tokens: word_tokenize mỗi điều luật một lần cho mọi chunk, phần
+      giữa chunk lấy token của điều luật theo vị trí ký tự, dòng đầu / dòng
+      cuối bị biên chunk cắt ngang được tokenize lại riêng. Đây là xấp xỉ: CRF
+      của underthesea nhìn ngữ cảnh nên vài từ ghép có thể tách khác khi
+      tokenize riêng chunk; mỗi cấu hình kiểm tra --verify_tokens chunk ngẫu
+      nhiên với bm25_tokenizer(chunk) và ghi số chunk lệch vào report.
+      Mặc định mọi chunk được tokenize như create_model_bm25.py
+    - chunk có text giống hệt nhau giữa các cấu hình (điều luật ngắn hơn
+      chunk_size nhỏ nhất luôn là một chunk) chỉ tokenize / encode một lần
+    - câu hỏi chỉ tokenize / encode một lần cho mọi cấu hình
+
+Mỗi cấu hình được ghi vào <out_dir>/<name>/ với cùng định dạng như pipeline
+gốc (chunk_corpus.json, bm25_model.pkl, bge.bin, corpus_meta.pkl) cùng kết quả
+BM25 / dense trên tập test, rồi được đánh giá bằng macro F2 của evaluate.py:
+BM25, dense và product_rank fusion (như ensemble_with_bm25.py).
+
+Example:
+    python utils/chunk_sweep.py --path_corpus data/processed/corpus.json \
+        --path_test data/processed/test.json --configs 256:32 512:50 1024:100 \
+        --path_model BAAI/bge-m3 --out_dir data/chunk_sweep
+    # Chỉ BM25 (không encode)
+    python utils/chunk_sweep.py ... --configs 256:32 400:50 512:50
+    # Encoder giả (benchmark/stub_encoder.py), để thử nhanh pipeline
+    python utils/chunk_sweep.py ... --stub
+"""
+import argparse
+import bisect
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.chunk import build_text_splitter, chunk_corpus
+from utils.ensemble_with_bm25 import fuse_product_rank
+from utils.evaluate import compute_macro_f2, load_ground_truth, predictions_from_results
+
+
+def parse_config(spec: str):
+    """'512:50' -> (512, 50); overlap mặc định 0 nếu chỉ có chunk_size."""
+    size, _, overlap = spec.partition(":")
+    size, overlap = int(size), int(overlap or 0)
+    if size <= 0 or not 0 <= overlap < size:
+        raise ValueError(f"invalid chunk config {spec!r}: need chunk_size > overlap >= 0")
+    return size, overlap
+
+
+def config_name(size: int, overlap: int) -> str:
+    return f"c{size}_o{overlap}"
+
+
+def _filter_tokens(raw_tokens):
+    # Cùng chuỗi xử lý với bm25_tokenizer của create_model_bm25.py sau word_tokenize
+    from retrieve.sparse.create_model_bm25 import lower_case, remove_punctuation, remove_stopword
+
+    tokens = list(map(lower_case, raw_tokens))
+    tokens = list(filter(remove_punctuation, tokens))
+    return list(filter(remove_stopword, tokens))
+
+
+def token_spans(text: str, raw_tokens):
+    """
+    Character span of every word_tokenize token inside text
+
+    Returns:
+        starts, ends: Lists of offsets, or None when a token cannot be located
+    """
+    starts, ends = [], []
+    pos = 0
+    for tok in raw_tokens:
+        i = text.find(tok, pos)
+        if i < 0:
+            # Từ ghép có thể nằm vắt qua xuống dòng / nhiều khoảng trắng
+            m = re.compile(r"\s+".join(map(re.escape, tok.split()))).search(text, pos)
+            if m is None:
+                return None
+            i, j = m.span()
+        else:
+            j = i + len(tok)
+        starts.append(i)
+        ends.append(j)
+        pos = j
+    return starts, ends
+
+
+class SharedTokenizer:
+    """
+    BM25 tokens of chunks, sharing word_tokenize calls across chunk configurations
+
+    Chunk giống hệt nhau (kể cả giữa các cấu hình) chỉ tokenize một lần; chunk
+    là cả điều luật dùng word_tokenize của điều luật. Còn lại mỗi chunk được
+    tokenize như create_model_bm25.py.
+
+    approx=True: chunk còn lại lấy token của điều luật cho phần giữa chunk (từ
+    dòng đầu tiên tới dòng cuối cùng nằm trọn trong chunk); dòng đầu và dòng
+    cuối, bị biên chunk cắt ngang, được tokenize lại riêng. Chunk không có dòng
+    nào nằm trọn thì vẫn tokenize cả chunk. Token có thể lệch nhẹ so với
+    tokenize riêng chunk (ngữ cảnh CRF của underthesea).
+    """
+
+    def __init__(self, approx: bool = False):
+        self.approx = approx
+        self.articles = {}   # aid -> (raw_tokens, starts, ends) hoặc None
+        self.by_text = {}    # text chunk -> tokens đã lọc
+        self.article_calls = 0
+        self.chunk_calls = 0
+        self.edge_calls = 0
+        self.reused = 0
+
+    def _article(self, aid, text):
+        if aid not in self.articles:
+            from underthesea import word_tokenize
+
+            raw = word_tokenize(text)
+            self.article_calls += 1
+            spans = token_spans(text, raw)
+            self.articles[aid] = None if spans is None else (raw, spans[0], spans[1])
+        return self.articles[aid]
+
+    def tokens(self, aid, article_text: str, chunk_text: str, start: int):
+        """Filtered BM25 tokens of one chunk starting at `start` in the article (-1 = unknown)."""
+        from retrieve.sparse.create_model_bm25 import bm25_tokenizer
+
+        cached = self.by_text.get(chunk_text)
+        if cached is not None:
+            self.reused += 1
+            return cached
+        head, tail = chunk_text.find("\n"), chunk_text.rfind("\n")
+        whole = start == 0 and len(chunk_text) == len(article_text)
+        # Chunk là cả điều luật: token của điều luật chính là token của chunk
+        sliced = self.approx and start >= 0 and head < tail
+        art = self._article(aid, article_text) if whole or sliced else None
+        if art is None:
+            self.chunk_calls += 1
+            tokens = bm25_tokenizer(chunk_text)
+        elif whole:
+            tokens = _filter_tokens(art[0])
+        else:
+            raw, starts, ends = art
+            # Token nằm trọn giữa dòng đầu và dòng cuối của chunk
+            lo = bisect.bisect_left(starts, start + head)
+            hi = bisect.bisect_right(ends, start + tail)
+            self.edge_calls += 2
+            tokens = bm25_tokenizer(chunk_text[:head]) + _filter_tokens(raw[lo:hi]) + bm25_tokenizer(chunk_text[tail:])
+        self.by_text[chunk_text] = tokens
+        return tokens
+
+
+def chunk_starts(corpus, chunks):
+    """Offset of every chunk inside its article (-1 if not found), chunks in chunk_corpus order."""
+    text_by_aid = {item["aid"]: item["content_Article"] for item in corpus}
+    starts = []
+    prev_aid, pos = None, 0
+    for c in chunks:
+        if c["aid"] != prev_aid:
+            prev_aid, pos = c["aid"], 0
+        i = text_by_aid[c["aid"]].find(c["content_Article"], pos)
+        starts.append(i)
+        if i >= 0:
+            pos = i + 1
+    return starts
+
+
+class SharedEmbeddings:
+    """Corpus embeddings keyed by chunk text: identical chunks across configurations are encoded once."""
+
+    def __init__(self, model, batch_size: int = 32):
+        self.model = model
+        self.batch_size = batch_size
+        self.rows = {}
+        self.blocks = []
+        self.encoded = 0
+        self.reused = 0
+
+    def matrix(self, texts):
+        """Normalized embeddings of texts (float32, one row per text), encoding only unseen texts."""
+        new = list(dict.fromkeys(t for t in texts if t not in self.rows))
+        self.reused += len(texts) - len(new)
+        if new:
+            emb = self.model.encode(new, batch_size=self.batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True)
+            base = sum(len(b) for b in self.blocks)
+            self.blocks.append(np.asarray(emb, dtype=np.float32))
+            for i, t in enumerate(new):
+                self.rows[t] = base + i
+            self.encoded += len(new)
+        all_emb = np.concatenate(self.blocks) if len(self.blocks) > 1 else self.blocks[0]
+        self.blocks = [all_emb]
+        return np.ascontiguousarray(all_emb[[self.rows[t] for t in texts]])
+
+
+def bm25_search(bm25_model, chunk_ids, query_tokens, queries, top_n: int):
+    """BM25 results (search.py schema) for pre-tokenized queries."""
+    from retrieve.sparse.shard_bm25 import topk_indices
+
+    results = []
+    for q, tokens in zip(queries, query_tokens):
+        idx, vals = topk_indices(np.asarray(bm25_model.get_scores(tokens)), top_n)
+        results.append({
+            "qid": q["qid"],
+            "question": q["question"],
+            "top_chunks": [{"chunk_id": chunk_ids[i], "score": float(v)} for i, v in zip(idx, vals)],
+        })
+    return results
+
+
+def dense_search(index, chunk_ids, query_emb, queries, topk: int):
+    """Dense results (predict_bge.py schema) for pre-encoded queries."""
+    D, I = index.search(query_emb, min(topk, index.ntotal))
+    return [
+        {"qid": q["qid"], "top_chunks": [{"chunk_id": chunk_ids[i], "score": float(s)}
+                                         for s, i in zip(d, rows) if i >= 0]}
+        for q, d, rows in zip(queries, D, I)
+    ]
+
+
+def fuse_runs(bm25_results, dense_results, K: int = 1000):
+    """product_rank fusion per query, same as ensemble_pair_product_rank."""
+    dense_by_qid = {r["qid"]: r for r in dense_results}
+    out = []
+    for rec in bm25_results:
+        dense = dense_by_qid[rec["qid"]]["top_chunks"]
+        topk = fuse_product_rank(
+            {c["chunk_id"]: c["score"] for c in dense},
+            {c["chunk_id"]: c["score"] for c in rec["top_chunks"]},
+            {c["chunk_id"]: i for i, c in enumerate(dense, start=1)},
+            1.0, 1.0, K,
+        )
+        out.append({"qid": rec["qid"], "top_chunks": [{"chunk_id": cid, "score": sc} for cid, sc in topk]})
+    return out
+
+
+def _dump_json(obj, path, indent=2):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=indent)
+
+
+def run_sweep(corpus, queries, gt, configs, out_dir: str, model=None, top_n: int = 1000, dense_topk: int = 100,
+              eval_topk: int = 3, batch_size: int = 32, approx_tokens: bool = False, verify_tokens: int = 200,
+              seed: int = 42):
+    """
+    Build and evaluate every (chunk_size, overlap) configuration
+
+    Args:
+        corpus: Articles as in corpus.json
+        queries: Questions with qid / question
+        gt: load_ground_truth of the questions
+        configs: List of (chunk_size, overlap)
+        out_dir: Output directory, one sub-directory per configuration
+        model: SentenceTransformer-compatible encoder, or None for BM25 only
+        approx_tokens: Slice chunk tokens out of the article tokens (see SharedTokenizer)
+        verify_tokens: approx_tokens only: chunks per configuration compared with bm25_tokenizer(chunk)
+
+    Returns:
+        report: dict with sharing statistics and one row per configuration
+    """
+    from rank_bm25 import BM25Okapi
+    from retrieve.sparse.search import bm25_tokenizer
+
+    import random
+
+    tokenizer = SharedTokenizer(approx=approx_tokens)
+    rng = random.Random(seed)
+    embeddings = SharedEmbeddings(model, batch_size) if model is not None else None
+    query_tokens = [bm25_tokenizer(q["question"]) for q in queries]
+    query_emb = None
+    if model is not None:
+        query_emb = np.ascontiguousarray(model.encode(
+            [q["question"] for q in queries], batch_size=batch_size, normalize_embeddings=True,
+            convert_to_numpy=True), dtype=np.float32)
+    text_by_aid = {item["aid"]: item["content_Article"] for item in corpus}
+
+    rows = []
+    for size, overlap in configs:
+        name = config_name(size, overlap)
+        cfg_dir = os.path.join(out_dir, name)
+        os.makedirs(cfg_dir, exist_ok=True)
+        row = {"name": name, "chunk_size": size, "chunk_overlap": overlap}
+        t0 = time.perf_counter()
+
+        chunks = chunk_corpus(corpus, build_text_splitter(size, overlap))
+        _dump_json(chunks, os.path.join(cfg_dir, "chunk_corpus.json"), indent=4)
+        chunk_ids = [c["chunk_id"] for c in chunks]
+        texts = [c["content_Article"] for c in chunks]
+        row["chunks"] = len(chunks)
+
+        t1 = time.perf_counter()
+        tokenized = [tokenizer.tokens(c["aid"], text_by_aid[c["aid"]], c["content_Article"], s)
+                     for c, s in zip(chunks, chunk_starts(corpus, chunks))]
+        if approx_tokens and verify_tokens > 0:
+            sample = rng.sample(range(len(chunks)), min(verify_tokens, len(chunks)))
+            row["token_check"] = len(sample)
+            row["token_mismatch"] = sum(tokenized[i] != bm25_tokenizer(texts[i]) for i in sample)
+        bm25_model = BM25Okapi(tokenized)
+        with open(os.path.join(cfg_dir, "bm25_model.pkl"), "wb") as f:
+            pickle.dump(bm25_model, f)
+        row["bm25_build_s"] = time.perf_counter() - t1
+
+        bm25_results = bm25_search(bm25_model, chunk_ids, query_tokens, queries, top_n)
+        _dump_json(bm25_results, os.path.join(cfg_dir, "bm25_test.json"))
+        row["f2_bm25"] = compute_macro_f2(gt, predictions_from_results(bm25_results, eval_topk))
+
+        if embeddings is not None:
+            import faiss
+
+            t1 = time.perf_counter()
+            before = embeddings.encoded
+            emb = embeddings.matrix(texts)
+            row["encoded"] = embeddings.encoded - before
+            index = faiss.IndexFlatIP(emb.shape[1])
+            index.add(emb)
+            faiss.write_index(index, os.path.join(cfg_dir, "bge.bin"))
+            with open(os.path.join(cfg_dir, "corpus_meta.pkl"), "wb") as f:
+                pickle.dump([(c["aid"], c["chunk_id"]) for c in chunks], f, protocol=pickle.HIGHEST_PROTOCOL)
+            row["dense_build_s"] = time.perf_counter() - t1
+
+            dense_results = dense_search(index, chunk_ids, query_emb, queries, dense_topk)
+            _dump_json(dense_results, os.path.join(cfg_dir, "bge_test.json"))
+            row["f2_dense"] = compute_macro_f2(gt, predictions_from_results(dense_results, eval_topk))
+            row["f2_fused"] = compute_macro_f2(
+                gt, predictions_from_results(fuse_runs(bm25_results, dense_results), eval_topk))
+
+        row["total_s"] = time.perf_counter() - t0
+        rows.append(row)
+        print(f"  {name}: {row['chunks']} chunks, F2 BM25 {row['f2_bm25']:.4f}"
+              + (f", dense {row['f2_dense']:.4f}, fused {row['f2_fused']:.4f}" if "f2_dense" in row else ""))
+
+    total_chunks = sum(r["chunks"] for r in rows)
+    return {
+        "queries": len(queries),
+        "articles": len(corpus),
+        "sharing": {
+            "chunks_total": total_chunks,
+            "article_tokenize_calls": tokenizer.article_calls,
+            "chunk_tokenize_calls": tokenizer.chunk_calls,
+            "edge_tokenize_calls": tokenizer.edge_calls,
+            "approx_tokens": approx_tokens,
+            "token_check": sum(r.get("token_check", 0) for r in rows),
+            "token_mismatch": sum(r.get("token_mismatch", 0) for r in rows),
+            "chunk_tokens_reused": tokenizer.reused,
+            "chunks_encoded": embeddings.encoded if embeddings is not None else 0,
+            "chunk_embeddings_reused": embeddings.reused if embeddings is not None else 0,
+        },
+        "rows": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and evaluate several chunk configurations in one job")
+    parser.add_argument("--path_corpus", type=str, default="./data/processed/corpus.json", help="Article corpus JSON")
+    parser.add_argument("--path_test", type=str, default="./data/processed/test.json",
+                        help="Questions with relevant_laws")
+    parser.add_argument("--configs", type=str, nargs="+", default=["256:32", "512:50", "1024:100"],
+                        help="chunk_size:chunk_overlap (in words) per configuration")
+    parser.add_argument("--out_dir", type=str, default="./data/chunk_sweep", help="Output directory")
+    parser.add_argument("--path_model", type=str, default=None, help="BGE model for the dense index (omit: BM25 only)")
+    parser.add_argument("--stub", action="store_true", help="Use the hashing stub encoder instead of --path_model")
+    parser.add_argument("--dim", type=int, default=1024, help="--stub: encoder dimension")
+    parser.add_argument("--batch_size", type=int, default=32, help="Encode batch size")
+    parser.add_argument("--top_n", type=int, default=1000, help="BM25 results per question")
+    parser.add_argument("--dense_topk", type=int, default=100, help="Dense results per question")
+    parser.add_argument("--eval_topk", type=int, default=3, help="Top-k used for F2 (as evaluate.py)")
+    parser.add_argument("--approx_tokens", action="store_true",
+                        help="Tokenize each article once and slice chunk tokens from it (approximate)")
+    parser.add_argument("--verify_tokens", type=int, default=200,
+                        help="--approx_tokens: chunks per configuration checked against bm25_tokenizer(chunk)")
+    args = parser.parse_args()
+
+    configs = [parse_config(c) for c in args.configs]
+    with open(args.path_corpus, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    with open(args.path_test, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    gt = load_ground_truth(Path(args.path_test))
+
+    model = None
+    if args.stub:
+        from benchmark.stub_encoder import HashingEncoder
+        model = HashingEncoder(dim=args.dim)
+    elif args.path_model:
+        from retrieve.dense.predict_bge import load_model
+        model, _ = load_model(args.path_model)
+
+    print(f"Sweeping {len(configs)} chunk configurations over {len(corpus)} articles...")
+    t0 = time.perf_counter()
+    report = run_sweep(corpus, queries, gt, configs, args.out_dir, model=model, top_n=args.top_n,
+                       dense_topk=args.dense_topk, eval_topk=args.eval_topk, batch_size=args.batch_size,
+                       approx_tokens=args.approx_tokens, verify_tokens=args.verify_tokens)
+    report["total_s"] = time.perf_counter() - t0
+
+    sharing = report["sharing"]
+    print(f"\nTokenize: {sharing['article_tokenize_calls']} articles + {sharing['chunk_tokenize_calls']} chunks "
+          f"+ {sharing['edge_tokenize_calls']} chunk edges for {sharing['chunks_total']} chunks "
+          f"({sharing['chunk_tokens_reused']} reused)")
+    if sharing["token_check"]:
+        print(f"Sliced tokens differ from bm25_tokenizer(chunk) for {sharing['token_mismatch']}/"
+              f"{sharing['token_check']} sampled chunks (--approx_tokens)")
+    if model is not None:
+        print(f"Encode: {sharing['chunks_encoded']} chunks ({sharing['chunk_embeddings_reused']} reused)")
+    has_dense = model is not None
+    header = f"{'config':<14} {'chunks':>8} {'tok diff':>9} {'F2 bm25':>8}"
+    print(header + (f" {'F2 dense':>9} {'F2 fused':>9}" if has_dense else ""))
+    for r in report["rows"]:
+        diff = f"{r['token_mismatch']}/{r['token_check']}" if "token_check" in r else "-"
+        line = f"{r['name']:<14} {r['chunks']:>8} {diff:>9} {r['f2_bm25']:>8.4f}"
+        if has_dense:
+            line += f" {r['f2_dense']:>9.4f} {r['f2_fused']:>9.4f}"
+        print(line)
+
+    _dump_json(report, os.path.join(args.out_dir, "report.json"))
+    print(f"✅ Đã lưu báo cáo vào {os.path.join(args.out_dir, 'report.json')} ({report['total_s']:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ for law in data:
     for article in law["content"]:
         filtered_articles.append({
             "aid": article["aid"],
+            "law_id": law["law_id"],  # giữ nhóm theo văn bản luật (dùng cho routing)
             "content_Article": article["content_Article"]
         })
 
@@ -0,0 +1,299 @@
+"""
+Near-duplicate chunk detection (MinHash + LSH) and deduplicated indexing
+
+Các điều khoản lặp lại giữa nhiều văn bản (hiệu lực thi hành, trách nhiệm thi
+hành, ...) sinh ra các chunk gần như giống hệt nhau; mỗi bản sao đều được
+tokenize, embed, index và chấm điểm riêng. Script này:
+
+    1) Tạo MinHash signature từ tập shingle k từ của mỗi chunk
+    2) LSH banding để tìm cặp ứng viên, kiểm tra lại bằng Jaccard chính xác
+       trên tập shingle, gom cụm bằng union-find
+    3) Ghi chunk_corpus.json chỉ gồm chunk đại diện của mỗi cụm (chunk có row
+       nhỏ nhất, giữ nguyên chunk_id) cùng fanout.json:
+       {chunk_id đại diện: [chunk_id mọi thành viên, đại diện đứng đầu]}
+    4) Báo cáo số chunk / từ / posting tiết kiệm (ước lượng kích thước index
+       và thời gian encode, vốn tỉ lệ với số token)
+
+chunk_corpus.json mới dùng được ngay với create_model_bm25.py,
+create_corpus_meta.py, chunk_store.py. Kết quả search trên index đã dedup
+được ``expand`` lại theo fanout.json để mỗi chunk đại diện kéo theo mọi chunk
+thành viên (cùng điểm), nên kết quả vẫn liệt kê đủ các điều luật (aid).
+
+Lưu ý: cửa sổ overlap 50 từ giữa hai chunk liên tiếp chỉ cho Jaccard rất
+thấp, nên không bị gộp ở ngưỡng mặc định; phần tiết kiệm đến từ các chunk
+lặp lại gần như nguyên văn. IDF của BM25 tính trên corpus đã dedup nên điểm
+số thay đổi nhẹ so với index đầy đủ.
+
+Example:
+    python utils/dedup_chunks.py build --path_chunk data/processed/chunked/chunk_corpus.json \
+        --out_dir data/processed/chunked/dedup --threshold 0.8
+    python utils/dedup_chunks.py expand --results results/test/bm25_dedup_test.json \
+        --fanout data/processed/chunked/dedup/fanout.json --output results/test/bm25_test.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+MASK_32 = np.uint64(0xFFFFFFFF)
+
+
+def shingles(text: str, k: int = 3):
+    """Set of k-word shingles (lowercased, whitespace tokens); short texts give one shingle."""
+    words = text.lower().split()
+    if len(words) < k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+class MinHasher:
+    """
+    MinHash with multiply-shift hash functions on 32-bit shingle hashes
+
+    Args:
+        num_perm: Signature length
+        seed: Random seed of the hash functions
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set) -> np.ndarray:
+        if not shingle_set:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+                        dtype=np.uint64, count=len(shingle_set))
+        # (a * x + b) mod 2^64, lấy 32 bit cao; phép nhân uint64 của numpy tự wrap
+        h = (self.a[:, None] * x[None, :] + self.b[:, None]) >> np.uint64(32)
+        return (h & MASK_32).min(axis=1).astype(np.uint32)
+
+
+def lsh_candidates(signatures: np.ndarray, bands: int):
+    """
+    Candidate pairs (i < j) sharing at least one LSH band, each bucket paired to its first row
+
+    Args:
+        signatures: (n, num_perm) uint32 MinHash signatures
+        bands: Number of bands (num_perm must be divisible by bands)
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+    rows = num_perm // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i in range(n):
+            buckets[block[i].tobytes()].append(i)
+        # Ghép mỗi thành viên với phần tử đầu của bucket (không ghép mọi cặp): cụm
+        # boilerplate hàng nghìn bản sao vẫn tuyến tính, các band khác bù cho cặp bị bỏ
+        for members in buckets.values():
+            for other in members[1:]:
+                pairs.add((members[0], other))
+    return pairs
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_duplicate_clusters(chunk_data, threshold: float = 0.8, num_perm: int = 128, bands: int = 16,
+                            k: int = 3, seed: int = 42):
+    """
+    Group near-duplicate chunks
+
+    Args:
+        chunk_data: List of {"aid", "chunk_id", "content_Article"}
+        threshold: Minimum exact shingle Jaccard for a duplicate pair
+        num_perm: MinHash signature length
+        bands: LSH bands (rows per band = num_perm / bands)
+        k: Shingle size in words
+        seed: Hash seed
+
+    Returns:
+        clusters: List of row lists (sorted, representative = first), only clusters of size > 1
+        stats: Candidate / verified pair counts
+    """
+    hasher = MinHasher(num_perm, seed)
+    sets = [shingles(c["content_Article"], k) for c in chunk_data]
+    signatures = np.stack([hasher.signature(s) for s in sets]) if sets else np.zeros((0, num_perm), np.uint32)
+
+    candidates = lsh_candidates(signatures, bands)
+    parent = list(range(len(chunk_data)))
+    verified = 0
+    for i, j in candidates:
+        if jaccard(sets[i], sets[j]) >= threshold:
+            verified += 1
+            ri, rj = _find(parent, i), _find(parent, j)
+            if ri != rj:
+                # Gốc luôn là row nhỏ nhất của cụm
+                parent[max(ri, rj)] = min(ri, rj)
+
+    groups = defaultdict(list)
+    for i in range(len(chunk_data)):
+        groups[_find(parent, i)].append(i)
+    clusters = sorted(rows for rows in groups.values() if len(rows) > 1)
+    return clusters, {"candidate_pairs": len(candidates), "verified_pairs": verified}
+
+
+def deduplicate(chunk_data, clusters):
+    """
+    Returns:
+        dedup_data: Representatives and singletons, in original row order
+        fanout: {representative chunk_id: [member chunk_ids, representative first]}
+    """
+    dropped = set()
+    fanout = {}
+    for rows in clusters:
+        rep = rows[0]
+        fanout[chunk_data[rep]["chunk_id"]] = [chunk_data[r]["chunk_id"] for r in rows]
+        dropped.update(rows[1:])
+    dedup_data = [c for i, c in enumerate(chunk_data) if i not in dropped]
+    return dedup_data, fanout
+
+
+def corpus_stats(chunk_data):
+    """Chunks, words (encode cost proxy), distinct-word postings (index size proxy) and text bytes."""
+    words = postings = n_bytes = 0
+    for c in chunk_data:
+        tokens = c["content_Article"].lower().split()
+        words += len(tokens)
+        postings += len(set(tokens))
+        n_bytes += len(c["content_Article"].encode("utf-8"))
+    return {"chunks": len(chunk_data), "words": words, "postings": postings, "text_bytes": n_bytes}
+
+
+def expand_results(results, fanout):
+    """
+    Re-insert cluster members after their representative, with the same score
+
+    Args:
+        results: [{"qid", "top_chunks": [{"chunk_id", "score"}]}] from the deduplicated index
+        fanout: fanout.json mapping
+
+    Returns:
+        expanded: Same schema, every member chunk listed
+    """
+    expanded = []
+    for rec in results:
+        top_chunks = []
+        for c in rec.get("top_chunks", []):
+            members = fanout.get(c["chunk_id"])
+            if members is None:
+                top_chunks.append(c)
+            else:
+                top_chunks.extend({**c, "chunk_id": m} for m in members)
+        expanded.append({**rec, "top_chunks": top_chunks})
+    return expanded
+
+
+def measure_bm25(chunk_data):
+    """Tokenize + build time and pickled size of a BM25 model over chunk_data."""
+    import pickle
+    from retrieve.sparse.create_model_bm25 import build_bm25_model
+
+    t0 = time.perf_counter()
+    model = build_bm25_model(chunk_data, show_progress=False)
+    return {"bm25_build_s": time.perf_counter() - t0, "bm25_pickle_mb": len(pickle.dumps(model)) / 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate chunk detection and deduplicated indexing")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Write a deduplicated chunk corpus + fan-out map")
+    p_build.add_argument("--path_chunk", type=str, default="./data/processed/chunked/chunk_corpus.json",
+                         help="Path to chunk corpus JSON file")
+    p_build.add_argument("--out_dir", type=str, default="./data/processed/chunked/dedup",
+                         help="Output directory (chunk_corpus.json, fanout.json, report.json)")
+    p_build.add_argument("--threshold", type=float, default=0.8, help="Shingle Jaccard for duplicates")
+    p_build.add_argument("--num_perm", type=int, default=128, help="MinHash signature length")
+    p_build.add_argument("--bands", type=int, default=16, help="LSH bands")
+    p_build.add_argument("--shingle", type=int, default=3, help="Shingle size in words")
+    p_build.add_argument("--seed", type=int, default=42, help="Hash seed")
+    p_build.add_argument("--measure_bm25", action="store_true",
+                         help="Also build BM25 on both corpora and report build time / size")
+
+    p_expand = sub.add_parser("expand", help="Expand results of the deduplicated index with the fan-out map")
+    p_expand.add_argument("--results", type=str, required=True, help="Results JSON (search.py / predict_bge.py)")
+    p_expand.add_argument("--fanout", type=str, required=True, help="fanout.json written by build")
+    p_expand.add_argument("--output", type=str, required=True, help="Expanded results JSON")
+
+    args = parser.parse_args()
+
+    if args.command == "expand":
+        with open(args.results, "r", encoding="utf-8") as f:
+            results = json.load(f)
+        with open(args.fanout, "r", encoding="utf-8") as f:
+            fanout = json.load(f)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(expand_results(results, fanout), f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã lưu kết quả vào {args.output}")
+        return
+
+    with open(args.path_chunk, "r", encoding="utf-8") as f:
+        chunk_data = json.load(f)
+
+    t0 = time.perf_counter()
+    clusters, stats = find_duplicate_clusters(chunk_data, args.threshold, args.num_perm, args.bands,
+                                              args.shingle, args.seed)
+    detect_s = time.perf_counter() - t0
+    dedup_data, fanout = deduplicate(chunk_data, clusters)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, "chunk_corpus.json"), "w", encoding="utf-8") as f:
+        json.dump(dedup_data, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(args.out_dir, "fanout.json"), "w", encoding="utf-8") as f:
+        json.dump(fanout, f, ensure_ascii=False, indent=2)
+
+    before, after = corpus_stats(chunk_data), corpus_stats(dedup_data)
+    if args.measure_bm25:
+        before.update(measure_bm25(chunk_data))
+        after.update(measure_bm25(dedup_data))
+    report = {
+        "settings": {"threshold": args.threshold, "num_perm": args.num_perm, "bands": args.bands,
+                     "shingle": args.shingle},
+        "detect_s": detect_s,
+        "clusters": len(clusters),
+        "largest_cluster": max((len(c) for c in clusters), default=1),
+        **stats,
+        "before": before,
+        "after": after,
+        "saved": {key: 1 - after[key] / before[key] if before[key] else 0.0 for key in before},
+    }
+    with open(os.path.join(args.out_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Clusters: {len(clusters)} (largest {report['largest_cluster']}), "
+          f"candidate pairs {stats['candidate_pairs']}, verified {stats['verified_pairs']}, {detect_s:.1f}s")
+    print(f"{'':<16} {'before':>12} {'after':>12} {'saved':>8}")
+    for key in before:
+        print(f"{key:<16} {before[key]:>12.6g} {after[key]:>12.6g} {report['saved'][key]:>8.1%}")
+    print(f"✅ Đã lưu {len(dedup_data)} chunks vào {args.out_dir} "
+          f"(words saved ~ encode time saved: {report['saved']['words']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
 import json
 import os
+import sys
 from collections import defaultdict
 
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import finish_tracing, get_tracer, init_tracing
+
 def ensemble_topk_global_minmax(file_paths, weights=None, K=10, output_path='ensemble_results.json'):
+    tracer = get_tracer()
     # 1) Compute global min/max per file
     stats = {}
     for p in file_paths:
         all_scores = []
-        with open(p, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            for rec in data:
-                all_scores.extend([c['score'] for c in rec.get('top_chunks', [])])
+        with tracer.stage("load_runs"):
+            with open(p, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        for rec in data:
+            all_scores.extend([c['score'] for c in rec.get('top_chunks', [])])
         mn, mx = (min(all_scores), max(all_scores)) if all_scores else (0.0, 1.0)
         stats[p] = (mn, mx)
 
@@ -22,8 +31,11 @@ def ensemble_topk_global_minmax(file_paths, weights=None, K=10, output_path='ens
     for p in file_paths:
         mn, mx = stats[p]
         w = weights.get(p, 1.0)
-        with open(p, 'r', encoding='utf-8') as f:
-            for rec in json.load(f):
+        with tracer.stage("load_runs"):
+            with open(p, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        with tracer.stage("fuse"):
+            for rec in data:
                 qid = rec['qid']
                 for c in rec.get('top_chunks', []):
                     raw = c['score']
@@ -33,32 +45,36 @@ def ensemble_topk_global_minmax(file_paths, weights=None, K=10, output_path='ens
     # 3) Take TOP K and prepare output
     output_list = []
     topk_results = {}
-    for qid, scores in agg.items():
-        topk = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:K]
-        topk_results[qid] = topk
-        output_list.append({
-            "qid": qid,
-            "top_chunks": [
-                {"chunk_id": cid, "score": sc}
-                for cid, sc in topk
-            ]
-        })
+    with tracer.stage("rank"):
+        for qid, scores in agg.items():
+            tracer.count("candidates", len(scores))
+            topk = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:K]
+            topk_results[qid] = topk
+            output_list.append({
+                "qid": qid,
+                "top_chunks": [
+                    {"chunk_id": cid, "score": sc}
+                    for cid, sc in topk
+                ]
+            })
 
     # 4) Write JSON file
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(output_list, out_f, ensure_ascii=False, indent=2)
+    with tracer.stage("serialize"):
+        with open(output_path, 'w', encoding='utf-8') as out_f:
+            json.dump(output_list, out_f, ensure_ascii=False, indent=2)
 
     return topk_results
 
 def _load_score_map(file_path: str) -> dict:
     """Load a results JSON file into { qid: { chunk_id: score } } map."""
     score_map = defaultdict(dict)
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        for rec in data:
-            qid = rec['qid']
-            for c in rec.get('top_chunks', []):
-                score_map[qid][c['chunk_id']] = c['score']
+    with get_tracer().stage("load_runs"):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            for rec in data:
+                qid = rec['qid']
+                for c in rec.get('top_chunks', []):
+                    score_map[qid][c['chunk_id']] = c['score']
     return score_map
 
 def ensemble_pair_product(model_path: str,
@@ -74,44 +90,91 @@ def ensemble_pair_product(model_path: str,
     combined = {}
     all_qids = set(model_scores.keys()) | set(bm25_scores.keys())
 
-    for qid in all_qids:
-        model_map = model_scores.get(qid, {})
-        bm25_map = bm25_scores.get(qid, {})
-        intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
+    tracer = get_tracer()
+    with tracer.stage("fuse"):
+        for qid in all_qids:
+            model_map = model_scores.get(qid, {})
+            bm25_map = bm25_scores.get(qid, {})
+            intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
 
-        scores_accumulator = []
+            scores_accumulator = []
         
-        # Process intersection chunks with product scoring
-        for cid in intersection_keys:
-            sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
-            scores_accumulator.append((cid, sc))
+            # Process intersection chunks with product scoring
+            for cid in intersection_keys:
+                sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
+                scores_accumulator.append((cid, sc))
         
-        # Add model-only chunks (chunks in model but not in BM25)
-        model_only_keys = set(model_map.keys()) - intersection_keys
-        for cid in model_only_keys:
-            sc = model_weight * model_map[cid]
-            scores_accumulator.append((cid, sc))
+            # Add model-only chunks (chunks in model but not in BM25)
+            model_only_keys = set(model_map.keys()) - intersection_keys
+            for cid in model_only_keys:
+                sc = model_weight * model_map[cid]
+                scores_accumulator.append((cid, sc))
         
-        # Add BM25-only chunks (chunks in BM25 but not in model)
-        bm25_only_keys = set(bm25_map.keys()) - intersection_keys
-        for cid in bm25_only_keys:
-            sc = bm25_weight * bm25_map[cid]
-            scores_accumulator.append((cid, sc))
-
-        topk = sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
-        combined[qid] = topk
-        output_list.append({
-            "qid": qid,
-            "top_chunks": [
-                {"chunk_id": cid, "score": sc} for cid, sc in topk
-            ]
-        })
-
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(output_list, out_f, ensure_ascii=False, indent=2)
+            # Add BM25-only chunks (chunks in BM25 but not in model)
+            bm25_only_keys = set(bm25_map.keys()) - intersection_keys
+            for cid in bm25_only_keys:
+                sc = bm25_weight * bm25_map[cid]
+                scores_accumulator.append((cid, sc))
+
+            tracer.count("candidates", len(scores_accumulator))
+            topk = sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
+            combined[qid] = topk
+            output_list.append({
+                "qid": qid,
+                "top_chunks": [
+                    {"chunk_id": cid, "score": sc} for cid, sc in topk
+                ]
+            })
+
+    with tracer.stage("serialize"):
+        with open(output_path, 'w', encoding='utf-8') as out_f:
+            json.dump(output_list, out_f, ensure_ascii=False, indent=2)
 
     return combined
 
+def fuse_product_rank(model_map: dict,
+                      bm25_map: dict,
+                      rank_map: dict,
+                      model_weight: float,
+                      bm25_weight: float,
+                      K: int):
+    """Product + model rank factor fusion for one query; returns top-K (chunk_id, score)."""
+    intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
+
+    scores_accumulator = []
+    
+    # Process intersection chunks with product scoring and rank factor
+    for cid in intersection_keys:
+        rank = rank_map.get(cid)
+        if rank:
+            rank_factor = 1.0 / float(rank)
+            sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid]) * rank_factor
+        else:
+            # Use raw product without rank factor if rank is missing
+            sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
+        scores_accumulator.append((cid, sc))
+    
+    # Add model-only chunks (chunks in model but not in BM25)
+    model_only_keys = set(model_map.keys()) - intersection_keys
+    for cid in model_only_keys:
+        rank = rank_map.get(cid)
+        if rank:
+            rank_factor = 1.0 / float(rank)
+            sc = (model_weight * model_map[cid]) * rank_factor
+        else:
+            # Use raw weighted score if rank is missing
+            sc = model_weight * model_map[cid]
+        scores_accumulator.append((cid, sc))
+    
+    # Add BM25-only chunks (chunks in BM25 but not in model)
+    bm25_only_keys = set(bm25_map.keys()) - intersection_keys
+    for cid in bm25_only_keys:
+        sc = bm25_weight * bm25_map[cid]
+        scores_accumulator.append((cid, sc))
+
+    get_tracer().count("candidates", len(scores_accumulator))
+    return sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
+
 def ensemble_pair_product_rank(model_path: str,
                                bm25_path: str,
                                model_weight: float,
@@ -124,65 +187,36 @@ def ensemble_pair_product_rank(model_path: str,
 
     # Build rank map from model file: { qid: { chunk_id: rank_index (1-based) } }
     model_rank_map = defaultdict(dict)
-    with open(model_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        for rec in data:
-            qid = rec['qid']
-            for idx, c in enumerate(rec.get('top_chunks', []), start=1):
-                model_rank_map[qid][c['chunk_id']] = idx
+    with get_tracer().stage("load_runs"):
+        with open(model_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            for rec in data:
+                qid = rec['qid']
+                for idx, c in enumerate(rec.get('top_chunks', []), start=1):
+                    model_rank_map[qid][c['chunk_id']] = idx
 
     output_list = []
     combined = {}
     all_qids = set(model_scores.keys()) | set(bm25_scores.keys())
 
-    for qid in all_qids:
-        model_map = model_scores.get(qid, {})
-        bm25_map = bm25_scores.get(qid, {})
-        rank_map = model_rank_map.get(qid, {})
-        intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
-
-        scores_accumulator = []
-        
-        # Process intersection chunks with product scoring and rank factor
-        for cid in intersection_keys:
-            rank = rank_map.get(cid)
-            if rank:
-                rank_factor = 1.0 / float(rank)
-                sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid]) * rank_factor
-            else:
-                # Use raw product without rank factor if rank is missing
-                sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
-            scores_accumulator.append((cid, sc))
-        
-        # Add model-only chunks (chunks in model but not in BM25)
-        model_only_keys = set(model_map.keys()) - intersection_keys
-        for cid in model_only_keys:
-            rank = rank_map.get(cid)
-            if rank:
-                rank_factor = 1.0 / float(rank)
-                sc = (model_weight * model_map[cid]) * rank_factor
-            else:
-                # Use raw weighted score if rank is missing
-                sc = model_weight * model_map[cid]
-            scores_accumulator.append((cid, sc))
-        
-        # Add BM25-only chunks (chunks in BM25 but not in model)
-        bm25_only_keys = set(bm25_map.keys()) - intersection_keys
-        for cid in bm25_only_keys:
-            sc = bm25_weight * bm25_map[cid]
-            scores_accumulator.append((cid, sc))
-
-        topk = sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
-        combined[qid] = topk
-        output_list.append({
-            "qid": qid,
-            "top_chunks": [
-                {"chunk_id": cid, "score": sc} for cid, sc in topk
-            ]
-        })
-
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(output_list, out_f, ensure_ascii=False, indent=2)
+    tracer = get_tracer()
+    with tracer.stage("fuse"):
+        for qid in all_qids:
+            model_map = model_scores.get(qid, {})
+            bm25_map = bm25_scores.get(qid, {})
+            rank_map = model_rank_map.get(qid, {})
+            topk = fuse_product_rank(model_map, bm25_map, rank_map, model_weight, bm25_weight, K)
+            combined[qid] = topk
+            output_list.append({
+                "qid": qid,
+                "top_chunks": [
+                    {"chunk_id": cid, "score": sc} for cid, sc in topk
+                ]
+            })
+
+    with tracer.stage("serialize"):
+        with open(output_path, 'w', encoding='utf-8') as out_f:
+            json.dump(output_list, out_f, ensure_ascii=False, indent=2)
 
     return combined
 
@@ -198,65 +232,70 @@ def ensemble_pair_product_bm25_rank(model_path: str,
 
     # Build rank map from BM25 file: { qid: { chunk_id: rank_index (1-based) } }
     bm25_rank_map = defaultdict(dict)
-    with open(bm25_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        for rec in data:
-            qid = rec['qid']
-            for idx, c in enumerate(rec.get('top_chunks', []), start=1):
-                bm25_rank_map[qid][c['chunk_id']] = idx
+    with get_tracer().stage("load_runs"):
+        with open(bm25_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            for rec in data:
+                qid = rec['qid']
+                for idx, c in enumerate(rec.get('top_chunks', []), start=1):
+                    bm25_rank_map[qid][c['chunk_id']] = idx
 
     output_list = []
     combined = {}
     all_qids = set(model_scores.keys()) | set(bm25_scores.keys())
 
-    for qid in all_qids:
-        model_map = model_scores.get(qid, {})
-        bm25_map = bm25_scores.get(qid, {})
-        rank_map = bm25_rank_map.get(qid, {})
-        intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
+    tracer = get_tracer()
+    with tracer.stage("fuse"):
+        for qid in all_qids:
+            model_map = model_scores.get(qid, {})
+            bm25_map = bm25_scores.get(qid, {})
+            rank_map = bm25_rank_map.get(qid, {})
+            intersection_keys = set(model_map.keys()) & set(bm25_map.keys())
 
-        scores_accumulator = []
+            scores_accumulator = []
         
-        # Process intersection chunks with product scoring and BM25 rank factor
-        for cid in intersection_keys:
-            rank = rank_map.get(cid)
-            if rank:
-                rank_factor = 1.0 / float(rank)
-                sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid]) * rank_factor
-            else:
-                # Use raw product without rank factor if rank is missing
-                sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
-            scores_accumulator.append((cid, sc))
+            # Process intersection chunks with product scoring and BM25 rank factor
+            for cid in intersection_keys:
+                rank = rank_map.get(cid)
+                if rank:
+                    rank_factor = 1.0 / float(rank)
+                    sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid]) * rank_factor
+                else:
+                    # Use raw product without rank factor if rank is missing
+                    sc = (model_weight * model_map[cid]) * (bm25_weight * bm25_map[cid])
+                scores_accumulator.append((cid, sc))
         
-        # Add model-only chunks (chunks in model but not in BM25)
-        model_only_keys = set(model_map.keys()) - intersection_keys
-        for cid in model_only_keys:
-            sc = model_weight * model_map[cid]
-            scores_accumulator.append((cid, sc))
+            # Add model-only chunks (chunks in model but not in BM25)
+            model_only_keys = set(model_map.keys()) - intersection_keys
+            for cid in model_only_keys:
+                sc = model_weight * model_map[cid]
+                scores_accumulator.append((cid, sc))
         
-        # Add BM25-only chunks (chunks in BM25 but not in model)
-        bm25_only_keys = set(bm25_map.keys()) - intersection_keys
-        for cid in bm25_only_keys:
-            rank = rank_map.get(cid)
-            if rank:
-                rank_factor = 1.0 / float(rank)
-                sc = (bm25_weight * bm25_map[cid]) * rank_factor
-            else:
-                # Use raw weighted score if rank is missing
-                sc = bm25_weight * bm25_map[cid]
-            scores_accumulator.append((cid, sc))
-
-        topk = sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
-        combined[qid] = topk
-        output_list.append({
-            "qid": qid,
-            "top_chunks": [
-                {"chunk_id": cid, "score": sc} for cid, sc in topk
-            ]
-        })
-
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(output_list, out_f, ensure_ascii=False, indent=2)
+            # Add BM25-only chunks (chunks in BM25 but not in model)
+            bm25_only_keys = set(bm25_map.keys()) - intersection_keys
+            for cid in bm25_only_keys:
+                rank = rank_map.get(cid)
+                if rank:
+                    rank_factor = 1.0 / float(rank)
+                    sc = (bm25_weight * bm25_map[cid]) * rank_factor
+                else:
+                    # Use raw weighted score if rank is missing
+                    sc = bm25_weight * bm25_map[cid]
+                scores_accumulator.append((cid, sc))
+
+            tracer.count("candidates", len(scores_accumulator))
+            topk = sorted(scores_accumulator, key=lambda x: x[1], reverse=True)[:K]
+            combined[qid] = topk
+            output_list.append({
+                "qid": qid,
+                "top_chunks": [
+                    {"chunk_id": cid, "score": sc} for cid, sc in topk
+                ]
+            })
+
+    with tracer.stage("serialize"):
+        with open(output_path, 'w', encoding='utf-8') as out_f:
+            json.dump(output_list, out_f, ensure_ascii=False, indent=2)
 
     return combined
 
@@ -400,6 +439,9 @@ def ensemble_pairs(
 if __name__ == "__main__":
     print("=== CUSTOM ENSEMBLE WITH BM25 ===\n")
 
+    # Bật tracing bằng VLSP_TRACE_JSON / VLSP_TRACE_PROM
+    init_tracing("ensemble")
+
     # Choose ensemble method: 'sum' (minmax-scale + weighted sum) or 'product' (raw multiplication), 'product_rank' (raw multiplication + rank factor)
     ENSEMBLE_METHOD = 'product_rank'
 
@@ -424,4 +466,6 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Custom ensemble failed: {e}\n")
 
+    finish_tracing()
+
     print("=== DONE ===")
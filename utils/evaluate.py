@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+import sys
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Sequence, Set
@@ -11,6 +12,11 @@ BETA_SQ = BETA ** 2
 ROOT = Path(__file__).resolve().parents[1]  # project root
 GT_PATH = ROOT / "data" / "processed" / "test.json"
 
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from utils.instrumentation import finish_tracing, get_tracer, init_tracing  # noqa: E402
+
 
 def fbeta_score(pred: Set[str], gold: Set[str], beta_sq: int = BETA_SQ) -> float:
     """Compute F-beta for a single sample.
@@ -41,7 +47,7 @@ def fbeta_score(pred: Set[str], gold: Set[str], beta_sq: int = BETA_SQ) -> float
 
 def load_ground_truth(path: Path = GT_PATH) -> Dict[int, Set[str]]:
     """Load ground-truth mapping *qid ➜ set(relevant_law_ids)*."""
-    with path.open(encoding="utf-8") as f:
+    with get_tracer().stage("load_ground_truth"), path.open(encoding="utf-8") as f:
         data = json.load(f)
     return {item["qid"]: {str(law_id) for law_id in item["relevant_laws"]} for item in data}
 
@@ -51,9 +57,12 @@ def load_predictions(path: Path, topk: int) -> Dict[int, List[str]]:
     Điều chỉnh: chỉ xét đúng topk phần tử đầu (có thể trùng), rồi loại trùng
     ngay trong đó, không lấy thêm để bù đủ.
     """
-    with path.open(encoding="utf-8") as f:
+    with get_tracer().stage("load_predictions"), path.open(encoding="utf-8") as f:
         preds = json.load(f)
+    return predictions_from_results(preds, topk)
 
+def predictions_from_results(preds: Sequence[dict], topk: int) -> Dict[int, List[str]]:
+    """Same as :func:`load_predictions` for results already in memory."""
     grouped: Dict[int, List[tuple[float, str]]] = defaultdict(list)
 
     for item in preds:
@@ -91,16 +100,21 @@ def load_predictions(path: Path, topk: int) -> Dict[int, List[str]]:
 
     return result
 
+def per_query_f2(gt: Dict[int, Set[str]], pred: Dict[int, List[str]]) -> List[float]:
+    """F2 of every query in *gt* (same order as *gt*).
+
+    If a *qid* is missing from *pred*, an empty prediction is used.
+    """
+    with get_tracer().stage("compute_f2"):
+        return [fbeta_score(set(pred.get(qid, [])), gold) for qid, gold in gt.items()]
+
+
 def compute_macro_f2(gt: Dict[int, Set[str]], pred: Dict[int, List[str]]) -> float:
     """Compute macro F2 across all queries present in *gt*.
 
     If a *qid* is missing from *pred*, an empty prediction is used.
     """
-    scores = []
-    for qid, gold in gt.items():
-        predicted = set(pred.get(qid, []))
-        score = fbeta_score(predicted, gold)
-        scores.append(score)
+    scores = per_query_f2(gt, pred)
     return sum(scores) / len(scores)
 
 
@@ -108,6 +122,7 @@ def main():
     """Run evaluation using predefined variables instead of CLI arguments."""
     # ----- User-configurable variables -----
     TOPK = 3  # Số id tối đa giữ lại cho mỗi truy vấn
+    SIGNIFICANCE = False  # In khoảng tin cậy + p-value (bootstrap / permutation) cho mọi cặp run
     PRED_PATHS = {
         "test_rerank_bgem3_base": ROOT / "results" / "test" / "test_rerank_bgem3_base.json",
         "ENSEMBLE test_rerank_bgem3_base": ROOT / "results" / "test" / "product_rank_ensemble_test_rerank_bgem3_base_bm25.json",
@@ -130,16 +145,29 @@ def main():
 
     # ---------------------------------------
 
+    # Bật tracing bằng VLSP_TRACE_JSON / VLSP_TRACE_PROM
+    init_tracing("evaluate")
+
     gt = load_ground_truth()
 
     print(f"Loaded ground-truth for {len(gt)} queries from {GT_PATH}")
     print(f"Using TOPK = {TOPK}\n")
 
+    per_query = {}
     for name, path in PRED_PATHS.items():
         preds = load_predictions(path, TOPK)
-        macro_f2 = compute_macro_f2(gt, preds)
+        per_query[name] = per_query_f2(gt, preds)
+        macro_f2 = sum(per_query[name]) / len(per_query[name])
         print(f"{name:>6}: {macro_f2:.4f}")
 
+    if SIGNIFICANCE:
+        from utils.significance import print_report, significance_report
+
+        print()
+        print_report(significance_report(per_query))
+
+    finish_tracing()
+
 
 if __name__ == "__main__":
     main()
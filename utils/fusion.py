@@ -0,0 +1,330 @@
+"""
+N-way fusion of sorted result runs with the threshold algorithm (Fagin TA)
+
+ensemble_with_bm25.py chỉ ghép một cặp model / BM25 và chấm điểm toàn bộ hợp
+các ứng viên (tới 2000 BM25 + 100 dense mỗi câu hỏi) rồi sort. Module này ghép
+số run bất kỳ (BM25, nhiều dense model, reranker):
+
+    1) Mỗi run được chuyển thành list (chunk_id, giá trị local) giảm dần, kèm
+       dict để truy cập ngẫu nhiên; chunk không có trong run nhận giá trị
+       ``missing`` của phương pháp (0 cho tổng, 1 cho tích)
+    2) Duyệt các run song song theo độ sâu (sorted access); mỗi chunk mới gặp
+       được tra điểm ở các run còn lại (random access) và chấm điểm đầy đủ
+    3) Ngưỡng = combine(max(giá trị kế tiếp của run i, missing_i)) là chặn
+       trên cho mọi chunk chưa gặp; dừng khi điểm thứ K lớn hơn hẳn ngưỡng
+
+Với hàm combine đơn điệu không giảm theo từng đối số, top-K giống hệt fusion
+toàn bộ (``fuse_exhaustive``), cùng điểm và cùng thứ tự (điểm giảm dần, hòa
+thì chunk_id tăng dần). ``product`` / ``product_rank`` chỉ đơn điệu khi mọi
+giá trị local không âm; nếu không, ``fuse`` tự chuyển sang fusion toàn bộ.
+
+Phương pháp (run cuối cùng là BM25, giống ensemble_pairs):
+    sum           w * minmax(score) theo min/max toàn file, missing = 0
+    product       w * score, missing = 1
+    product_rank  như product, run khác BM25 nhân thêm 1 / rank
+    rrf           w / (rrf_k + rank), missing = 0
+
+Example:
+    python utils/fusion.py --runs results/test/bge_test.json results/test/bm25_test.json \
+        --weights 1.0 1.0 --method product_rank --K 100 --output results/test/fused.json --check
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.instrumentation import finish_tracing, get_tracer, init_tracing
+
+METHODS = ("sum", "product", "product_rank", "rrf")
+RRF_K = 60
+
+
+def _combine_sum(values):
+    total = 0.0
+    for v in values:
+        total += v
+    return total
+
+
+def _combine_product(values):
+    total = 1.0
+    for v in values:
+        total *= v
+    return total
+
+
+# method -> (combine, missing)
+_COMBINE = {
+    "sum": (_combine_sum, 0.0),
+    "product": (_combine_product, 1.0),
+    "product_rank": (_combine_product, 1.0),
+    "rrf": (_combine_sum, 0.0),
+}
+
+
+class SortedRun:
+    """One run of one query: chunk ids by decreasing local value + random-access dict."""
+
+    __slots__ = ("ids", "values", "lookup", "missing")
+
+    def __init__(self, ids, values, missing: float):
+        # Đầu vào thường đã giảm dần (search.py, predict_bge.py); sort lại nếu không
+        if any(values[i] < values[i + 1] for i in range(len(values) - 1)):
+            order = sorted(range(len(values)), key=lambda i: -values[i])
+            ids = [ids[i] for i in order]
+            values = [values[i] for i in order]
+        self.ids = ids
+        self.values = values
+        self.lookup = dict(zip(ids, values))
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def local_values(scores, method: str, weight: float, apply_rank: bool, minmax=None, rrf_k: int = RRF_K):
+    """
+    Per-run local values for one query, in run order
+
+    Args:
+        scores: Raw scores of the run, best first
+        method: One of METHODS
+        weight: Run weight
+        apply_rank: product_rank only, multiply by 1 / rank
+        minmax: (min, max) of the whole run file, for "sum"
+        rrf_k: RRF constant
+
+    Returns:
+        values: List of floats
+    """
+    if method == "sum":
+        mn, mx = minmax
+        return [((s - mn) / (mx - mn) if mx > mn else 0.0) * weight for s in scores]
+    if method == "rrf":
+        return [weight / (rrf_k + rank) for rank in range(1, len(scores) + 1)]
+    if method == "product_rank" and apply_rank:
+        return [(weight * s) * (1.0 / float(rank)) for rank, s in enumerate(scores, start=1)]
+    return [weight * s for s in scores]
+
+
+def is_monotone(runs, method: str) -> bool:
+    """TA is exact only if combine is non-decreasing in every argument."""
+    if method in ("product", "product_rank"):
+        return all(v >= 0 for run in runs for v in run.values)
+    return True
+
+
+def _score(cid, runs, combine, stats):
+    values = []
+    for run in runs:
+        v = run.lookup.get(cid)
+        values.append(run.missing if v is None else v)
+    stats["random_accesses"] += len(runs) - 1
+    return combine(values)
+
+
+def _top_k(scored: dict, K: int):
+    return sorted(scored.items(), key=lambda x: (-x[1], x[0]))[:K]
+
+
+def fuse_exhaustive(runs, method: str, K: int):
+    """Score the full union of candidates; reference for fuse_threshold."""
+    combine, _ = _COMBINE[method]
+    stats = {"sorted_accesses": 0, "random_accesses": 0, "depth": 0}
+    scored = {}
+    for run in runs:
+        stats["sorted_accesses"] += len(run)
+        stats["depth"] = max(stats["depth"], len(run))
+        for cid in run.ids:
+            if cid not in scored:
+                scored[cid] = _score(cid, runs, combine, stats)
+    stats["candidates"] = len(scored)
+    return _top_k(scored, K), stats
+
+
+def fuse_threshold(runs, method: str, K: int):
+    """
+    Threshold-algorithm fusion of one query
+
+    Args:
+        runs: List of SortedRun
+        method: One of METHODS
+        K: Number of fused results
+
+    Returns:
+        topk: List of (chunk_id, score), same as fuse_exhaustive for monotone combine
+        stats: sorted / random accesses, depth reached and candidates scored
+    """
+    combine, _ = _COMBINE[method]
+    stats = {"sorted_accesses": 0, "random_accesses": 0, "depth": 0}
+    scored = {}
+    kth = []  # min-heap với K điểm cao nhất đã gặp
+    max_depth = max((len(run) for run in runs), default=0)
+
+    for depth in range(max_depth):
+        for run in runs:
+            if depth >= len(run):
+                continue
+            stats["sorted_accesses"] += 1
+            cid = run.ids[depth]
+            if cid in scored:
+                continue
+            sc = _score(cid, runs, combine, stats)
+            scored[cid] = sc
+            if len(kth) < K:
+                heapq.heappush(kth, sc)
+            elif sc > kth[0]:
+                heapq.heapreplace(kth, sc)
+        stats["depth"] = depth + 1
+
+        if len(kth) == K:
+            # Chặn trên của chunk chưa gặp: nằm sau depth trong run i hoặc không có trong run i
+            bounds = [
+                max(run.values[depth + 1], run.missing) if depth + 1 < len(run) else run.missing
+                for run in runs
+            ]
+            # So sánh chặt: chunk chưa gặp không thể hòa điểm với top-K
+            if kth[0] > combine(bounds):
+                break
+
+    stats["candidates"] = len(scored)
+    return _top_k(scored, K), stats
+
+
+def fuse(runs, method: str, K: int, algorithm: str = "threshold"):
+    """fuse_threshold when exact for these runs, otherwise fuse_exhaustive."""
+    if algorithm == "threshold" and is_monotone(runs, method):
+        return fuse_threshold(runs, method, K)
+    return fuse_exhaustive(runs, method, K)
+
+
+def load_run(path: str):
+    """Results JSON -> ({qid: (chunk_ids, scores)}, (min, max) score of the file)."""
+    with get_tracer().stage("load_runs"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    run, mn, mx = {}, None, None
+    for rec in data:
+        chunks = rec.get("top_chunks", [])
+        scores = [c["score"] for c in chunks]
+        run[rec["qid"]] = ([c["chunk_id"] for c in chunks], scores)
+        if scores:
+            mn = min(scores) if mn is None else min(mn, min(scores))
+            mx = max(scores) if mx is None else max(mx, max(scores))
+    return run, (0.0, 1.0) if mn is None else (mn, mx)
+
+
+def build_query_runs(loaded, qid, method: str, weights, rrf_k: int = RRF_K):
+    """SortedRun list of one query; the last run is BM25 (no rank factor in product_rank)."""
+    _, missing = _COMBINE[method]
+    runs = []
+    for i, ((run, minmax), w) in enumerate(zip(loaded, weights)):
+        ids, scores = run.get(qid, ([], []))
+        values = local_values(scores, method, w, apply_rank=i < len(loaded) - 1, minmax=minmax, rrf_k=rrf_k)
+        runs.append(SortedRun(list(ids), values, missing))
+    return runs
+
+
+def fuse_files(paths, weights=None, method: str = "product_rank", K: int = 100,
+               output_path: str = None, algorithm: str = "threshold", rrf_k: int = RRF_K):
+    """
+    Fuse N result files query by query
+
+    Args:
+        paths: Result JSON files (BM25 last)
+        weights: One weight per file (default 1.0)
+        method: One of METHODS
+        K: Number of fused results per query
+        output_path: Where to write the fused results (optional)
+        algorithm: "threshold" or "exhaustive"
+        rrf_k: RRF constant
+
+    Returns:
+        combined: {qid: [(chunk_id, score)]}
+        stats: Totals of accesses / candidates over all queries
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}")
+    weights = [1.0] * len(paths) if weights is None else [float(w) for w in weights]
+    if len(weights) != len(paths):
+        raise ValueError("need one weight per run")
+
+    tracer = get_tracer()
+    loaded = [load_run(p) for p in paths]
+    qids = []
+    seen = set()
+    for run, _ in loaded:
+        for qid in run:
+            if qid not in seen:
+                seen.add(qid)
+                qids.append(qid)
+
+    combined, output_list = {}, []
+    totals = {"sorted_accesses": 0, "random_accesses": 0, "candidates": 0, "union": 0}
+    with tracer.stage("fuse"):
+        for qid in qids:
+            runs = build_query_runs(loaded, qid, method, weights, rrf_k)
+            topk, stats = fuse(runs, method, K, algorithm)
+            for key in ("sorted_accesses", "random_accesses", "candidates"):
+                totals[key] += stats[key]
+            totals["union"] += len(set().union(*(run.ids for run in runs)))
+            tracer.count("candidates", stats["candidates"])
+            combined[qid] = topk
+            output_list.append({
+                "qid": qid,
+                "top_chunks": [{"chunk_id": cid, "score": sc} for cid, sc in topk]
+            })
+
+    if output_path:
+        with tracer.stage("serialize"):
+            with open(output_path, "w", encoding="utf-8") as out_f:
+                json.dump(output_list, out_f, ensure_ascii=False, indent=2)
+
+    return combined, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="N-way fusion of result runs (threshold algorithm)")
+    parser.add_argument("--runs", nargs="+", required=True, help="Result JSON files, BM25 last")
+    parser.add_argument("--weights", nargs="+", type=float, default=None, help="One weight per run")
+    parser.add_argument("--method", type=str, default="product_rank", choices=METHODS, help="Fusion function")
+    parser.add_argument("--K", type=int, default=100, help="Fused results per query")
+    parser.add_argument("--rrf_k", type=int, default=RRF_K, help="RRF constant")
+    parser.add_argument("--algorithm", type=str, default="threshold", choices=("threshold", "exhaustive"))
+    parser.add_argument("--output", type=str, required=True, help="Output results JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="Also run exhaustive fusion and verify identical top-K")
+    parser.add_argument("--trace_json", type=str, default=None, help="Write a per-stage timing summary (JSON)")
+    args = parser.parse_args()
+    init_tracing("fusion", args.trace_json)
+
+    t0 = time.perf_counter()
+    combined, stats = fuse_files(args.runs, args.weights, args.method, args.K, args.output,
+                                 args.algorithm, args.rrf_k)
+    elapsed = time.perf_counter() - t0
+    print(f"✅ {len(combined)} câu hỏi -> {args.output} ({elapsed:.2f}s)")
+    print(f"Candidates scored: {stats['candidates']} / {stats['union']} "
+          f"({stats['candidates'] / max(1, stats['union']):.1%}), "
+          f"sorted accesses: {stats['sorted_accesses']}, random accesses: {stats['random_accesses']}")
+
+    if args.check:
+        t0 = time.perf_counter()
+        reference, _ = fuse_files(args.runs, args.weights, args.method, args.K,
+                                  algorithm="exhaustive", rrf_k=args.rrf_k)
+        ref_elapsed = time.perf_counter() - t0
+        mismatched = [qid for qid in reference if reference[qid] != combined.get(qid)]
+        print(f"Exhaustive: {ref_elapsed:.2f}s, mismatched queries: {len(mismatched)}")
+        if mismatched:
+            sys.exit(1)
+
+    finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""
+Incremental index updates for added, amended or repealed articles.
+
+Keeps the chunk table, BM25 collection statistics and dense vectors of the
+current corpus in an index directory and applies add / update / delete
+operations keyed by article ``aid``:
+
+- only the chunks of the touched article are re-chunked; chunks whose text
+  did not change keep their tokens and vectors, the others are re-tokenized
+  and re-encoded;
+- dense vectors live in a ``faiss.IndexIDMap2`` keyed by a stable chunk row
+  id, so removals and additions never rebuild the index;
+- BM25 document frequencies and total length are updated per chunk, IDF is
+  derived from them when the model is exported.
+
+``compact`` renumbers the live chunks contiguously in corpus order and
+writes the usual artifacts (chunk_corpus.json, bm25_model.pkl, bge.bin,
+corpus_meta.pkl). It runs automatically once too many row ids have been
+retired. ``check`` compares the state with a full rebuild from scratch.
+
+Example:
+    python utils/incremental_index.py init --index_dir data/incremental \
+        --corpus data/processed/corpus.json \
+        --chunk_corpus data/processed/chunked/chunk_corpus.json \
+        --bm25_model retrieve/sparse/bm25_model.pkl --faiss_index data/faiss_index/bge.bin
+    python utils/incremental_index.py apply --index_dir data/incremental \
+        --updates updates.json --path_model BAAI/bge-m3
+    python utils/incremental_index.py compact --index_dir data/incremental --out_dir data/incremental/export
+    python utils/incremental_index.py check --index_dir data/incremental
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import sys
+from collections import Counter
+
+import faiss
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.chunk import chunk_record
+
+STATE_FILE = "state.pkl"
+DENSE_FILE = "dense_idmap.bin"
+
+
+def _term_frequencies(tokens):
+    # Giống BM25Okapi._initialize: dict theo thứ tự xuất hiện đầu tiên
+    frequencies = {}
+    for word in tokens:
+        frequencies[word] = frequencies.get(word, 0) + 1
+    return frequencies
+
+
+class IncrementalBM25:
+    """BM25 collection statistics maintained one chunk at a time."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.doc_freqs = {}     # row_id -> {term: tf}
+        self.doc_len = {}       # row_id -> số token
+        self.df = Counter()     # term -> số chunk chứa term
+        self.total_len = 0
+
+    @property
+    def corpus_size(self):
+        return len(self.doc_len)
+
+    def add(self, row_id: int, tokens):
+        freqs = _term_frequencies(tokens)
+        self.doc_freqs[row_id] = freqs
+        self.doc_len[row_id] = len(tokens)
+        self.total_len += len(tokens)
+        self.df.update(freqs.keys())
+
+    def remove(self, row_id: int):
+        freqs = self.doc_freqs.pop(row_id)
+        self.total_len -= self.doc_len.pop(row_id)
+        self.df.subtract(freqs.keys())
+        for term in freqs:
+            if self.df[term] <= 0:
+                del self.df[term]
+
+    def idf(self):
+        """IDF như BM25Okapi._calc_idf, tính từ df đang được duy trì."""
+        n = self.corpus_size
+        idf, negative = {}, []
+        for term, freq in self.df.items():
+            value = math.log(n - freq + 0.5) - math.log(freq + 0.5)
+            idf[term] = value
+            if value < 0:
+                negative.append(term)
+        average_idf = sum(idf.values()) / len(idf) if idf else 0.0
+        eps = self.epsilon * average_idf
+        for term in negative:
+            idf[term] = eps
+        return idf, average_idf
+
+    def to_bm25okapi(self, row_order):
+        """Export a rank_bm25.BM25Okapi equivalent to rebuilding on the rows in row_order."""
+        from rank_bm25 import BM25Okapi
+
+        model = BM25Okapi.__new__(BM25Okapi)
+        model.k1, model.b, model.epsilon = self.k1, self.b, self.epsilon
+        model.tokenizer = None
+        model.corpus_size = len(row_order)
+        model.doc_freqs = [self.doc_freqs[r] for r in row_order]
+        model.doc_len = [self.doc_len[r] for r in row_order]
+        model.avgdl = self.total_len / model.corpus_size
+        model.idf, model.average_idf = self.idf()
+        return model
+
+
+class IncrementalIndex:
+    """
+    Chunk table + BM25 statistics + id-mapped dense index of the current corpus
+
+    Args:
+        index_dir: Directory holding state.pkl and dense_idmap.bin
+        chunk_size, chunk_overlap: Same splitter settings as utils/chunk.py
+        compact_ratio: Auto-compact when retired row ids exceed this fraction of live rows
+    """
+
+    def __init__(self, index_dir: str, chunk_size: int = 400, chunk_overlap: int = 50,
+                 compact_ratio: float = 0.2):
+        self.index_dir = index_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.compact_ratio = compact_ratio
+        self.articles = {}      # aid -> content_Article (thứ tự dict = thứ tự corpus)
+        self.article_fields = {}  # aid -> field khác của điều luật trong corpus.json (vd. law_id)
+        self.article_rows = {}  # aid -> [row_id theo thứ tự chunk]
+        self.chunks = {}        # row_id -> {"aid", "chunk_id", "content_Article"}
+        self.bm25 = IncrementalBM25()
+        self.dense = None
+        self.next_row_id = 0
+        self.retired = 0
+        self._splitter = None
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        # Lưu dạng dict thuần để load được dù module chạy dưới tên __main__
+        state = {k: v for k, v in self.__dict__.items() if k not in ("dense", "_splitter", "bm25")}
+        state["bm25"] = dict(self.bm25.__dict__)
+        with open(os.path.join(self.index_dir, STATE_FILE), "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.dense is not None:
+            faiss.write_index(self.dense, os.path.join(self.index_dir, DENSE_FILE))
+
+    @classmethod
+    def load(cls, index_dir: str):
+        index = cls(index_dir)
+        with open(os.path.join(index_dir, STATE_FILE), "rb") as f:
+            state = pickle.load(f)
+        index.bm25.__dict__.update(state.pop("bm25"))
+        index.__dict__.update(state)
+        index.index_dir = index_dir
+        dense_path = os.path.join(index_dir, DENSE_FILE)
+        if os.path.exists(dense_path):
+            index.dense = faiss.read_index(dense_path)
+        return index
+
+    # ------------------------------------------------------------------
+    # Building blocks
+    # ------------------------------------------------------------------
+
+    def splitter(self):
+        if self._splitter is None:
+            from utils.chunk import build_text_splitter
+            self._splitter = build_text_splitter(self.chunk_size, self.chunk_overlap)
+        return self._splitter
+
+    def chunk_article(self, content: str):
+        return self.splitter().split_text(content)
+
+    @staticmethod
+    def tokenize(texts):
+        from retrieve.sparse.create_model_bm25 import bm25_tokenizer
+        return [bm25_tokenizer(t) for t in texts]
+
+    @staticmethod
+    def encode(encoder, texts, batch_size: int = 32):
+        vectors = encoder.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def _ensure_dense(self, dim: int):
+        if self.dense is None:
+            self.dense = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    def _add_rows(self, aid, items, tokens, vectors):
+        """items: list of (idx, text); tokens/vectors aligned with items."""
+        row_ids = np.arange(self.next_row_id, self.next_row_id + len(items), dtype=np.int64)
+        self.next_row_id += len(items)
+        for row_id, (idx, text), toks in zip(row_ids.tolist(), items, tokens):
+            self.chunks[row_id] = {"aid": aid, "chunk_id": f"{aid}_{idx}", "content_Article": text}
+            self.bm25.add(row_id, toks)
+        if vectors is not None and len(items):
+            self._ensure_dense(vectors.shape[1])
+            self.dense.add_with_ids(vectors, row_ids)
+        return row_ids.tolist()
+
+    def _remove_rows(self, row_ids):
+        if not row_ids:
+            return
+        for row_id in row_ids:
+            self.bm25.remove(row_id)
+            del self.chunks[row_id]
+        if self.dense is not None:
+            self.dense.remove_ids(faiss.IDSelectorBatch(np.asarray(row_ids, dtype=np.int64)))
+        self.retired += len(row_ids)
+
+    # ------------------------------------------------------------------
+    # Initialisation
+    # ------------------------------------------------------------------
+
+    def build(self, corpus, encoder=None, batch_size: int = 32):
+        """Full build from a corpus.json list (aid, law_id, content_Article)."""
+        for item in corpus:
+            self.add(item["aid"], item["content_Article"], encoder=encoder, batch_size=batch_size, fields=item)
+        self.retired = 0
+
+    def adopt(self, corpus, chunk_data, bm25_model, faiss_index=None):
+        """
+        Adopt artifacts produced by the regular pipeline without recomputing them
+
+        Args:
+            corpus: corpus.json list
+            chunk_data: chunk_corpus.json list (same row order as the BM25 model and FAISS index)
+            bm25_model: BM25Okapi from bm25_model.pkl
+            faiss_index: Flat FAISS index (bge.bin), optional
+        """
+        if len(chunk_data) != bm25_model.corpus_size:
+            raise ValueError("chunk corpus và bm25_model không cùng số chunk")
+        self.bm25 = IncrementalBM25(bm25_model.k1, bm25_model.b, bm25_model.epsilon)
+        for item in corpus:
+            self.articles[item["aid"]] = item["content_Article"]
+            self.article_rows[item["aid"]] = []
+            self._set_fields(item["aid"], item)
+        for row_id, item in enumerate(chunk_data):
+            if "law_id" in item and "law_id" not in self.article_fields.get(item["aid"], {}):
+                # corpus.json cũ không có law_id: lấy từ chunk
+                self._set_fields(item["aid"], {"law_id": item["law_id"]})
+            self.chunks[row_id] = {
+                "aid": item["aid"], "chunk_id": item["chunk_id"], "content_Article": item["content_Article"]
+            }
+            self.article_rows.setdefault(item["aid"], []).append(row_id)
+            freqs = dict(bm25_model.doc_freqs[row_id])
+            self.bm25.doc_freqs[row_id] = freqs
+            self.bm25.doc_len[row_id] = bm25_model.doc_len[row_id]
+            self.bm25.total_len += bm25_model.doc_len[row_id]
+            self.bm25.df.update(freqs.keys())
+        self.next_row_id = len(chunk_data)
+        if faiss_index is not None:
+            if faiss_index.ntotal != len(chunk_data):
+                raise ValueError("FAISS index và chunk corpus không cùng số vector")
+            vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+            self._ensure_dense(faiss_index.d)
+            self.dense.add_with_ids(vectors, np.arange(len(chunk_data), dtype=np.int64))
+
+    # ------------------------------------------------------------------
+    # Operations keyed by aid
+    # ------------------------------------------------------------------
+
+    def add(self, aid, content: str, encoder=None, batch_size: int = 32, fields=None):
+        """Thêm điều luật mới (nếu aid đã tồn tại thì cập nhật); fields: field khác của điều luật (law_id)."""
+        if aid in self.articles:
+            return self.update(aid, content, encoder=encoder, batch_size=batch_size, fields=fields)
+        self._set_fields(aid, fields)
+        texts = self.chunk_article(content)
+        items = list(enumerate(texts))
+        tokens = self.tokenize(texts)
+        vectors = self.encode(encoder, texts, batch_size) if encoder is not None and texts else None
+        self.articles[aid] = content
+        self.article_rows[aid] = self._add_rows(aid, items, tokens, vectors)
+        return {"aid": aid, "added": len(items), "removed": 0, "kept": 0}
+
+    def update(self, aid, content: str, encoder=None, batch_size: int = 32, fields=None):
+        """Sửa đổi điều luật: chỉ chunk có nội dung thay đổi mới bị tokenize/encode lại."""
+        if aid not in self.articles:
+            return self.add(aid, content, encoder=encoder, batch_size=batch_size, fields=fields)
+        self._set_fields(aid, fields)
+        old_rows = self.article_rows[aid]
+        old_texts = [self.chunks[r]["content_Article"] for r in old_rows]
+        new_texts = self.chunk_article(content)
+
+        # Giữ chunk cùng vị trí, cùng nội dung (chunk_id = {aid}_{idx} không đổi)
+        keep = [i < len(old_texts) and old_texts[i] == t for i, t in enumerate(new_texts)]
+        removed = [r for i, r in enumerate(old_rows) if i >= len(new_texts) or not keep[i]]
+        changed = [(i, t) for i, t in enumerate(new_texts) if not keep[i]]
+
+        self._remove_rows(removed)
+        texts = [t for _, t in changed]
+        tokens = self.tokenize(texts)
+        vectors = self.encode(encoder, texts, batch_size) if encoder is not None and texts else None
+        new_rows = iter(self._add_rows(aid, changed, tokens, vectors))
+
+        self.articles[aid] = content
+        self.article_rows[aid] = [
+            old_rows[i] if keep[i] else next(new_rows) for i in range(len(new_texts))
+        ]
+        return {"aid": aid, "added": len(changed), "removed": len(removed), "kept": sum(keep)}
+
+    def delete(self, aid):
+        """Bãi bỏ điều luật: xóa toàn bộ chunk của aid."""
+        if aid not in self.articles:
+            return {"aid": aid, "added": 0, "removed": 0, "kept": 0}
+        rows = self.article_rows.pop(aid)
+        self._remove_rows(rows)
+        del self.articles[aid]
+        self.article_fields.pop(aid, None)
+        return {"aid": aid, "added": 0, "removed": len(rows), "kept": 0}
+
+    def apply(self, operations, encoder=None, batch_size: int = 32):
+        """
+        Apply a list of {"op": "add"|"update"|"delete", "aid": ..., "content_Article": ..., "law_id": ...}
+
+        law_id (và field khác) là tùy chọn; update không có law_id giữ law_id cũ.
+
+        Returns:
+            report: list of per-operation summaries
+        """
+        if self.dense is not None and encoder is None and any(op["op"] != "delete" for op in operations):
+            raise ValueError("State có dense index: cần encoder (--path_model) để encode chunk mới")
+        report = []
+        for op in operations:
+            kind = op["op"]
+            if kind == "delete":
+                report.append(self.delete(op["aid"]))
+            elif kind in ("add", "update"):
+                fn = self.add if kind == "add" else self.update
+                report.append(fn(op["aid"], op["content_Article"], encoder=encoder, batch_size=batch_size,
+                                 fields=op))
+            else:
+                raise ValueError(f"Unknown op: {kind}")
+            report[-1]["op"] = kind
+        return report
+
+    def needs_compaction(self):
+        return self.retired > self.compact_ratio * max(1, len(self.chunks))
+
+    # ------------------------------------------------------------------
+    # Compaction / export
+    # ------------------------------------------------------------------
+
+    def _set_fields(self, aid, fields):
+        fields = {k: v for k, v in (fields or {}).items() if k not in ("aid", "content_Article", "op")}
+        if fields:
+            self.article_fields.setdefault(aid, {}).update(fields)
+
+    def article_item(self, aid):
+        """Article as a corpus.json item (aid, extra fields such as law_id, content_Article)."""
+        return dict(self.article_fields.get(aid, {}), aid=aid, content_Article=self.articles[aid])
+
+    def row_order(self):
+        """Live row ids in corpus order (article order, then chunk index)."""
+        return [r for aid in self.articles for r in self.article_rows[aid]]
+
+    def compact(self, out_dir: str = None):
+        """
+        Renumber rows contiguously in corpus order and optionally export artifacts
+
+        Args:
+            out_dir: If given, write chunk_corpus.json, bm25_model.pkl, bge.bin and corpus_meta.pkl there
+        """
+        order = self.row_order()
+        mapping = {old: new for new, old in enumerate(order)}
+
+        vectors = None
+        if self.dense is not None and self.dense.ntotal:
+            vectors = np.vstack([self.dense.reconstruct(int(r)) for r in order]).astype(np.float32)
+
+        self.chunks = {mapping[r]: self.chunks[r] for r in order}
+        self.article_rows = {aid: [mapping[r] for r in rows] for aid, rows in self.article_rows.items()}
+        self.bm25.doc_freqs = {mapping[r]: self.bm25.doc_freqs[r] for r in order}
+        self.bm25.doc_len = {mapping[r]: self.bm25.doc_len[r] for r in order}
+        self.next_row_id = len(order)
+        self.retired = 0
+        if vectors is not None:
+            self.dense = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            self.dense.add_with_ids(vectors, np.arange(len(order), dtype=np.int64))
+
+        if out_dir:
+            self.export(out_dir)
+
+    def export(self, out_dir: str):
+        """Write the standard pipeline artifacts for the current (compacted) state."""
+        os.makedirs(out_dir, exist_ok=True)
+        order = self.row_order()
+        # Cùng record như utils/chunk.py (giữ law_id cho routing theo văn bản luật)
+        chunk_data = [
+            chunk_record(self.article_item(aid), idx, self.chunks[r]["content_Article"])
+            for aid in self.articles for idx, r in enumerate(self.article_rows[aid])
+        ]
+        with open(os.path.join(out_dir, "chunk_corpus.json"), "w", encoding="utf-8") as f:
+            json.dump(chunk_data, f, ensure_ascii=False, indent=4)
+        with open(os.path.join(out_dir, "bm25_model.pkl"), "wb") as f:
+            pickle.dump(self.bm25.to_bm25okapi(order), f)
+        meta = [(c["aid"], c["chunk_id"]) for c in chunk_data]
+        with open(os.path.join(out_dir, "corpus_meta.pkl"), "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.dense is not None:
+            flat = faiss.IndexFlatIP(self.dense.d)
+            if order:
+                flat.add(np.vstack([self.dense.reconstruct(int(r)) for r in order]).astype(np.float32))
+            faiss.write_index(flat, os.path.join(out_dir, "bge.bin"))
+        print(f"✅ Đã xuất {len(order)} chunks vào {out_dir}")
+
+    # ------------------------------------------------------------------
+    # Consistency check
+    # ------------------------------------------------------------------
+
+    def check_consistency(self, encoder=None, sample: int = 200, tol: float = 1e-6, seed: int = 42):
+        """
+        Compare the incremental state with a full rebuild from the current articles
+
+        Args:
+            encoder: If given, re-encode up to `sample` chunks and compare vectors
+            sample: Number of chunks to re-encode for the dense check
+            tol: Absolute tolerance for IDF / vector comparisons
+
+        Returns:
+            report: dict of mismatch counts (all zero when consistent)
+        """
+        from rank_bm25 import BM25Okapi
+
+        order = self.row_order()
+        rebuilt = []
+        for aid, content in self.articles.items():
+            for idx, text in enumerate(self.chunk_article(content)):
+                rebuilt.append((f"{aid}_{idx}", text))
+        current = [(self.chunks[r]["chunk_id"], self.chunks[r]["content_Article"]) for r in order]
+
+        report = {"chunks": len(order), "chunk_mismatch": 0, "doc_freq_mismatch": 0,
+                  "idf_mismatch": 0, "avgdl_diff": 0.0, "vector_mismatch": 0, "vectors_checked": 0}
+        if len(rebuilt) != len(current):
+            report["chunk_mismatch"] = abs(len(rebuilt) - len(current))
+        report["chunk_mismatch"] += sum(a != b for a, b in zip(rebuilt, current))
+        if report["chunk_mismatch"]:
+            return report
+
+        full = BM25Okapi(self.tokenize([t for _, t in rebuilt]))
+        inc = self.bm25.to_bm25okapi(order)
+        report["doc_freq_mismatch"] = sum(a != b for a, b in zip(full.doc_freqs, inc.doc_freqs))
+        report["avgdl_diff"] = abs(full.avgdl - inc.avgdl)
+        report["idf_mismatch"] = sum(
+            1 for t in set(full.idf) | set(inc.idf)
+            if abs(full.idf.get(t, math.inf) - inc.idf.get(t, -math.inf)) > tol
+        )
+
+        if encoder is not None and self.dense is not None and order:
+            rng = np.random.default_rng(seed)
+            picked = rng.choice(len(order), size=min(sample, len(order)), replace=False)
+            fresh = self.encode(encoder, [rebuilt[i][1] for i in picked])
+            stored = np.vstack([self.dense.reconstruct(int(order[i])) for i in picked])
+            report["vectors_checked"] = len(picked)
+            report["vector_mismatch"] = int(np.sum(np.max(np.abs(fresh - stored), axis=1) > 1e-4))
+        return report
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental index updates keyed by article aid")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_init = sub.add_parser("init", help="Create the incremental state")
+    p_init.add_argument("--index_dir", type=str, required=True)
+    p_init.add_argument("--corpus", type=str, required=True, help="Path to corpus.json")
+    p_init.add_argument("--chunk_corpus", type=str, default=None, help="Adopt an existing chunk_corpus.json")
+    p_init.add_argument("--bm25_model", type=str, default=None, help="Adopt an existing bm25_model.pkl")
+    p_init.add_argument("--faiss_index", type=str, default=None, help="Adopt an existing bge.bin")
+    p_init.add_argument("--path_model", type=str, default=None, help="BGE M3 model (full build only)")
+    p_init.add_argument("--chunk_size", type=int, default=400)
+    p_init.add_argument("--chunk_overlap", type=int, default=50)
+
+    p_apply = sub.add_parser("apply", help="Apply add/update/delete operations")
+    p_apply.add_argument("--index_dir", type=str, required=True)
+    p_apply.add_argument("--updates", type=str, required=True,
+                         help='JSON list of {"op": "add"|"update"|"delete", "aid", "content_Article"}')
+    p_apply.add_argument("--path_model", type=str, default=None, help="BGE M3 model for re-encoding")
+    p_apply.add_argument("--export_dir", type=str, default=None, help="Export artifacts on auto-compaction")
+
+    p_compact = sub.add_parser("compact", help="Renumber rows and export pipeline artifacts")
+    p_compact.add_argument("--index_dir", type=str, required=True)
+    p_compact.add_argument("--out_dir", type=str, required=True)
+
+    p_check = sub.add_parser("check", help="Compare with a full rebuild")
+    p_check.add_argument("--index_dir", type=str, required=True)
+    p_check.add_argument("--path_model", type=str, default=None, help="Also re-encode a sample of chunks")
+    p_check.add_argument("--sample", type=int, default=200)
+
+    args = parser.parse_args()
+
+    encoder = None
+    if getattr(args, "path_model", None):
+        from retrieve.dense.predict_bge import load_model
+        encoder, _ = load_model(args.path_model)
+
+    if args.command == "init":
+        index = IncrementalIndex(args.index_dir, args.chunk_size, args.chunk_overlap)
+        corpus = _load_json(args.corpus)
+        if args.chunk_corpus and args.bm25_model:
+            with open(args.bm25_model, "rb") as f:
+                bm25_model = pickle.load(f)
+            faiss_index = faiss.read_index(args.faiss_index) if args.faiss_index else None
+            index.adopt(corpus, _load_json(args.chunk_corpus), bm25_model, faiss_index)
+        else:
+            index.build(corpus, encoder=encoder)
+        index.save()
+        print(f"✅ Đã tạo state với {len(index.articles)} điều luật, {len(index.chunks)} chunks")
+
+    elif args.command == "apply":
+        index = IncrementalIndex.load(args.index_dir)
+        report = index.apply(_load_json(args.updates), encoder=encoder)
+        for r in report:
+            print(f"{r['op']:>6} aid={r['aid']}: +{r['added']} -{r['removed']} ={r['kept']}")
+        if index.needs_compaction():
+            print("Auto-compacting...")
+            index.compact(args.export_dir)
+        index.save()
+
+    elif args.command == "compact":
+        index = IncrementalIndex.load(args.index_dir)
+        index.compact(args.out_dir)
+        index.save()
+
+    else:
+        index = IncrementalIndex.load(args.index_dir)
+        report = index.check_consistency(encoder=encoder, sample=args.sample)
+        print(json.dumps(report, indent=2))
+        consistent = not (report["chunk_mismatch"] or report["doc_freq_mismatch"]
+                          or report["idf_mismatch"] or report["vector_mismatch"])
+        print("✅ Khớp với full rebuild" if consistent else "❌ Không khớp với full rebuild")
+        sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
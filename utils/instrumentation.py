@@ -0,0 +1,251 @@
+"""
+Lightweight per-stage tracing shared by the retrieval entry points.
+
+Tracing is off by default: ``get_tracer()`` then returns a no-op tracer whose
+methods do nothing, so instrumented code pays only an attribute lookup and an
+empty call. Enable it with ``enable_tracing()`` (the ``--trace_json`` /
+``--trace_prom`` flags do this) or with environment variables::
+
+    VLSP_TRACE_JSON=trace.json VLSP_TRACE_PROM=trace.prom python utils/evaluate.py
+
+Usage in an entry point::
+
+    tracer = get_tracer()
+    with tracer.stage("tokenize"):
+        tokens = bm25_tokenizer(question)
+    tracer.observe("query_latency_seconds", elapsed)
+    tracer.count("candidates", len(top_chunks))
+"""
+import json
+import math
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+ENV_TRACE_JSON = "VLSP_TRACE_JSON"
+ENV_TRACE_PROM = "VLSP_TRACE_PROM"
+
+# Bucket (giây) cho histogram latency theo kiểu Prometheus
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _peak_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _percentile(ordered, q):
+    rank = max(1, int(math.ceil(q / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullTracer:
+    """Tracer used when tracing is disabled: every method is a no-op."""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def summary(self):
+        return {}
+
+    def to_prometheus(self):
+        return ""
+
+    def export(self, json_path=None, prom_path=None):
+        pass
+
+
+class Tracer:
+    """
+    Collect per-stage wall time, latency histograms, counters and peak memory
+
+    Args:
+        entry: Name of the entry point (e.g. "search", "predict_bge"), used as a label
+    """
+
+    enabled = True
+
+    def __init__(self, entry: str = "main"):
+        self.entry = entry
+        self.started = time.perf_counter()
+        self.stages = {}        # name -> [calls, total_s, max_s, peak_rss_bytes]
+        self.histograms = {}    # name -> list of observed values (seconds)
+        self.counters = {}      # name -> list of observed counts
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - t0
+            rec = self.stages.get(name)
+            if rec is None:
+                rec = self.stages[name] = [0, 0.0, 0.0, 0]
+            rec[0] += 1
+            rec[1] += elapsed
+            rec[2] = max(rec[2], elapsed)
+            rec[3] = _peak_rss_bytes()
+
+    def observe(self, name, value):
+        self.histograms.setdefault(name, []).append(float(value))
+
+    def count(self, name, value):
+        self.counters.setdefault(name, []).append(value)
+
+    def summary(self):
+        """Return a JSON-serialisable summary of everything recorded."""
+        out = {
+            "entry": self.entry,
+            "wall_s": time.perf_counter() - self.started,
+            "peak_rss_mb": _peak_rss_bytes() / (1024 * 1024),
+            "stages": {},
+            "histograms": {},
+            "counters": {},
+        }
+        for name, (calls, total, longest, rss) in self.stages.items():
+            out["stages"][name] = {
+                "calls": calls,
+                "total_s": total,
+                "mean_ms": 1000.0 * total / calls,
+                "max_ms": 1000.0 * longest,
+                "peak_rss_mb": rss / (1024 * 1024),
+            }
+        for name, values in self.histograms.items():
+            ordered = sorted(values)
+            out["histograms"][name] = {
+                "count": len(ordered),
+                "sum": sum(ordered),
+                "p50": _percentile(ordered, 50),
+                "p90": _percentile(ordered, 90),
+                "p99": _percentile(ordered, 99),
+                "max": ordered[-1],
+                "buckets": {str(le): sum(1 for v in ordered if v <= le) for le in LATENCY_BUCKETS},
+            }
+        for name, values in self.counters.items():
+            out["counters"][name] = {
+                "count": len(values),
+                "sum": sum(values),
+                "min": min(values),
+                "max": max(values),
+                "mean": sum(values) / len(values),
+            }
+        return out
+
+    def to_prometheus(self):
+        """Render the recorded metrics in Prometheus text exposition format."""
+        entry = self.entry
+        lines = [
+            "# HELP vlsp_stage_seconds_total Wall time spent per pipeline stage.",
+            "# TYPE vlsp_stage_seconds_total counter",
+        ]
+        for name, (_, total, _, _) in self.stages.items():
+            lines.append(f'vlsp_stage_seconds_total{{entry="{entry}",stage="{name}"}} {total:.9f}')
+        lines += [
+            "# HELP vlsp_stage_calls_total Number of times each stage ran.",
+            "# TYPE vlsp_stage_calls_total counter",
+        ]
+        for name, (calls, _, _, _) in self.stages.items():
+            lines.append(f'vlsp_stage_calls_total{{entry="{entry}",stage="{name}"}} {calls}')
+
+        for name, values in self.histograms.items():
+            metric = f"vlsp_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for le in LATENCY_BUCKETS:
+                n = sum(1 for v in values if v <= le)
+                lines.append(f'{metric}_bucket{{entry="{entry}",le="{le}"}} {n}')
+            lines.append(f'{metric}_bucket{{entry="{entry}",le="+Inf"}} {len(values)}')
+            lines.append(f'{metric}_sum{{entry="{entry}"}} {sum(values):.9f}')
+            lines.append(f'{metric}_count{{entry="{entry}"}} {len(values)}')
+
+        for name, values in self.counters.items():
+            metric = f"vlsp_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f'{metric}_sum{{entry="{entry}"}} {sum(values)}')
+            lines.append(f'{metric}_count{{entry="{entry}"}} {len(values)}')
+
+        lines += [
+            "# HELP vlsp_peak_rss_bytes Peak resident set size of the process.",
+            "# TYPE vlsp_peak_rss_bytes gauge",
+            f'vlsp_peak_rss_bytes{{entry="{entry}"}} {_peak_rss_bytes()}',
+        ]
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path=None, prom_path=None):
+        """Write the JSON summary and/or the Prometheus text file."""
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+            print(f"Trace summary saved to {json_path}")
+        if prom_path:
+            with open(prom_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            print(f"Prometheus metrics saved to {prom_path}")
+
+
+_TRACER = NullTracer()
+_EXPORT_PATHS = (None, None)
+
+
+def get_tracer():
+    """Return the active tracer (a NullTracer when tracing is disabled)."""
+    return _TRACER
+
+
+def enable_tracing(entry: str, json_path=None, prom_path=None):
+    """Turn tracing on for this process and remember where to export it."""
+    global _TRACER, _EXPORT_PATHS
+    _TRACER = Tracer(entry)
+    _EXPORT_PATHS = (json_path, prom_path)
+    return _TRACER
+
+
+def init_tracing(entry: str, json_path=None, prom_path=None):
+    """
+    Enable tracing if an export path is given, either directly or via the
+    VLSP_TRACE_JSON / VLSP_TRACE_PROM environment variables
+    """
+    json_path = json_path or os.environ.get(ENV_TRACE_JSON)
+    prom_path = prom_path or os.environ.get(ENV_TRACE_PROM)
+    if json_path or prom_path:
+        return enable_tracing(entry, json_path, prom_path)
+    return _TRACER
+
+
+def finish_tracing():
+    """Export the active tracer to the paths given at init time."""
+    _TRACER.export(*_EXPORT_PATHS)
+
+
+def add_tracing_args(parser):
+    """Add --trace_json / --trace_prom to an argparse parser."""
+    parser.add_argument("--trace_json", type=str, default=None,
+                        help="Write a per-stage timing summary (JSON) to this path")
+    parser.add_argument("--trace_prom", type=str, default=None,
+                        help="Write metrics in Prometheus text format to this path")
+    return parser
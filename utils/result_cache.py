@@ -0,0 +1,264 @@
+"""
+Exact-match result cache shared by the retrieval entry points.
+
+Questions that repeat verbatim or differ only in casing, whitespace or
+punctuation map to the same key, so their tokenization, encoding and search
+run once. Entries live in an in-memory LRU bounded by ``max_entries`` and can
+be persisted to ``cache_dir``.
+
+Every cache is tied to a fingerprint ``<index hash>-<params hash>``: the
+index part covers the index files the results come from (size + mtime of
+``bm25_model.pkl``, ``bge.bin``, ...), the params part the search parameters.
+The persisted file is named after that fingerprint. When an index changes the
+old entries are simply not found, and files of the old index are deleted on
+the next save; files of other parameters on the same index are kept, so a
+sweep over top_n / weights keeps one cache per configuration.
+
+Usage in an entry point::
+
+    cache = build_cache(args, "search", [args.path_model], {"top_n": args.top_n})
+    results = cached_search(question_data, cache, lambda qs: search_questions(qs, ...))
+    if cache is not None:
+        cache.save()
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+import string
+import unicodedata
+from collections import OrderedDict
+
+from utils.instrumentation import get_tracer
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# Dấu câu ASCII + dấu ngoặc kép / gạch ngang hay gặp trong câu hỏi tiếng Việt
+_PUNCT = set(string.punctuation) | set("“”‘’«»…–—")
+
+
+def normalize_question(text: str) -> str:
+    """NFC, lowercase, punctuation -> space, collapse whitespace."""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = "".join(" " if ch in _PUNCT else ch for ch in text)
+    return " ".join(text.split())
+
+
+def _path_signature(path: str):
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        # Thư mục index (vd. bm25_shards): chữ ký của mọi file bên trong
+        files = sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True))
+        return [_path_signature(f) for f in files if os.path.isfile(f)]
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+def index_fingerprint(paths, params=None) -> str:
+    """
+    Fingerprint of index files and search parameters
+
+    Args:
+        paths: Index files or directories (bm25_model.pkl, bge.bin, corpus_meta.pkl, ...)
+        params: Extra JSON-serializable settings that change the results (top_n, model path, ...)
+    """
+    payload = {
+        "paths": [_path_signature(p) for p in paths if p],
+        "params": params or {},
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def cache_fingerprint(paths, params=None) -> str:
+    """'<index hash>-<params hash>' of index files and search parameters (see remove_stale_files)."""
+    return f"{index_fingerprint(paths)}-{index_fingerprint([], params)}"
+
+
+def remove_stale_files(cache_dir: str, prefix: str, fingerprint: str):
+    """
+    Delete persisted caches ``{prefix}_{fingerprint}.pkl`` of other indexes
+
+    Chỉ xóa file có phần index của fingerprint khác fingerprint hiện tại (và
+    file dạng cũ chỉ có một hash); file của tham số khác trên cùng index được
+    giữ lại.
+    """
+    index_part = fingerprint.split("-", 1)[0]
+    current = f"{prefix}_{fingerprint}.pkl"
+    pattern = re.compile(rf"{re.escape(prefix)}_([0-9a-f]{{16}})(-[0-9a-f]{{16}})?\.pkl")
+    for path in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(prefix)}_*.pkl")):
+        name = os.path.basename(path)
+        m = pattern.fullmatch(name)
+        if m and name != current and (m.group(1) != index_part or m.group(2) is None):
+            os.remove(path)
+
+
+class ResultCache:
+    """
+    LRU cache of per-question results
+
+    Args:
+        namespace: Entry point name, part of the file name on disk
+        fingerprint: cache_fingerprint of the index and parameters the results come from
+        max_entries: Maximum number of cached questions
+        cache_dir: Persist entries here (None = memory only)
+    """
+
+    def __init__(self, namespace: str, fingerprint: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 cache_dir: str = None):
+        self.namespace = namespace
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cache_dir:
+            self.load()
+
+    @property
+    def path(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{self.namespace}_{self.fingerprint}.pkl")
+
+    def key(self, question: str) -> str:
+        return normalize_question(question)
+
+    def get(self, key: str):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def load(self):
+        """Load persisted entries of this fingerprint (if any)."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with get_tracer().stage("cache_load"):
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        if data.get("fingerprint") != self.fingerprint:
+            return
+        for key, value in data["entries"][-self.max_entries:]:
+            self.entries[key] = value
+
+    def save(self):
+        """Persist entries and delete files of older indexes."""
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with get_tracer().stage("cache_save"):
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {"fingerprint": self.fingerprint, "entries": list(self.entries.items())},
+                    f, protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_path, self.path)
+            remove_stale_files(self.cache_dir, self.namespace, self.fingerprint)
+
+
+def _with_query(record, entry):
+    # Kết quả cache không gắn với qid: thay qid (và question nếu có) theo câu hỏi hiện tại
+    out = dict(record)
+    out["qid"] = entry["qid"]
+    if "question" in out:
+        out["question"] = entry["question"]
+    return out
+
+
+def cached_search(question_data, cache, search_fn):
+    """
+    Run search_fn only on questions missing from the cache
+
+    Duplicates inside question_data are searched once as well.
+
+    Args:
+        question_data: List of dicts with 'qid' and 'question'
+        cache: ResultCache or None (then search_fn(question_data) is returned as is)
+        search_fn: Callable taking a list of question dicts, returning one record per question
+
+    Returns:
+        results: One record per question, in input order
+    """
+    if cache is None:
+        return search_fn(question_data)
+
+    tracer = get_tracer()
+    results = [None] * len(question_data)
+    pending = {}
+    misses = []
+    with tracer.stage("cache_lookup"):
+        for pos, entry in enumerate(question_data):
+            key = cache.key(entry["question"])
+            if key in pending:
+                pending[key].append(pos)
+                continue
+            record = cache.get(key)
+            if record is not None:
+                results[pos] = _with_query(record, entry)
+            else:
+                pending[key] = [pos]
+                misses.append(entry)
+
+    hits = len(question_data) - len(misses)
+    tracer.count("cache_hits", hits)
+    print(f"Result cache: {hits}/{len(question_data)} questions served from cache")
+
+    if misses:
+        for entry, record in zip(misses, search_fn(misses)):
+            key = cache.key(entry["question"])
+            cache.put(key, record)
+            for pos in pending[key]:
+                results[pos] = _with_query(record, question_data[pos])
+    return results
+
+
+def add_cache_args(parser):
+    """Add --cache_dir / --cache_memory / --cache_size to an argparse parser."""
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Persist the exact-match result cache in this directory")
+    parser.add_argument("--cache_memory", action="store_true",
+                        help="Use an in-memory result cache without persisting it")
+    parser.add_argument("--cache_size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"Maximum cached questions (default: {DEFAULT_MAX_ENTRIES})")
+    return parser
+
+
+def build_cache(args, namespace: str, paths, params=None):
+    """ResultCache from add_cache_args flags, or None when caching is off."""
+    if not args.cache_dir and not args.cache_memory:
+        return None
+    return ResultCache(
+        namespace,
+        cache_fingerprint(paths, params),
+        max_entries=args.cache_size,
+        cache_dir=args.cache_dir,
+    )
@@ -0,0 +1,202 @@
+"""
+Semantic query cache keyed by embedding similarity
+
+Cache exact-match (result_cache.py) chỉ gộp các câu hỏi giống nhau sau khi
+chuẩn hóa; câu hỏi diễn đạt lại ("tôi có được phép kết hôn ..." hỏi theo chục
+cách khác nhau) vẫn bị miss. SemanticCache lưu embedding (đã normalize) của các
+câu hỏi đã trả lời trong một FAISS index nhỏ trong RAM:
+
+    - câu hỏi mới có cosine >= threshold với một câu hỏi trong cache thì dùng
+      lại kết quả đã fuse của câu hỏi đó, bỏ qua sparse search, FAISS search,
+      fusion (và rerank nếu có)
+    - tối đa max_entries câu hỏi, bỏ câu hỏi ít được dùng gần nhất (LRU)
+    - thống kê hits / misses / evictions / hit_rate và similarity trung bình
+      của các hit
+
+Embedding phải do cùng một encoder sinh ra; fingerprint (index + model + tham
+số search) nằm trong tên file khi lưu xuống đĩa, và file của index cũ được dọn
+giống result_cache.py.
+
+Usage in an entry point (embedding đã có sẵn từ bước encode)::
+
+    cache = build_semantic_cache(args, "bge_m3_hybrid", [args.index_dir], params)
+    records, sims = cache.lookup(dense_embeddings)
+    ...
+    cache.put(embedding, record, question)
+"""
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.instrumentation import get_tracer
+from utils.result_cache import DEFAULT_MAX_ENTRIES, cache_fingerprint, remove_stale_files
+
+DEFAULT_THRESHOLD = 0.95
+
+
+def _normalize(embeddings) -> np.ndarray:
+    x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return np.ascontiguousarray(x / np.maximum(norms, 1e-12))
+
+
+class SemanticCache:
+    """
+    LRU cache of fused results looked up by query-embedding cosine similarity
+
+    Args:
+        namespace: Entry point name, part of the file name on disk
+        fingerprint: cache_fingerprint of the index / model / parameters
+        threshold: Minimum cosine similarity for a hit
+        max_entries: Maximum number of cached questions
+        cache_dir: Persist entries here (None = memory only)
+    """
+
+    def __init__(self, namespace: str, fingerprint: str, threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, cache_dir: str = None):
+        self.namespace = namespace
+        self.fingerprint = fingerprint
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.index = None
+        self.entries = OrderedDict()  # id -> (question, embedding, record)
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_similarity = 0.0
+        if cache_dir:
+            self.load()
+
+    @property
+    def prefix(self):
+        return f"semantic_{self.namespace}"
+
+    @property
+    def path(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{self.prefix}_{self.fingerprint}.pkl")
+
+    def _ensure_index(self, dim: int):
+        if self.index is None:
+            import faiss
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, embeddings):
+        """
+        Nearest cached question of every embedding
+
+        Returns:
+            records: Cached record or None (miss) per embedding
+            similarities: Cosine similarity to the nearest cached question (-1 if the cache is empty)
+        """
+        x = _normalize(embeddings)
+        records = [None] * len(x)
+        sims = np.full(len(x), -1.0, dtype=np.float32)
+        if self.entries:
+            with get_tracer().stage("semantic_cache_lookup"):
+                D, I = self.index.search(x, 1)
+            for i, (sim, eid) in enumerate(zip(D[:, 0], I[:, 0])):
+                sims[i] = sim
+                if eid >= 0 and sim >= self.threshold:
+                    self.entries.move_to_end(int(eid))
+                    records[i] = self.entries[int(eid)][2]
+        n_hits = sum(r is not None for r in records)
+        self.hits += n_hits
+        self.misses += len(x) - n_hits
+        self._hit_similarity += float(sum(s for s, r in zip(sims, records) if r is not None))
+        get_tracer().count("semantic_cache_hits", n_hits)
+        return records, sims
+
+    def put(self, embedding, record, question: str = None):
+        """Add one answered question; evicts the least recently used entries beyond max_entries."""
+        x = _normalize(embedding)
+        self._ensure_index(x.shape[1])
+        eid = self._next_id
+        self._next_id += 1
+        self.index.add_with_ids(x, np.array([eid], dtype=np.int64))
+        self.entries[eid] = (question, x[0], record)
+        self._evict()
+
+    def _evict(self):
+        if len(self.entries) <= self.max_entries:
+            return
+        old = []
+        while len(self.entries) > self.max_entries:
+            eid, _ = self.entries.popitem(last=False)
+            old.append(eid)
+        self.index.remove_ids(np.array(old, dtype=np.int64))
+        self.evictions += len(old)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "mean_hit_similarity": self._hit_similarity / self.hits if self.hits else 0.0,
+            "threshold": self.threshold,
+        }
+
+    def load(self):
+        """Load persisted entries of this fingerprint (if any)."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with get_tracer().stage("cache_load"):
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        if data.get("fingerprint") != self.fingerprint:
+            return
+        for question, embedding, record in data["entries"][-self.max_entries:]:
+            self.put(embedding, record, question)
+
+    def save(self):
+        """Persist entries (LRU order) and delete files of older indexes."""
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with get_tracer().stage("cache_save"):
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"fingerprint": self.fingerprint, "entries": list(self.entries.values())},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            remove_stale_files(self.cache_dir, self.prefix, self.fingerprint)
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Semantic cache: {s['hits']}/{s['hits'] + s['misses']} hits ({s['hit_rate']:.1%}, "
+              f"threshold {s['threshold']}), {s['entries']} entries, {s['evictions']} evictions")
+
+
+def add_semantic_cache_args(parser):
+    """Add --semantic_cache / --semantic_cache_threshold / --semantic_cache_size to an argparse parser."""
+    parser.add_argument("--semantic_cache", action="store_true",
+                        help="Reuse results of paraphrased questions (cosine similarity of query embeddings)")
+    parser.add_argument("--semantic_cache_threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Minimum cosine similarity for a semantic cache hit (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--semantic_cache_size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"Maximum questions in the semantic cache (default: {DEFAULT_MAX_ENTRIES})")
+    return parser
+
+
+def build_semantic_cache(args, namespace: str, paths, params=None):
+    """SemanticCache from add_semantic_cache_args flags (persisted in --cache_dir if given), or None."""
+    if not args.semantic_cache:
+        return None
+    return SemanticCache(
+        namespace,
+        cache_fingerprint(paths, params),
+        threshold=args.semantic_cache_threshold,
+        max_entries=args.semantic_cache_size,
+        cache_dir=getattr(args, "cache_dir", None),
+    )